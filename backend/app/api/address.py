@@ -7,10 +7,17 @@ import asyncio
 import logging
 
 from app.database.database import get_db
+from app.utils.address_search_index import search_address_index, rebuild_address_search_index, FTS_TABLE
+from app.utils.admin_division_index import admin_division_index
+from app.services.geocoding_job import bulk_geocoding_job, GEOCODING_LEVELS
+from app.utils.geocoding_cache import geocoding_cache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# None = chưa kiểm tra; được set lại khi index được dựng lại
+_fts_index_ready: Optional[bool] = None
+
 # Pydantic models
 class SmartGeocodeRequest(BaseModel):
     level: str  # province, district, ward
@@ -22,6 +29,37 @@ class CoordinateUpdateRequest(BaseModel):
     latitude: float
     longitude: float
 
+def _division_list_response(key: str, nodes, include_coordinates: bool) -> Dict:
+    """Response danh sách tỉnh/huyện/xã từ index trong memory (cùng định dạng bản truy vấn DB)"""
+    items = []
+    for node in nodes:
+        item = {
+            "id": node.id,
+            "code": node.code,
+            "name": node.name,
+            "full_name": node.full_name or node.name
+        }
+        if node.level == "ward":
+            item["division_type"] = node.division_type
+        if include_coordinates:
+            item["has_coordinates"] = node.has_coordinates
+            # Chỉ include coordinates nếu có
+            if node.has_coordinates:
+                item["latitude"] = node.latitude
+                item["longitude"] = node.longitude
+        items.append(item)
+
+    if not include_coordinates:
+        return {key: items}
+
+    with_coords = sum(1 for item in items if item["has_coordinates"])
+    return {
+        key: items,
+        "total": len(items),
+        "with_coordinates": with_coords,
+        "coordinate_coverage": round((with_coords / len(items) * 100) if len(items) > 0 else 0, 1)
+    }
+
 @router.get("/test")
 async def test_address(db: Session = Depends(get_db)):
     """Test endpoint để kiểm tra database connection"""
@@ -39,6 +77,10 @@ async def get_provinces(
 ):
     """Lấy danh sách tỉnh/thành phố với tùy chọn include coordinates"""
     try:
+        nodes = admin_division_index.list_provinces()
+        if nodes is not None:
+            return _division_list_response("provinces", nodes, include_coordinates)
+
         if include_coordinates:
             # Enhanced query với coordinate info
             query = text("SELECT id, code, name, full_name, latitude, longitude FROM provinces ORDER BY name")
@@ -97,6 +139,10 @@ async def get_districts(
 ):
     """Lấy danh sách quận/huyện theo mã tỉnh với tùy chọn include coordinates"""
     try:
+        nodes = admin_division_index.list_children("province", province_code)
+        if nodes is not None:
+            return _division_list_response("districts", nodes, include_coordinates)
+
         if include_coordinates:
             # Enhanced query với coordinate info
             query = text("""
@@ -165,6 +211,10 @@ async def get_wards(
 ):
     """Lấy danh sách phường/xã theo mã quận/huyện với tùy chọn include coordinates"""
     try:
+        nodes = admin_division_index.list_children("district", district_code)
+        if nodes is not None:
+            return _division_list_response("wards", nodes, include_coordinates)
+
         if include_coordinates:
             # Enhanced query với coordinate info
             query = text("""
@@ -236,88 +286,116 @@ async def search_address(
     limit: int = Query(20, le=50, description="Số lượng kết quả tối đa"),
     db: Session = Depends(get_db)
 ):
-    """Tìm kiếm địa chỉ theo từ khóa"""
+    """Tìm kiếm địa chỉ theo từ khóa (index trong memory -> FTS5 -> LIKE)"""
     try:
-        results = []
-        search_term = f"%{q}%"
-        
-        if type in ["province", "all"]:
-            # Tìm tỉnh
-            query = text("""
-                SELECT 'province' as type, code, name, full_name, NULL as parent_code, NULL as parent_name
-                FROM provinces 
-                WHERE name LIKE :search_term OR full_name LIKE :search_term
-                ORDER BY name
-                LIMIT :limit
-            """)
-            province_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
-            
-            for row in province_results:
-                results.append({
-                    "type": row[0],
-                    "code": row[1],
-                    "name": row[2],
-                    "full_name": row[3],
-                    "display_name": row[3] or row[2]
-                })
-        
-        if type in ["district", "all"]:
-            # Tìm quận/huyện
-            query = text("""
-                SELECT 'district' as type, d.code, d.name, d.full_name, d.province_code, p.name as province_name
-                FROM districts d
-                JOIN provinces p ON d.province_code = p.code
-                WHERE d.name LIKE :search_term OR d.full_name LIKE :search_term
-                ORDER BY d.name
-                LIMIT :limit
-            """)
-            district_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
-            
-            for row in district_results:
-                results.append({
-                    "type": row[0],
-                    "code": row[1], 
-                    "name": row[2],
-                    "full_name": row[3],
-                    "parent_code": row[4],
-                    "parent_name": row[5],
-                    "display_name": f"{row[3] or row[2]}, {row[5]}"
-                })
-        
-        if type in ["ward", "all"]:
-            # Tìm phường/xã
-            query = text("""
-                SELECT 'ward' as type, w.code, w.name, w.full_name, w.district_code, d.name as district_name, p.name as province_name
-                FROM wards w
-                JOIN districts d ON w.district_code = d.code  
-                JOIN provinces p ON w.province_code = p.code
-                WHERE w.name LIKE :search_term OR w.full_name LIKE :search_term
-                ORDER BY w.name
-                LIMIT :limit
-            """)
-            ward_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
-            
-            for row in ward_results:
-                results.append({
-                    "type": row[0],
-                    "code": row[1],
-                    "name": row[2], 
-                    "full_name": row[3],
-                    "district_code": row[4],
-                    "district_name": row[5],
-                    "province_name": row[6],
-                    "display_name": f"{row[3] or row[2]}, {row[5]}, {row[6]}"
-                })
+        results = admin_division_index.search(q, type, limit)
+        if results is None:
+            raw_conn = _get_search_connection(db)
+            results = search_address_index(raw_conn, q, type, limit) if raw_conn is not None else None
+        if results is not None:
+            return {
+                "query": q,
+                "total": len(results),
+                "results": results
+            }
         
-        return {
-            "query": q,
-            "total": len(results),
-            "results": results[:limit]
-        }
+        return _search_address_like(db, q, type, limit)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _get_search_connection(db: Session):
+    """Kết nối sqlite3 gốc nếu index FTS5 đã sẵn sàng, None nếu không dùng được"""
+    global _fts_index_ready
+    if db.get_bind().dialect.name != "sqlite":
+        return None
+    
+    raw_conn = db.connection().connection.driver_connection
+    if _fts_index_ready is None:
+        _fts_index_ready = raw_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)
+        ).fetchone() is not None
+    return raw_conn if _fts_index_ready else None
+
+def _search_address_like(db: Session, q: str, type: Optional[str], limit: int) -> Dict:
+    """Tìm kiếm bằng LIKE trên 3 bảng (khi không có index FTS5)"""
+    results = []
+    search_term = f"%{q}%"
+    
+    if type in ["province", "all"]:
+        # Tìm tỉnh
+        query = text("""
+            SELECT 'province' as type, code, name, full_name, NULL as parent_code, NULL as parent_name
+            FROM provinces 
+            WHERE name LIKE :search_term OR full_name LIKE :search_term
+            ORDER BY name
+            LIMIT :limit
+        """)
+        province_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
+        
+        for row in province_results:
+            results.append({
+                "type": row[0],
+                "code": row[1],
+                "name": row[2],
+                "full_name": row[3],
+                "display_name": row[3] or row[2]
+            })
+    
+    if type in ["district", "all"]:
+        # Tìm quận/huyện
+        query = text("""
+            SELECT 'district' as type, d.code, d.name, d.full_name, d.province_code, p.name as province_name
+            FROM districts d
+            JOIN provinces p ON d.province_code = p.code
+            WHERE d.name LIKE :search_term OR d.full_name LIKE :search_term
+            ORDER BY d.name
+            LIMIT :limit
+        """)
+        district_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
+        
+        for row in district_results:
+            results.append({
+                "type": row[0],
+                "code": row[1], 
+                "name": row[2],
+                "full_name": row[3],
+                "parent_code": row[4],
+                "parent_name": row[5],
+                "display_name": f"{row[3] or row[2]}, {row[5]}"
+            })
+    
+    if type in ["ward", "all"]:
+        # Tìm phường/xã
+        query = text("""
+            SELECT 'ward' as type, w.code, w.name, w.full_name, w.district_code, d.name as district_name, p.name as province_name
+            FROM wards w
+            JOIN districts d ON w.district_code = d.code  
+            JOIN provinces p ON w.province_code = p.code
+            WHERE w.name LIKE :search_term OR w.full_name LIKE :search_term
+            ORDER BY w.name
+            LIMIT :limit
+        """)
+        ward_results = db.execute(query, {"search_term": search_term, "limit": limit}).fetchall()
+        
+        for row in ward_results:
+            results.append({
+                "type": row[0],
+                "code": row[1],
+                "name": row[2], 
+                "full_name": row[3],
+                "district_code": row[4],
+                "district_name": row[5],
+                "province_name": row[6],
+                "display_name": f"{row[3] or row[2]}, {row[5]}, {row[6]}"
+            })
+    
+    return {
+        "query": q,
+        "total": len(results),
+        "results": results[:limit]
+    }
+
 @router.get("/full-address")
 async def get_full_address(
     province_code: Optional[str] = None,
@@ -424,8 +502,65 @@ async def get_address_stats(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/search-index/rebuild")
+async def rebuild_search_index(db: Session = Depends(get_db)):
+    """Dựng lại index tìm kiếm FTS5 (sau khi sửa dữ liệu địa chỉ trực tiếp trong DB)"""
+    global _fts_index_ready
+    if db.get_bind().dialect.name != "sqlite":
+        raise HTTPException(status_code=400, detail="Index FTS5 chỉ hỗ trợ SQLite")
+    
+    try:
+        raw_conn = db.connection().connection.driver_connection
+        result = rebuild_address_search_index(raw_conn)
+        _fts_index_ready = None
+        return {"success": True, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/index/reload")
+async def reload_division_index():
+    """Build lại index tỉnh/huyện/xã trong memory (gọi sau khi import dữ liệu địa chỉ)"""
+    try:
+        stats = await asyncio.to_thread(admin_division_index.load)
+        return {"success": True, **stats}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/index/stats")
+async def get_division_index_stats():
+    """Thống kê index trong memory: số node, bộ nhớ, thời gian build"""
+    return admin_division_index.get_stats()
+
+@router.get("/reverse")
+async def reverse_lookup(
+    lat: float = Query(..., ge=-90, le=90, description="Vĩ độ"),
+    lng: float = Query(..., ge=-180, le=180, description="Kinh độ"),
+):
+    """Tọa độ -> xã/huyện/tỉnh gần nhất (theo tâm đơn vị trong index memory)"""
+    if not admin_division_index.is_loaded:
+        raise HTTPException(status_code=503, detail="Index địa chỉ chưa được load")
+    match = admin_division_index.locate(lat, lng)
+    if match is None:
+        return {"success": False, "data": None}
+    data = {"level": match["level"], "distance_km": match["distance_km"]}
+    for level in ("province", "district", "ward"):
+        node = match[level]
+        data[level] = {"id": node.id, "code": node.code, "name": node.name, "full_name": node.full_name} if node else None
+    return {"success": True, "data": data}
+
 # ===== SMART COORDINATE ENDPOINTS =====
 
+@router.get("/geocode-cache/stats")
+async def get_geocode_cache_stats():
+    """Thống kê cache tọa độ của worker này: hit/miss, số entry, invalidation"""
+    return geocoding_cache.get_stats()
+
+@router.post("/geocode-cache/clear")
+async def clear_geocode_cache():
+    """Xóa cache tọa độ ở mọi worker (VD: sau khi sửa tọa độ trực tiếp trong DB)"""
+    await asyncio.to_thread(geocoding_cache.clear)
+    return {"success": True, **geocoding_cache.get_stats()}
+
 @router.post("/smart-geocode")
 async def smart_geocode(request: SmartGeocodeRequest, db: Session = Depends(get_db)):
     """Smart geocoding: Ưu tiên database -> Google Maps -> Save to database"""
@@ -436,24 +571,21 @@ async def smart_geocode(request: SmartGeocodeRequest, db: Session = Depends(get_
         
         table_name = f"{request.level}s"
         
-        # Kiểm tra trong database trước (trừ khi force_refresh)
+        # Import here to avoid circular import
+        from app.services.geocoding_service import geocoding_service
+        
+        # Kiểm tra cache/database trước (trừ khi force_refresh)
         if not request.force_refresh:
-            query = text(f"""
-                SELECT code, name, full_name, latitude, longitude 
-                FROM {table_name} 
-                WHERE code = :code
-            """)
-            result = db.execute(query, {"code": request.code}).fetchone()
-            
-            if result and result[3] is not None and result[4] is not None:
+            cached = await geocoding_service.get_coordinates_from_cache_or_db(request.level, request.code, db)
+            if cached:
                 # Có tọa độ rồi, trả về luôn
-                logger.info(f"Sử dụng tọa độ từ database cho {request.level}:{request.code}")
+                logger.debug("Sử dụng tọa độ có sẵn cho %s:%s", request.level, request.code)
                 return {
                     "success": True,
                     "data": {
-                        "latitude": float(result[3]),
-                        "longitude": float(result[4]),
-                        "address": request.full_address or result[2] or result[1],
+                        "latitude": cached["latitude"],
+                        "longitude": cached["longitude"],
+                        "address": request.full_address or cached.get("full_name") or cached.get("name"),
                         "source": "database",
                         "from_cache": True
                     }
@@ -469,9 +601,6 @@ async def smart_geocode(request: SmartGeocodeRequest, db: Session = Depends(get_
             
             request.full_address = (result[1] or result[0]) + ", Việt Nam"
         
-        # Import here to avoid circular import
-        from app.services.geocoding_service import geocoding_service
-        
         # Gọi Google Maps thông qua smart_geocode
         geocode_result = await geocoding_service.smart_geocode(
             level=request.level,
@@ -555,6 +684,8 @@ async def _update_coordinates(level: str, code: str, request: CoordinateUpdateRe
             "code": code
         })
         db.commit()
+        admin_division_index.update_coordinates(level, code, request.latitude, request.longitude)
+        geocoding_cache.invalidate(level, code, db)
 
         logger.info(f"Cập nhật tọa độ cho {level} {code}: {request.latitude}, {request.longitude}")
         
@@ -610,6 +741,36 @@ async def get_coordinate_stats(db: Session = Depends(get_db)):
         logger.error(f"Lỗi get_coordinate_stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/coordinates/geocode-job")
+async def start_geocode_job(
+    levels: Optional[List[str]] = Query(None, description="Các cấp cần geocode: province, district, ward (mặc định tất cả)"),
+    restart: bool = Query(False, description="Bỏ checkpoint, chạy lại từ đầu"),
+    limit: Optional[int] = Query(None, ge=1, description="Dừng sau N đơn vị (chạy thử)"),
+    workers: Optional[int] = Query(None, ge=1, le=32, description="Số request song song"),
+    rate_per_second: Optional[float] = Query(None, gt=0, description="Giới hạn request/giây"),
+    db: Session = Depends(get_db)
+):
+    """Chạy nền job geocode tất cả tỉnh/huyện/xã chưa có tọa độ (tiếp tục từ checkpoint nếu có)"""
+    if levels and any(level not in GEOCODING_LEVELS for level in levels):
+        raise HTTPException(status_code=400, detail="levels phải là province, district hoặc ward")
+    try:
+        bulk_geocoding_job.start(levels=levels, restart=restart, limit=limit,
+                                 max_workers=workers, rate_per_second=rate_per_second)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "data": bulk_geocoding_job.get_status(db)}
+
+@router.get("/coordinates/geocode-job")
+async def get_geocode_job_status(db: Session = Depends(get_db)):
+    """Trạng thái job geocode: tiến độ, checkpoint, tốc độ (đơn vị/giây), số còn thiếu theo cấp"""
+    return {"success": True, "data": bulk_geocoding_job.get_status(db)}
+
+@router.post("/coordinates/geocode-job/stop")
+async def stop_geocode_job():
+    """Dừng job sau lô hiện tại; lần chạy sau tiếp tục từ checkpoint"""
+    await asyncio.to_thread(bulk_geocoding_job.stop)
+    return {"success": True, "data": bulk_geocoding_job.get_status()}
+
 @router.get("/coordinates/missing")
 async def get_missing_coordinates(
     level: str = Query("province", description="Cấp: province, district, ward"),
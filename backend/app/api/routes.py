@@ -1,29 +1,49 @@
 # backend/app/api/routes.py
 
 from fastapi import APIRouter, HTTPException, Depends, Form, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from typing import List, Optional
 from datetime import datetime
+import asyncio
+import json
+import logging
+import time
 
 # Import database và models
-from app.database.database import get_db
+from app.database.database import get_db, SessionLocal, engine
+from app.database.engine_config import get_engine_info
+from app.config.settings import settings
 from app.database.crud import price_config_crud, trip_crud, settings_crud
 from app.models import models
 from app.models.schemas import (
     PriceConfig, PriceConfigCreate, PriceConfigUpdate,
     TierPriceCalculationResponse,TierPriceCalculationRequest,TierPriceConfigUpdate,TierPriceConfigCreate,TierPriceConfig,
-    PriceTier,TripCalculationRequest,
+    PriceTier,TripCalculationRequest,BatchTripCalculationRequest,
     BookingRequest, BookingResponse,
     Trip, FixedPriceRoute, FixedPriceRouteCreate, FixedPriceRouteUpdate
 )
 from app.crud.tier_pricing import tier_pricing_crud
 from app.crud.fixed_price_routes import fixed_price_routes_crud
-from app.utils.tier_calculator import TierPriceCalculator
+from app.utils.fixed_price_matcher import fixed_price_route_matcher, AdminKey
+from app.utils.admin_division_index import admin_division_index
 from app.utils.price_calculator import PriceCalculator
+from app.utils.route_cache import route_distance_cache
+from app.utils.trip_log_writer import trip_log_writer
+from app.utils.pricing_snapshot import pricing_snapshot_store, PricingSnapshot, PRICING_SETTING_KEYS
+from app.utils.tier_calculator import tier_calculator_cache
+from app.utils.distance_providers import get_distance_provider_chain, chunk_matrix_request
+from app.utils.haversine import enhanced_haversine
+from app.utils.circuit_breaker import circuit_breakers
+from app.utils.google_maps_calculator import google_maps_client_registry
 from app.utils.simple_email_service import simple_email_service
 from app.utils.telegram_service import telegram_service
+from app.utils.notification_outbox import enqueue_notifications, notification_dispatcher
+from app.utils.metrics import QUOTE_STAGE_DURATION
+from app.utils.trip_repricing import build_calculator, reprice_trips
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -56,7 +76,7 @@ async def calculate_trip_price(
         )
         
         # Tính toán
-        result = calculator.calculate_trip(request)
+        result = await calculator.calculate_trip_async(request)
         
         # Lưu vào database (nếu cần)
         trip_data = {
@@ -71,7 +91,7 @@ async def calculate_trip_price(
         }
         
         # Tạo trip record
-        db_trip = trip_crud.create_trip(db, trip_data)
+        trip_crud.log_trip(db, trip_data)
         
         return result
         
@@ -120,7 +140,7 @@ async def create_booking(
 ):
     """Tạo đặt chuyến và gửi email thông báo cho admin"""
     try:
-        print(f"📝 Creating booking with frontend calculated price...")
+        logger.debug("📝 Creating booking with frontend calculated price...")
         
         # Kiểm tra nếu frontend đã truyền giá tính sẵn
         if hasattr(booking, 'calculated_price') and booking.calculated_price and booking.calculated_price > 0:
@@ -129,12 +149,12 @@ async def create_booking(
             distance_km = getattr(booking, 'distance_km', 0)
             duration_minutes = getattr(booking, 'duration_minutes', 0)
             
-            print(f"✅ Using frontend calculated price: {final_price} VND")
-            print(f"   Distance: {distance_km} km")
-            print(f"   Duration: {duration_minutes} minutes")
+            logger.debug("✅ Using frontend calculated price: %s VND", final_price)
+            logger.debug("   Distance: %s km", distance_km)
+            logger.debug("   Duration: %s minutes", duration_minutes)
         else:
             # FALLBACK: Tính giá lại nếu frontend không truyền
-            print("⚠️ Frontend price not provided, calculating on backend...")
+            logger.debug("⚠️ Frontend price not provided, calculating on backend...")
             
             # Lấy cấu hình giá
             config = price_config_crud.get_config(db, "default")
@@ -166,12 +186,9 @@ async def create_booking(
             final_price = price_info["final_price"]
             duration_minutes = (distance_km / 40) * 60  # 40km/h average speed
             
-            print(f"✅ Backend calculated price: {final_price} VND")
+            logger.debug("✅ Backend calculated price: %s VND", final_price)
         
         
-        print(f"aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
-        print(f"final_price: {final_price}")
-        print(f"distance_km: {"frontend_calculated" if hasattr(booking, 'calculated_price') and booking.calculated_price else "backend_calculated"}")
         # Tạo booking record
         booking_data = {
             "customer_name": booking.customer_name,
@@ -195,13 +212,12 @@ async def create_booking(
             "config_used": "frontend_calculated" if hasattr(booking, 'calculated_price') and booking.calculated_price else "backend_calculated"
         }
 
-        print(f"booking_data: {booking_data}")
+        logger.debug("booking_data: %s", booking_data)
 
         # Lưu vào database
         db_booking = models.Booking(**booking_data)
         db.add(db_booking)
-        db.commit()
-        db.refresh(db_booking)
+        db.flush()
         
         # Chuẩn bị dữ liệu cho email
         vehicle_type_names = {
@@ -227,56 +243,18 @@ async def create_booking(
             "notes": db_booking.notes
         }
         
-        # Gửi thông báo cho admin (email + Telegram song song)
-        email_sent = False
-        telegram_sent = False
-        
-        # Gửi email thông báo
-        try:
-            email_sent = simple_email_service.send_new_booking_notification(email_data)
-            print(f"📧 Email notification: {'✅ sent' if email_sent else '❌ failed'}")
-        except Exception as e:
-            print(f"📧 Email notification error: {e}")
-        
-        # Gửi Telegram thông báo
-        try:
-            # Lấy config Telegram từ database
-            bot_token_setting = settings_crud.get_setting(db, "telegram_bot_token")
-            chat_id_setting = settings_crud.get_setting(db, "telegram_chat_id")
-            
-            if bot_token_setting and chat_id_setting:
-                bot_token = bot_token_setting.value
-                chat_id = chat_id_setting.value
-                
-                # Cấu hình service
-                telegram_service.set_credentials(bot_token, chat_id)
-                
-                # Gửi thông báo
-                telegram_result = telegram_service.send_new_booking_notification(email_data)
-                telegram_sent = telegram_result.get("success", False)
-                print(f"📱 Telegram notification: {'✅ sent' if telegram_sent else '❌ failed'}")
-            else:
-                print("📱 Telegram notification: ⚠️ chưa cấu hình bot token/chat ID")
-        except Exception as e:
-            print(f"📱 Telegram notification error: {e}")
-        
-        # Tạo response message
-        base_message = "Đặt chuyến thành công!"
-        notifications = []
-        if email_sent:
-            notifications.append("📧 Email sent")
-        if telegram_sent:
-            notifications.append("📱 Telegram sent")
-        
-        if notifications:
-            notification_msg = f" | {' & '.join(notifications)}"
-        else:
-            notification_msg = " | ⚠️ Không thể gửi thông báo (sẽ xử lý thủ công)"
+        # Thông báo cho admin (email + Telegram) ghi vào outbox cùng transaction với booking,
+        # dispatcher nền sẽ gửi và tự thử lại nếu lỗi
+        enqueue_notifications(db, "new_booking", email_data, booking_id=db_booking.id)
+        db.commit()
+        db.refresh(db_booking)
+        notification_dispatcher.wake()
+        logger.info("📨 Booking #%s: notifications queued", db_booking.id)
         
         return {
             "success": True,
             "booking_id": db_booking.id,
-            "message": base_message + notification_msg,
+            "message": "Đặt chuyến thành công! | 📨 Đang gửi thông báo cho nhà xe",
             "booking_info": {
                 "customer_name": db_booking.customer_name,
                 "customer_phone": db_booking.customer_phone,
@@ -291,8 +269,8 @@ async def create_booking(
                 "travel_time": db_booking.travel_time,
                 "booking_status": db_booking.booking_status
             },
-            "email_notification": "sent" if email_sent else "failed",
-            "telegram_notification": "sent" if telegram_sent else "failed",
+            "email_notification": "queued",
+            "telegram_notification": "queued",
             "price_source": "frontend_calculated" if hasattr(booking, 'calculated_price') and booking.calculated_price else "backend_calculated"
         }
 
@@ -365,7 +343,9 @@ async def get_price_config(config_name: str, db: Session = Depends(get_db)):
 @router.post("/price-configs")
 async def create_price_config(config: PriceConfigCreate, db: Session = Depends(get_db)):
     """Tạo cấu hình giá mới"""
-    return price_config_crud.create_config(db, config)
+    db_config = price_config_crud.create_config(db, config)
+    pricing_snapshot_store.invalidate(db)
+    return db_config
 
 @router.put("/price-configs/{config_name}")
 async def update_price_config(
@@ -377,6 +357,7 @@ async def update_price_config(
     updated_config = price_config_crud.update_config(db, config_name, config_update)
     if not updated_config:
         raise HTTPException(status_code=404, detail="Không tìm thấy cấu hình")
+    pricing_snapshot_store.invalidate(db)
     return updated_config
 
 # API quản lý lịch sử chuyến đi
@@ -385,6 +366,29 @@ async def get_trips(skip: int = 0, limit: int = 100, db: Session = Depends(get_d
     """Lấy lịch sử các chuyến đi"""
     return trip_crud.get_trips(db, skip, limit)
 
+@router.post("/trips/reprice")
+async def reprice_trips_endpoint(
+    config: Optional[str] = Query(None, description='VD: "tier:standard" - bỏ trống = cấu hình đang dùng'),
+    apply: bool = Query(False, description="Ghi giá mới vào trips (mặc định chỉ thống kê what-if)"),
+    only_missing: bool = Query(False, description="Chỉ backfill các chuyến chưa có giá"),
+    limit: Optional[int] = Query(None, ge=1),
+    chunk_size: int = Query(50000, ge=100, le=500000),
+    db: Session = Depends(get_db)
+):
+    """Tính lại giá lịch sử trips theo 1 cấu hình (vector hóa bằng NumPy theo từng chunk)"""
+    if config:
+        config_type, config_name, config_data, error = pricing_snapshot_store.load_config(db, config)
+        if error:
+            raise HTTPException(status_code=404, detail=error)
+    else:
+        config_type, config_name, config_data, _ = await _resolve_pricing_config(db)
+    
+    calculator = build_calculator(config_type, config_data)
+    return await asyncio.to_thread(
+        reprice_trips, db, calculator, f"{config_type}:{config_name}",
+        chunk_size=chunk_size, apply=apply, only_missing=only_missing, limit=limit
+    )
+
 # Import Google Maps calculator
 try:
     from utils.google_maps_calculator import GoogleMapsDistanceCalculator
@@ -407,7 +411,7 @@ async def test_google_maps():
             }
         
         # Test Google Maps
-        print("🧪 Testing Google Maps connection...")
+        logger.info("🧪 Testing Google Maps connection...")
         gmaps_calc = GoogleMapsDistanceCalculator()
         
         if not gmaps_calc.has_api_key:
@@ -431,7 +435,7 @@ async def test_google_maps():
         }
         
     except Exception as e:
-        print(f"❌ Error in test_google_maps endpoint: {e}")
+        logger.error("❌ Error in test_google_maps endpoint: %s", e)
         return {
             "status": "endpoint_error",
             "message": f"Lỗi trong endpoint test: {str(e)}",
@@ -554,67 +558,13 @@ async def detailed_google_maps_test(db: Session = Depends(get_db)):
 
 @router.get("/active-config")
 async def get_active_config(db: Session = Depends(get_db)):
-    """Lấy cấu hình tính giá đang active"""
+    """Lấy cấu hình tính giá đang active (từ pricing snapshot trong memory)"""
     try:
-        # Lấy setting active_pricing_config
-        active_config_setting = settings_crud.get_setting(db, "active_pricing_config")
-        
-        # Lấy setting use_fixed_price
-        use_fixed_price_setting = settings_crud.get_setting(db, "use_fixed_price")
-        use_fixed_price = use_fixed_price_setting.value == "true" if use_fixed_price_setting else False
-        
-        if not active_config_setting:
-            # Mặc định là simple pricing
-            return {
-                "type": "simple",
-                "config_name": "default",
-                "config": None,
-                "use_fixed_price": use_fixed_price
-            }
-        
-        config_value = active_config_setting.value
-        
-        # Parse config value: "simple:default" hoặc "tier:standard"
-        if ":" in config_value:
-            config_type, config_name = config_value.split(":", 1)
-        else:
-            config_type = "simple"
-            config_name = config_value
+        snapshot = pricing_snapshot_store.get(db)
+        if snapshot.error:
+            raise HTTPException(status_code=404, detail=snapshot.error)
         
-        if config_type == "tier":
-            # Lấy tier config
-            tier_config = tier_pricing_crud.get_config(db, config_name)
-            if not tier_config:
-                raise HTTPException(status_code=404, detail=f"Tier config '{config_name}' không tồn tại")
-            
-            return {
-                "type": "tier",
-                "config_name": config_name,
-                "use_fixed_price": use_fixed_price,
-                "config": {
-                    "name": tier_config.name,
-                    "base_price": tier_config.base_price,
-                    "tiers": tier_config.tiers
-                }
-            }
-        else:
-            # Lấy simple config
-            simple_config = price_config_crud.get_config(db, config_name)
-            if not simple_config:
-                raise HTTPException(status_code=404, detail=f"Simple config '{config_name}' không tồn tại")
-            
-            return {
-                "type": "simple", 
-                "config_name": config_name,
-                "use_fixed_price": use_fixed_price,
-                "config": {
-                    "name": simple_config.config_name,
-                    "base_price": simple_config.base_price,
-                    "price_per_km": simple_config.price_per_km,
-                    "min_price": simple_config.min_price,
-                    "max_price": simple_config.max_price
-                }
-            }
+        return snapshot.as_active_config()
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi lấy active config: {str(e)}")
@@ -647,6 +597,8 @@ async def set_active_config(
         # Save fixed price setting
         settings_crud.set_setting(db, "use_fixed_price", "true" if use_fixed_price else "false")
         
+        pricing_snapshot_store.invalidate(db)
+        
         return {
             "message": f"Đã set active config: {config_type}:{config_name}",
             "type": config_type,
@@ -814,6 +766,62 @@ async def set_active_config(
 #     except Exception as e:
 #         raise HTTPException(status_code=500, detail=f"Lỗi tính giá enhanced: {str(e)}")
 
+async def _resolve_pricing_config(db: Session, snapshot: Optional[PricingSnapshot] = None):
+    """
+    Lấy active config (type, name, config dict, snapshot) từ pricing snapshot, fallback về simple:default.
+    Với config tier, dùng snapshot.tier_calculator() để lấy calculator đã biên dịch sẵn.
+    Truyền snapshot đã đọc trong request để không đọc lại (giá cố định và config dùng cùng 1 phiên bản).
+    """
+    if snapshot is None:
+        snapshot = pricing_snapshot_store.get(db)
+    if snapshot.error:
+        raise HTTPException(status_code=404, detail=snapshot.error)
+    
+    config_type, config_name, config_data = snapshot.effective_config()
+    if not config_data:
+        raise HTTPException(status_code=404, detail="Không tìm thấy cấu hình giá default")
+    
+    return config_type, config_name, config_data, snapshot
+
+def _find_fixed_price_route(db: Session, request: TripCalculationRequest) -> Optional[models.FixedPriceRoute]:
+    """Tìm tuyến giá cố định cho request: ưu tiên theo ID hành chính, sau đó theo text địa chỉ"""
+    return _find_fixed_price_routes(db, [request])[0]
+
+def _admin_key(request: TripCalculationRequest) -> Optional[AdminKey]:
+    """ID hành chính 2 đầu chuyến: lấy từ request, nếu thiếu thì reverse lookup từ tọa độ"""
+    if request.from_province_id and request.to_province_id:
+        return (request.from_province_id, request.from_district_id, request.from_ward_id,
+                request.to_province_id, request.to_district_id, request.to_ward_id)
+    if None in (request.from_lat, request.from_lng, request.to_lat, request.to_lng):
+        return None
+    from_ids = admin_division_index.locate_ids(request.from_lat, request.from_lng)
+    to_ids = admin_division_index.locate_ids(request.to_lat, request.to_lng) if from_ids else None
+    return from_ids + to_ids if to_ids else None
+
+def _find_fixed_price_routes(db: Session, requests: List[TripCalculationRequest]) -> List[Optional[models.FixedPriceRoute]]:
+    """
+    Bản nhiều request của _find_fixed_price_route (cùng thứ tự với requests):
+    tra theo ID hành chính (gửi kèm hoặc suy ra từ tọa độ) cho cả lô trong 1 lượt,
+    các chuyến chưa khớp thử khớp theo text địa chỉ
+    """
+    routes = [None] * len(requests)
+    keyed = [(index, key) for index, key in enumerate(map(_admin_key, requests)) if key]
+    
+    if keyed:
+        logger.debug("🔍 Searching fixed price by ID for %s trips", len(keyed))
+        matched = fixed_price_routes_crud.find_matching_routes(db, [key for _, key in keyed])
+        for (index, _), route in zip(keyed, matched):
+            routes[index] = route
+    
+    for index, request in enumerate(requests):
+        if routes[index] is None and request.from_address and request.to_address:
+            logger.debug("🔍 Searching fixed price by text: %s -> %s", request.from_address, request.to_address)
+            routes[index] = fixed_price_routes_crud.find_matching_route_by_text(
+                db, request.from_address, request.to_address
+            )
+    
+    return routes
+
 @router.post("/calculate-price-enhanced")
 async def calculate_price_enhanced(
     request: TripCalculationRequest,
@@ -821,18 +829,19 @@ async def calculate_price_enhanced(
 ):
     """Tính giá nâng cao với kiểm tra giá cố định và fallback mechanism"""
     try:
-        print(f"🚀 Enhanced calculation started for: {request.from_address} -> {request.to_address}")
+        logger.debug("🚀 Enhanced calculation started for: %s -> %s", request.from_address, request.to_address)
 
         # QUAN TRỌNG: Tính khoảng cách nếu chưa có
         distance_km = request.distance_km
         duration_minutes = request.duration_minutes
         calculation_method = "provided"
         route_info = {}
+        from_cache = False
         
         # Nếu có tọa độ nhưng chưa có distance, hoặc muốn tính lại chính xác
         if ((request.from_lat and request.from_lng and request.to_lat and request.to_lng) and 
             (distance_km is None or distance_km <= 0)):
-            print("🎯 Calculating distance from coordinates...")
+            logger.debug("🎯 Calculating distance from coordinates...")
             
             # Tạo PriceCalculator để tính khoảng cách
             temp_calculator = PriceCalculator(
@@ -844,50 +853,35 @@ async def calculate_price_enhanced(
             )
             
             # Tính khoảng cách với smart calculation (Google Maps + fallback)
-            distance_result = temp_calculator.calculate_distance_and_duration(
-                request.from_lat, request.from_lng,
-                request.to_lat, request.to_lng
-            )
+            with QUOTE_STAGE_DURATION.time(stage="distance"):
+                distance_result = await temp_calculator.calculate_distance_and_duration_async(
+                    request.from_lat, request.from_lng,
+                    request.to_lat, request.to_lng,
+                    use_cache=request.use_cache is not False
+                )
             
             distance_km = distance_result["distance_km"]
             duration_minutes = distance_result["duration_minutes"]
             calculation_method = distance_result.get("method", "unknown")
             route_info = distance_result.get("route_info", {})
+            from_cache = distance_result.get("from_cache", False)
             
-            print(f"✅ Distance calculated: {distance_km} km via {calculation_method}")
+            logger.debug("✅ Distance calculated: %s km via %s", distance_km, calculation_method)
         
-        # Kiểm tra setting có sử dụng giá cố định không
-        use_fixed_price_setting = settings_crud.get_setting(db, "use_fixed_price")
-        use_fixed_price = use_fixed_price_setting and use_fixed_price_setting.value == "true"
+        # Đọc pricing snapshot 1 lần cho cả request: setting giá cố định + active config
+        with QUOTE_STAGE_DURATION.time(stage="config_load"):
+            pricing_snapshot = pricing_snapshot_store.get(db)
+        use_fixed_price = pricing_snapshot.use_fixed_price
         
         # Nếu bật tính năng giá cố định, thử tìm giá cố định trước
         fixed_price_result = None
         if use_fixed_price:
             try:
-                route = None
-                
-                # Ưu tiên tìm theo text address (cho hệ thống cũ dùng tọa độ)
-                if hasattr(request, 'from_address') and hasattr(request, 'to_address') and request.from_address and request.to_address:
-                    print(f"🔍 Searching fixed price by text: {request.from_address} -> {request.to_address}")
-                    route = fixed_price_routes_crud.find_matching_route_by_text(
-                        db, request.from_address, request.to_address
-                    )
-                
-                # Nếu không tìm thấy theo text, thử tìm theo ID (cho hệ thống mới)
-                if not route and hasattr(request, 'from_province_id') and hasattr(request, 'to_province_id') and request.from_province_id and request.to_province_id:
-                    print(f"🔍 Searching fixed price by ID: {request.from_province_id} -> {request.to_province_id}")
-                    route = fixed_price_routes_crud.find_matching_route(
-                        db, 
-                        request.from_province_id, 
-                        request.to_province_id,
-                        getattr(request, 'from_district_id', None),
-                        getattr(request, 'to_district_id', None),
-                        getattr(request, 'from_ward_id', None),
-                        getattr(request, 'to_ward_id', None)
-                    )
+                with QUOTE_STAGE_DURATION.time(stage="fixed_price_lookup"):
+                    route = _find_fixed_price_route(db, request)
                 
                 if route:
-                    print(f"✅ Found fixed price route: {route.fixed_price} VND")
+                    logger.debug("✅ Found fixed price route: %s VND", route.fixed_price)
                     fixed_price_result = {
                         "distance_km": request.distance_km or distance_km,
                         "duration_minutes": request.duration_minutes or duration_minutes,
@@ -914,47 +908,32 @@ async def calculate_price_enhanced(
                             "calculated_price": fixed_price_result["calculated_price"],
                             "config_used": f"fixed_price:route_{route.id}"
                         }
-                        trip_crud.create_trip(db, trip_data)
+                        with QUOTE_STAGE_DURATION.time(stage="trip_persistence"):
+                            trip_crud.log_trip(db, trip_data)
                     except Exception as trip_error:
-                        print(f"Warning: Could not save fixed price trip: {trip_error}")
+                        logger.warning("⚠️ Could not save fixed price trip: %s", trip_error)
                     
                     return fixed_price_result
                     
             except Exception as fixed_price_error:
-                print(f"Warning: Fixed price lookup failed: {fixed_price_error}")
+                logger.warning("⚠️ Fixed price lookup failed: %s", fixed_price_error)
         
         # Nếu không tìm thấy giá cố định, tiếp tục với logic tính giá bình thường
-        print("🔄 No fixed price found, using normal calculation...")
-        
-        # Lấy active config
-        active_config_response = await get_active_config(db)
-        config_type = active_config_response["type"]
-        config_name = active_config_response["config_name"]
-        config_data = active_config_response["config"]
-        
-        # Fallback nếu không có config
-        if not config_data:
-            config_data = price_config_crud.get_config(db, "default")
-            if not config_data:
-                raise HTTPException(status_code=404, detail="Không tìm thấy cấu hình giá default")
-            config_data = {
-                "base_price": config_data.base_price,
-                "price_per_km": config_data.price_per_km,
-                "min_price": config_data.min_price,
-                "max_price": config_data.max_price
-            }
-            config_type = "simple"
-            config_name = "default"
+        logger.debug("🔄 No fixed price found, using normal calculation...")
+        
+        # Lấy active config từ snapshot đã đọc ở trên
+        config_type, config_name, config_data, snapshot = await _resolve_pricing_config(db, pricing_snapshot)
         
         # Validate distance cuối cùng
         if distance_km is None or distance_km <= 0:
             raise HTTPException(status_code=400, detail="Không thể tính được khoảng cách. Vui lòng cung cấp tọa độ hợp lệ.")
         
         # Tính giá theo loại config
+        pricing_started = time.perf_counter()
         if config_type == "tier":
             # Sử dụng tier pricing
-            calculator = TierPriceCalculator(config_data["base_price"], config_data["tiers"])
-            result = calculator.calculate_price(distance_km)
+            calculator = snapshot.tier_calculator()
+            result = calculator.calculate_price(distance_km, include_breakdown=request.include_breakdown is not False)
             
             # Thêm thông tin bổ sung
             result.update({
@@ -1013,11 +992,12 @@ async def calculate_price_enhanced(
                     request.to_address or 'Điểm B'
                 )
                 
-                result = calculator.calculate_trip(temp_request)
+                result = await calculator.calculate_trip_async(temp_request)
                 result.update({
                     "config_type": "simple",
                     "config_name": config_name
                 })
+        QUOTE_STAGE_DURATION.observe(time.perf_counter() - pricing_started, stage="pricing")
         
         # Lưu trip vào database
         try:
@@ -1033,27 +1013,270 @@ async def calculate_price_enhanced(
                 "calculated_price": result.get("total_price") or result.get("calculated_price"),
                 "config_used": f"{config_type}:{config_name}"
             }
-            trip_crud.create_trip(db, trip_data)
-            print("✅ Trip saved to database")
+            with QUOTE_STAGE_DURATION.time(stage="trip_persistence"):
+                queued = trip_crud.log_trip(db, trip_data)
+            if queued:
+                logger.debug("✅ Trip queued for saving")
+            else:
+                logger.debug("✅ Trip saved to database")
         except Exception as trip_error:
-            print(f"⚠️ Warning: Could not save trip: {trip_error}")
+            logger.warning("⚠️ Could not save trip: %s", trip_error)
         
         # Thêm metadata
         result["metadata"] = {
             "calculation_method": calculation_method,
             "has_fallback": True,
-            "google_maps_attempted": True,
+            "google_maps_attempted": not from_cache,
+            "from_cache": from_cache,
             "distance_source": "calculated" if calculation_method != "provided" else "provided"
         }
         
-        print(f"✅ Enhanced calculation complete: {result.get('distance_km')} km, {result.get('calculated_price')} VND")
+        logger.debug("✅ Enhanced calculation complete: %s km, %s VND", result.get('distance_km'), result.get('calculated_price'))
         return result
         
     except Exception as e:
-        print(f"❌ Enhanced calculation error: {str(e)}")
+        logger.error("❌ Enhanced calculation error: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Lỗi tính giá enhanced: {str(e)}")
 
 
+# =================== API tính giá hàng loạt ===================
+def _price_distance(calculator, config_type: str, config_name: str, request: TripCalculationRequest,
+                    distance_km: float, duration_minutes: Optional[float], calculation_method: str,
+                    route_info: dict, from_cache: bool = False) -> dict:
+    """Tính giá cho 1 khoảng cách đã biết với calculator đã dựng sẵn (dùng chung trong batch)"""
+    if config_type == "tier":
+        result = calculator.calculate_price(distance_km, include_breakdown=request.include_breakdown is not False)
+    else:
+        price_info = calculator.calculate_price(distance_km)
+        result = {
+            "calculated_price": price_info["final_price"],
+            "breakdown": price_info
+        }
+    
+    result.update({
+        "config_type": config_type,
+        "config_name": config_name,
+        "from_address": request.from_address or 'Điểm A',
+        "to_address": request.to_address or 'Điểm B',
+        "distance_km": distance_km,
+        "duration_minutes": duration_minutes or (distance_km / 40) * 60,  # Fallback duration
+        "calculation_method": calculation_method,
+        "route_info": route_info,
+        "from_cache": from_cache
+    })
+    return result
+
+@router.post("/calculate-price/batch")
+async def calculate_price_batch(batch: BatchTripCalculationRequest):
+    """
+    Tính giá cho nhiều chuyến đi trong 1 request.
+    - Khoảng cách lấy từ cache trước, phần còn lại gom các điểm đi x điểm đến khác nhau thành
+      ma trận, chia khối <= 25x25 và <= 100 ô mỗi request Distance Matrix thay vì gọi Directions
+      cho từng chuyến; tối đa GOOGLE_MAPS_POOL_SIZE request chạy song song, kết quả ghi vào cache
+    - Kết quả trả về dạng NDJSON, mỗi dòng 1 chuyến (có "index") ngay khi tính xong
+    - Dùng 1 DB session cho cả batch, lưu trips 1 lần ở cuối
+    """
+    trips = batch.trips
+    if not trips:
+        raise HTTPException(status_code=400, detail="Danh sách chuyến đi trống")
+    if len(trips) > settings.BATCH_QUOTE_MAX_TRIPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tối đa {settings.BATCH_QUOTE_MAX_TRIPS} chuyến đi mỗi batch"
+        )
+    
+    use_cache = batch.use_cache is not False
+    
+    def to_line(payload: dict) -> str:
+        return json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+    
+    async def generate():
+        started = time.perf_counter()
+        db = SessionLocal()
+        trips_to_save = []
+        counters = {"fixed_price": 0, "provided": 0, "cache": 0, "distance_matrix": 0,
+                    "haversine": 0, "errors": 0, "matrix_requests": 0}
+        
+        def finish(index: int, request: TripCalculationRequest, result: dict, config_used: str):
+            result["index"] = index
+            result["success"] = True
+            trips_to_save.append({
+                "from_address": result.get("from_address", "Điểm A"),
+                "to_address": result.get("to_address", "Điểm B"),
+                "from_lat": request.from_lat,
+                "from_lng": request.from_lng,
+                "to_lat": request.to_lat,
+                "to_lng": request.to_lng,
+                "distance_km": result.get("distance_km"),
+                "duration_minutes": result.get("duration_minutes"),
+                "calculated_price": result.get("total_price") or result.get("calculated_price"),
+                "config_used": config_used
+            })
+            return to_line(result)
+        
+        def fail(index: int, error: str) -> str:
+            counters["errors"] += 1
+            return to_line({"index": index, "success": False, "error": error})
+        
+        try:
+            # Đọc cấu hình 1 lần cho cả batch
+            try:
+                config_type, config_name, config_data, snapshot = await _resolve_pricing_config(db)
+            except HTTPException as e:
+                yield to_line({"success": False, "error": e.detail})
+                return
+            
+            if config_type == "tier":
+                calculator = snapshot.tier_calculator()
+            else:
+                calculator = PriceCalculator(
+                    base_price=config_data["base_price"],
+                    price_per_km=config_data["price_per_km"],
+                    min_price=config_data["min_price"],
+                    max_price=config_data["max_price"],
+                    use_google_maps=False  # Khoảng cách đã tính ở đây, calculator chỉ dùng để tính giá
+                )
+            config_used = f"{config_type}:{config_name}"
+            
+            use_fixed_price = snapshot.use_fixed_price
+            
+            # Bước 1: giá cố định, khoảng cách có sẵn, cache -> trả về ngay
+            fixed_routes = [None] * len(trips)
+            if use_fixed_price:
+                try:
+                    fixed_routes = _find_fixed_price_routes(db, trips)
+                except Exception as fixed_price_error:
+                    logger.warning("⚠️ Fixed price lookup failed: %s", fixed_price_error)
+            
+            pending = {}  # (origin, destination) -> [(index, request)]
+            for index, request in enumerate(trips):
+                route = fixed_routes[index]
+                if route:
+                    counters["fixed_price"] += 1
+                    yield finish(index, request, {
+                        "distance_km": request.distance_km,
+                        "duration_minutes": request.duration_minutes,
+                        "calculated_price": route.fixed_price,
+                        "from_address": request.from_address or route.from_address_text,
+                        "to_address": request.to_address or route.to_address_text,
+                        "config_type": "fixed_price",
+                        "config_name": f"route_{route.id}",
+                        "route_description": route.description,
+                        "calculation_method": "fixed_price"
+                    }, f"fixed_price:route_{route.id}")
+                    continue
+                
+                if request.distance_km and request.distance_km > 0:
+                    counters["provided"] += 1
+                    yield finish(index, request, _price_distance(
+                        calculator, config_type, config_name, request,
+                        request.distance_km, request.duration_minutes, "provided", {}
+                    ), config_used)
+                    continue
+                
+                if not all(v is not None for v in (request.from_lat, request.from_lng, request.to_lat, request.to_lng)):
+                    yield fail(index, "Cần có tọa độ hoặc distance_km")
+                    continue
+                
+                if use_cache and request.use_cache is not False:
+                    cached = await asyncio.to_thread(
+                        route_distance_cache.get,
+                        request.from_lat, request.from_lng, request.to_lat, request.to_lng
+                    )
+                    if cached:
+                        counters["cache"] += 1
+                        yield finish(index, request, _price_distance(
+                            calculator, config_type, config_name, request,
+                            cached["distance_km"], cached.get("duration_minutes"),
+                            cached.get("method", "google_maps"), cached.get("route_info", {}), from_cache=True
+                        ), config_used)
+                        continue
+                
+                origin = (request.from_lat, request.from_lng)
+                destination = (request.to_lat, request.to_lng)
+                pending.setdefault((origin, destination), []).append((index, request))
+            
+            # Bước 2: các điểm đi x điểm đến khác nhau -> khối <= 25x25, <= 100 ô = 1 request Distance Matrix
+            chain = get_distance_provider_chain()
+            origins = list(dict.fromkeys(origin for origin, _ in pending))
+            destinations = list(dict.fromkeys(destination for _, destination in pending))
+            
+            chunks = []
+            for _, origin_chunk, _, destination_chunk in chunk_matrix_request(origins, destinations):
+                # Chỉ giữ điểm đi/điểm đến có chuyến trong khối, khối không có chuyến nào thì bỏ
+                chunk_origins = [o for o in origin_chunk if any((o, d) in pending for d in destination_chunk)]
+                if not chunk_origins:
+                    continue
+                chunk_destinations = [d for d in destination_chunk if any((o, d) in pending for o in chunk_origins)]
+                chunks.append((chunk_origins, chunk_destinations))
+            
+            # Không bắn quá số kết nối của pool HTTP cùng lúc
+            matrix_slots = asyncio.Semaphore(max(1, settings.GOOGLE_MAPS_POOL_SIZE))
+            
+            async def resolve_chunk(chunk_origins, chunk_destinations):
+                # Chuỗi provider tự failover; ô nào vẫn thiếu thì dùng Haversine bên dưới
+                async with matrix_slots:
+                    matrix = await chain.matrix(chunk_origins, chunk_destinations)
+                counters["matrix_requests"] += 1
+                # Cả các ô không thuộc chuyến nào trong batch cũng đáng cache; không cache ước tính Haversine
+                routed = [
+                    (o[0], o[1], d[0], d[1], cell)
+                    for o, row in zip(chunk_origins, matrix)
+                    for d, cell in zip(chunk_destinations, row)
+                    if cell and cell.get("method") != "enhanced_haversine"
+                ]
+                if routed:
+                    await asyncio.to_thread(route_distance_cache.set_many, routed)
+                return chunk_origins, chunk_destinations, matrix
+            
+            tasks = [asyncio.ensure_future(resolve_chunk(o, d)) for o, d in chunks]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    chunk_origins, chunk_destinations, matrix = await next_done
+                    for origin, row in zip(chunk_origins, matrix):
+                        for destination, cell in zip(chunk_destinations, row):
+                            for index, request in pending.get((origin, destination), ()):
+                                distance_result = cell or enhanced_haversine(
+                                    origin[0], origin[1], destination[0], destination[1]
+                                )
+                                if distance_result.get("method") == "enhanced_haversine":
+                                    counters["haversine"] += 1
+                                else:
+                                    counters["distance_matrix"] += 1
+                                yield finish(index, request, _price_distance(
+                                    calculator, config_type, config_name, request,
+                                    distance_result["distance_km"], distance_result.get("duration_minutes"),
+                                    distance_result.get("method", "unknown"), distance_result.get("route_info", {})
+                                ), config_used)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            
+            # Bước 3: lưu toàn bộ trips trong 1 transaction
+            saved = 0
+            if batch.save_trips is not False and trips_to_save:
+                try:
+                    saved = trip_crud.create_trips(db, trips_to_save)
+                except Exception as trip_error:
+                    db.rollback()
+                    logger.warning("⚠️ Could not save batch trips: %s", trip_error)
+            
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            logger.info("✅ Batch calculation complete: %s trips, %s matrix requests, %s ms", len(trips), counters['matrix_requests'], elapsed_ms)
+            yield to_line({
+                "summary": {
+                    "total": len(trips),
+                    **counters,
+                    "saved_trips": saved,
+                    "elapsed_ms": elapsed_ms
+                }
+            })
+        finally:
+            db.close()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 # ===== FALLBACK API CHO TRƯỜNG HỢP KHẨn CẤP =====
 @router.post("/calculate-price-fallback")
 async def calculate_price_fallback(
@@ -1062,7 +1285,7 @@ async def calculate_price_fallback(
 ):
     """API fallback dùng haversine khi mọi thứ khác fail"""
     try:
-        print("🆘 Using fallback calculation method")
+        logger.warning("🆘 Using fallback calculation method")
         
         # Validate coordinates
         if not all([request.from_lat, request.from_lng, request.to_lat, request.to_lng]):
@@ -1095,8 +1318,8 @@ async def calculate_price_fallback(
             use_google_maps=False  # Force dùng haversine
         )
         
-        # Tính toán với enhanced haversine
-        distance_result = calculator._enhanced_haversine_calculation(
+        # Tính toán với enhanced haversine (hàm module, không phụ thuộc loại calculator)
+        distance_result = enhanced_haversine(
             request.from_lat, request.from_lng,
             request.to_lat, request.to_lng
         )
@@ -1121,11 +1344,11 @@ async def calculate_price_fallback(
             }
         }
         
-        print(f"✅ Fallback calculation: {result['distance_km']} km, {result['calculated_price']} VND")
+        logger.info("✅ Fallback calculation: %s km, %s VND", result['distance_km'], result['calculated_price'])
         return result
         
     except Exception as e:
-        print(f"❌ Fallback calculation failed: {str(e)}")
+        logger.error("❌ Fallback calculation failed: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Lỗi fallback calculation: {str(e)}")
 
 
@@ -1241,6 +1464,13 @@ async def get_calculation_status():
         
         return {
             **status,
+            "google_maps_client": google_maps_client_registry.get_status(),
+            "database": get_engine_info(engine),
+            "pricing_snapshot": pricing_snapshot_store.get_status(),
+            "tier_calculator_cache": tier_calculator_cache.get_stats(),
+            "fixed_price_matcher": fixed_price_route_matcher.get_stats(),
+            "trip_log_writer": trip_log_writer.get_stats(),
+            "circuit_breakers": circuit_breakers.get_status(),
             "api_endpoints": {
                 "enhanced": "/api/calculate-price-enhanced",
                 "basic": "/api/calculate-price",
@@ -1260,6 +1490,39 @@ async def get_calculation_status():
             "google_maps_ready": False
         }
 
+# API quản lý cache khoảng cách
+@router.get("/route-cache/stats")
+async def get_route_cache_stats():
+    """Thống kê cache khoảng cách tuyến đường (hit/miss, kích thước)"""
+    return route_distance_cache.get_stats()
+
+@router.delete("/route-cache")
+async def clear_route_cache():
+    """Xóa toàn bộ cache khoảng cách tuyến đường"""
+    try:
+        route_distance_cache.clear()
+        return {"message": "Đã xóa cache khoảng cách", "stats": route_distance_cache.get_stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi xóa cache: {str(e)}")
+
+# API trạng thái các provider khoảng cách
+@router.get("/distance-providers")
+async def get_distance_providers_status():
+    """Thứ tự ưu tiên và sức khỏe các provider khoảng cách (Google, OSRM, Valhalla, Haversine)"""
+    return await asyncio.to_thread(get_distance_provider_chain().get_status)
+
+@router.get("/circuit-breakers")
+async def get_circuit_breakers():
+    """Trạng thái circuit breaker của các dịch vụ ngoài (closed / open / half_open)"""
+    return circuit_breakers.get_status()
+
+@router.post("/circuit-breakers/{name}/reset")
+async def reset_circuit_breaker(name: str):
+    """Đóng lại circuit thủ công"""
+    if not circuit_breakers.reset(name):
+        raise HTTPException(status_code=404, detail=f"Không có circuit breaker {name}")
+    return circuit_breakers.get_status()[name]
+
 # test config Google Maps
 
 @router.get("/debug/google-maps-config")
@@ -1399,6 +1662,15 @@ async def test_raw_google_maps(db: Session = Depends(get_db)):
 
 # ================== API SETTINGS MANAGEMENT ==================
 
+def _on_setting_changed(key: str, db: Session = None):
+    """Làm mới các state dùng chung phụ thuộc vào setting vừa thay đổi"""
+    if key == "google_maps_api_key":
+        google_maps_client_registry.invalidate()
+        # Key mới -> cho Google cơ hội lại ngay thay vì chờ circuit hết hạn
+        circuit_breakers.reset("google_maps")
+    elif key in PRICING_SETTING_KEYS:
+        pricing_snapshot_store.invalidate(db)
+
 @router.get("/settings/{key}")
 async def get_setting(key: str, db: Session = Depends(get_db)):
     """Lấy giá trị setting theo key"""
@@ -1446,6 +1718,7 @@ async def update_setting_put(
         
         db.commit()
         db.refresh(setting)
+        _on_setting_changed(key, db)
         
         return {
             "message": "Cập nhật setting thành công", 
@@ -1491,6 +1764,7 @@ async def update_setting(
         
         db.commit()
         db.refresh(setting)
+        _on_setting_changed(key, db)
         
         return {
             "message": "Cập nhật setting thành công", 
@@ -1728,6 +2002,46 @@ async def test_telegram_connection(db: Session = Depends(get_db)):
             "error": f"Lỗi test Telegram: {str(e)}"
         }
 
+@router.get("/notifications/outbox")
+async def get_notification_outbox(
+    status: Optional[str] = Query(None, description="pending, sending, sent, skipped, failed"),
+    limit: int = Query(50, le=500),
+    db: Session = Depends(get_db)
+):
+    """Danh sách thông báo trong outbox và trạng thái dispatcher"""
+    query = db.query(models.NotificationOutbox)
+    if status:
+        query = query.filter(models.NotificationOutbox.status == status)
+    rows = query.order_by(models.NotificationOutbox.id.desc()).limit(limit).all()
+    return {
+        "dispatcher": notification_dispatcher.get_stats(db),
+        "smtp": simple_email_service.get_stats(),
+        "telegram": telegram_service.get_stats(),
+        "notifications": [
+            {
+                "id": row.id,
+                "channel": row.channel,
+                "event": row.event,
+                "booking_id": row.booking_id,
+                "status": row.status,
+                "attempts": row.attempts,
+                "next_attempt_at": row.next_attempt_at.isoformat() if row.next_attempt_at else None,
+                "last_error": row.last_error,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "sent_at": row.sent_at.isoformat() if row.sent_at else None
+            }
+            for row in rows
+        ]
+    }
+
+@router.post("/notifications/outbox/{notification_id}/retry")
+async def retry_notification(notification_id: int, db: Session = Depends(get_db)):
+    """Gửi lại 1 thông báo (VD: đã failed sau khi sửa cấu hình SMTP/Telegram)"""
+    row = notification_dispatcher.retry(db, notification_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Không tìm thấy thông báo")
+    return {"success": True, "id": row.id, "status": row.status}
+
 @router.post("/test-fixed-price-matching")
 async def test_fixed_price_matching(
     from_address: str = Query(..., description="Địa chỉ điểm đi để test"),
@@ -1736,9 +2050,9 @@ async def test_fixed_price_matching(
 ):
     """Test matching logic cho giá cố định (for debugging)"""
     try:
-        print(f"\n🧪 TESTING FIXED PRICE MATCHING")
-        print(f"Input FROM: {from_address}")
-        print(f"Input TO: {to_address}")
+        logger.info("🧪 TESTING FIXED PRICE MATCHING")
+        logger.info("Input FROM: %s", from_address)
+        logger.info("Input TO: %s", to_address)
         
         route = fixed_price_routes_crud.find_matching_route_by_text(
             db, from_address, to_address
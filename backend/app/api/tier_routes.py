@@ -6,7 +6,8 @@ from app.models.schemas import  (
     TierPriceCalculationRequest, PriceTier
 )
 from app.crud.tier_pricing import tier_pricing_crud
-from app.utils.tier_calculator import TierPriceCalculator
+from app.utils.tier_calculator import tier_calculator_cache
+from app.utils.pricing_snapshot import pricing_snapshot_store
 from typing import List
 
 router = APIRouter()
@@ -25,6 +26,7 @@ async def create_tier_config(
         
         # Tạo mới
         db_config = tier_pricing_crud.create_config(db, config)
+        pricing_snapshot_store.invalidate(db)
         
         # Convert response
         tiers = [PriceTier(**tier) for tier in db_config.tiers]
@@ -88,6 +90,7 @@ async def update_tier_config(
     updated_config = tier_pricing_crud.update_config(db, config_name, config_update)
     if not updated_config:
         raise HTTPException(status_code=404, detail="Không tìm thấy cấu hình")
+    pricing_snapshot_store.invalidate(db)
     
     tiers = [PriceTier(**tier) for tier in updated_config.tiers]
     return TierPriceConfig(
@@ -106,6 +109,7 @@ async def delete_tier_config(config_name: str, db: Session = Depends(get_db)):
     success = tier_pricing_crud.delete_config(db, config_name)
     if not success:
         raise HTTPException(status_code=404, detail="Không tìm thấy cấu hình")
+    pricing_snapshot_store.invalidate(db)
     
     return {"message": f"Đã xóa cấu hình '{config_name}'"}
 
@@ -121,7 +125,9 @@ async def calculate_tier_price(
         raise HTTPException(status_code=404, detail=f"Không tìm thấy cấu hình '{request.config_name}'")
     
     # Tính giá
-    calculator = TierPriceCalculator(config.base_price, config.tiers)
+    calculator = tier_calculator_cache.get(
+        ("tier_config", config.id, config.updated_at, config.base_price), config.base_price, config.tiers
+    )
     result = calculator.calculate_price(request.distance_km)
     
     # Thêm thông tin cấu hình
@@ -142,7 +148,9 @@ async def calculate_tier_price_get(
         raise HTTPException(status_code=404, detail=f"Không tìm thấy cấu hình '{config_name}'")
     
     # Tính giá
-    calculator = TierPriceCalculator(config.base_price, config.tiers)
+    calculator = tier_calculator_cache.get(
+        ("tier_config", config.id, config.updated_at, config.base_price), config.base_price, config.tiers
+    )
     result = calculator.calculate_price(distance_km)
     
     # Thêm thông tin cấu hình
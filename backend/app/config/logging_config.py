@@ -0,0 +1,80 @@
+# backend/app/config/logging_config.py
+"""
+Cấu hình logging cho toàn bộ app (logger "app" và các logger con theo module).
+- LOG_LEVEL: DEBUG | INFO | WARNING | ERROR (mặc định INFO - log theo từng request đều ở DEBUG)
+- LOG_FORMAT: text (dễ đọc khi dev) hoặc json (1 dòng JSON/bản ghi để đưa vào hệ thống gom log)
+- LOG_FILE: ghi thêm ra file nếu được cấu hình
+Log dùng định dạng lười (logger.debug("... %s", x)) nên khi level tắt không tốn chi phí format.
+"""
+
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config.settings import settings
+
+# Thuộc tính chuẩn của LogRecord - phần còn lại (truyền qua extra=...) được đưa vào JSON
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s [%(name)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi là 1 dòng JSON: ts, level, logger, msg (+ exc, các field extra)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None, log_file: Optional[str] = None):
+    """Gắn handler cho logger "app" (gọi 1 lần khi khởi động, gọi lại thì thay handler cũ)"""
+    level = (level or settings.LOG_LEVEL).upper()
+    fmt = (fmt or settings.LOG_FORMAT).lower()
+    log_file = log_file if log_file is not None else settings.LOG_FILE
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+
+    app_logger = logging.getLogger("app")
+    for handler in list(app_logger.handlers):
+        app_logger.removeHandler(handler)
+        handler.close()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        app_logger.addHandler(handler)
+    app_logger.setLevel(level)
+    # Không đẩy tiếp lên root để tránh in 2 lần khi uvicorn cũng cấu hình root
+    app_logger.propagate = False
+    return app_logger
+
+
+class DebugSampler:
+    """
+    Chỉ log debug cho 1 phần request ở đường nóng (VD: 1% lượt tìm giá cố định).
+    Khi logger không bật DEBUG, sample() chỉ tốn 1 lần isEnabledFor (đã được logging cache).
+    """
+
+    def __init__(self, logger: logging.Logger, rate: float):
+        self.logger = logger
+        self.rate = max(0.0, min(1.0, rate))
+
+    def sample(self) -> bool:
+        if self.rate <= 0 or not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return self.rate >= 1 or random.random() < self.rate
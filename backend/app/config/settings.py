@@ -3,9 +3,69 @@ import os
 class Settings:
     # Cấu hình database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///../../database/travel_calculator.db")
+    APP_ENV: str = os.getenv("APP_ENV", "development")  # development | production
+    
+    # Cấu hình engine database (xem app/database/engine_config.py)
+    DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"  # In toàn bộ SQL ra console (chỉ để debug)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10" if APP_ENV == "production" else "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20" if APP_ENV == "production" else "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Postgres: đóng kết nối cũ hơn 30 phút
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+    
+    # Cấu hình logging (xem app/config/logging_config.py)
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")  # text hoặc json
+    LOG_FILE: str = os.getenv("LOG_FILE", "")
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"  # Middleware đo latency + /metrics
+    FIXED_PRICE_MATCHER_DEBUG_SAMPLE_RATE: float = float(os.getenv("FIXED_PRICE_MATCHER_DEBUG_SAMPLE_RATE", "0.01"))  # Khi LOG_LEVEL=DEBUG
     
     # Cấu hình Google Maps
     GOOGLE_MAPS_API_KEY: str = "YOUR_API_KEY_HERE"
+    GOOGLE_MAPS_KEY_REFRESH_SECONDS: int = int(os.getenv("GOOGLE_MAPS_KEY_REFRESH_SECONDS", "60"))
+    GOOGLE_MAPS_POOL_SIZE: int = int(os.getenv("GOOGLE_MAPS_POOL_SIZE", "10"))
+    GOOGLE_MAPS_BASE_URL: str = os.getenv("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com")
+    GOOGLE_DISTANCE_BACKEND: str = os.getenv("GOOGLE_DISTANCE_BACKEND", "httpx")  # httpx hoặc thread
+    DISTANCE_PROVIDER_TIMEOUT_SECONDS: float = float(os.getenv("DISTANCE_PROVIDER_TIMEOUT_SECONDS", "8"))
+    DISTANCE_THREAD_POOL_SIZE: int = int(os.getenv("DISTANCE_THREAD_POOL_SIZE", "8"))
+    # Chuỗi provider khoảng cách theo thứ tự ưu tiên (google, osrm, valhalla, haversine)
+    DISTANCE_PROVIDERS: str = os.getenv("DISTANCE_PROVIDERS", "google,haversine")
+    DISTANCE_PROVIDER_FAILURE_THRESHOLD: int = int(os.getenv("DISTANCE_PROVIDER_FAILURE_THRESHOLD", "3"))  # Lỗi liên tiếp -> tạm bỏ qua
+    DISTANCE_PROVIDER_COOLDOWN_SECONDS: float = float(os.getenv("DISTANCE_PROVIDER_COOLDOWN_SECONDS", "30"))  # Thời gian circuit mở
+    DISTANCE_PROVIDER_SLOW_CALL_SECONDS: float = float(os.getenv("DISTANCE_PROVIDER_SLOW_CALL_SECONDS", "5"))  # Gọi chậm hơn = lỗi (0 = tắt)
+    DISTANCE_HEDGE_AFTER_SECONDS: float = float(os.getenv("DISTANCE_HEDGE_AFTER_SECONDS", "0"))  # > 0: quá ngưỡng thì gọi song song provider kế tiếp
+    DISTANCE_QUOTE_SLA_SECONDS: float = float(os.getenv("DISTANCE_QUOTE_SLA_SECONDS", "0"))  # > 0: quá hạn thì trả Haversine ngay
+    OSRM_BASE_URL: str = os.getenv("OSRM_BASE_URL", "")  # VD: http://localhost:5000
+    OSRM_PROFILE: str = os.getenv("OSRM_PROFILE", "driving")
+    VALHALLA_BASE_URL: str = os.getenv("VALHALLA_BASE_URL", "")  # VD: http://localhost:8002
+    VALHALLA_COSTING: str = os.getenv("VALHALLA_COSTING", "auto")
+    TRIP_LOG_ASYNC: bool = os.getenv("TRIP_LOG_ASYNC", "true").lower() == "true"  # false = INSERT trong request như cũ
+    TRIP_LOG_QUEUE_SIZE: int = int(os.getenv("TRIP_LOG_QUEUE_SIZE", "10000"))
+    TRIP_LOG_BATCH_SIZE: int = int(os.getenv("TRIP_LOG_BATCH_SIZE", "200"))
+    TRIP_LOG_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("TRIP_LOG_FLUSH_INTERVAL_SECONDS", "1"))
+    NOTIFICATION_POLL_SECONDS: float = float(os.getenv("NOTIFICATION_POLL_SECONDS", "5"))
+    NOTIFICATION_MAX_ATTEMPTS: int = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "6"))
+    NOTIFICATION_RETRY_BASE_SECONDS: float = float(os.getenv("NOTIFICATION_RETRY_BASE_SECONDS", "30"))  # 30s, 60s, 120s...
+    NOTIFICATION_CLAIM_LEASE_SECONDS: float = float(os.getenv("NOTIFICATION_CLAIM_LEASE_SECONDS", "300"))  # Dòng sending quá hạn -> coi như worker đã chết, gửi lại
+    BATCH_QUOTE_MAX_TRIPS: int = int(os.getenv("BATCH_QUOTE_MAX_TRIPS", "500"))
+    FIXED_PRICE_MATCHER_CHECK_SECONDS: float = float(os.getenv("FIXED_PRICE_MATCHER_CHECK_SECONDS", "5"))
+    ADMIN_DIVISION_INDEX_ENABLED: bool = os.getenv("ADMIN_DIVISION_INDEX_ENABLED", "true").lower() == "true"
+    # Reverse lookup tọa độ -> xã/huyện/tỉnh: bán kính tối đa tới tâm đơn vị gần nhất ở từng cấp
+    REVERSE_GEOCODE_WARD_MAX_KM: float = float(os.getenv("REVERSE_GEOCODE_WARD_MAX_KM", "3"))
+    REVERSE_GEOCODE_DISTRICT_MAX_KM: float = float(os.getenv("REVERSE_GEOCODE_DISTRICT_MAX_KM", "15"))
+    REVERSE_GEOCODE_PROVINCE_MAX_KM: float = float(os.getenv("REVERSE_GEOCODE_PROVINCE_MAX_KM", "100"))
+    PRICING_SNAPSHOT_CHECK_SECONDS: float = float(os.getenv("PRICING_SNAPSHOT_CHECK_SECONDS", "1"))  # 0 = kiểm tra version mỗi request
+    GEOCODING_CACHE_SIZE: int = int(os.getenv("GEOCODING_CACHE_SIZE", "5000"))  # Số tọa độ tối đa trong LRU mỗi worker
+    GEOCODING_CACHE_TTL_SECONDS: int = int(os.getenv("GEOCODING_CACHE_TTL_SECONDS", str(24 * 3600)))
+    GEOCODING_CACHE_SHARED: bool = os.getenv("GEOCODING_CACHE_SHARED", "true").lower() == "true"  # Đồng bộ invalidation giữa các worker qua SQLite
+    GEOCODING_CACHE_CHECK_SECONDS: float = float(os.getenv("GEOCODING_CACHE_CHECK_SECONDS", "1"))  # Chu kỳ đọc nhật ký invalidation
+    GEOCODING_JOB_WORKERS: int = int(os.getenv("GEOCODING_JOB_WORKERS", "4"))  # Số request geocode song song
+    GEOCODING_JOB_RATE_PER_SECOND: float = float(os.getenv("GEOCODING_JOB_RATE_PER_SECOND", "10"))  # Giới hạn QPS Google Geocoding
+    GEOCODING_JOB_BATCH_SIZE: int = int(os.getenv("GEOCODING_JOB_BATCH_SIZE", "100"))  # Số đơn vị mỗi lần commit + checkpoint
     
     # Cấu hình giá cơ bản
     BASE_PRICE: float = 10000
@@ -13,6 +73,13 @@ class Settings:
     MIN_PRICE: float = 20000
     MAX_PRICE: float = 500000
     
+    # Cấu hình cache khoảng cách tuyến đường (LRU in-process + SQLite)
+    ROUTE_CACHE_ENABLED: bool = os.getenv("ROUTE_CACHE_ENABLED", "true").lower() == "true"
+    ROUTE_CACHE_TTL_SECONDS: int = int(os.getenv("ROUTE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    ROUTE_CACHE_MEMORY_SIZE: int = int(os.getenv("ROUTE_CACHE_MEMORY_SIZE", "2000"))
+    ROUTE_CACHE_DB_SIZE: int = int(os.getenv("ROUTE_CACHE_DB_SIZE", "50000"))
+    ROUTE_CACHE_PRECISION: int = int(os.getenv("ROUTE_CACHE_PRECISION", "4"))  # 4 số lẻ ~ 11m
+    
     # Cấu hình server
     HOST: str = "127.0.0.1"
     PORT: int = 8000
@@ -1,6 +1,10 @@
+import logging
 from sqlalchemy.orm import Session
 from app.models import models, schemas
 from typing import List, Optional
+from app.utils.trip_log_writer import trip_log_writer
+
+logger = logging.getLogger(__name__)
 
 # CRUD cho PriceConfig
 class PriceConfigCRUD:
@@ -35,7 +39,7 @@ class PriceConfigCRUD:
         
         if not db_config:
             # Tạo mới nếu chưa tồn tại
-            print(f"🏗️ Creating new config '{config_name}'...")
+            logger.info("🏗️ Creating new config '%s'...", config_name)
             create_data = config_update.dict(exclude_unset=True)
             create_data['config_name'] = config_name
             
@@ -47,7 +51,7 @@ class PriceConfigCRUD:
             db.add(db_config)
         else:
             # Cập nhật nếu đã tồn tại
-            print(f"📝 Updating existing config '{config_name}'...")
+            logger.info("📝 Updating existing config '%s'...", config_name)
             update_data = config_update.dict(exclude_unset=True)
             for field, value in update_data.items():
                 setattr(db_config, field, value)
@@ -65,6 +69,22 @@ class TripCRUD:
         db.refresh(db_trip)
         return db_trip
     
+    def log_trip(self, db: Session, trip_data: dict) -> bool:
+        """
+        Lưu lịch sử báo giá ngoài luồng request (write-behind).
+        Ghi đồng bộ nếu writer chưa chạy hoặc queue đầy. True nếu đã đưa vào queue.
+        """
+        if trip_log_writer.submit(trip_data):
+            return True
+        self.create_trip(db, trip_data)
+        return False
+    
+    def create_trips(self, db: Session, trips_data: List[dict]) -> int:
+        """Lưu nhiều chuyến đi trong 1 transaction (dùng cho tính giá hàng loạt)"""
+        db.add_all([models.Trip(**trip_data) for trip_data in trips_data])
+        db.commit()
+        return len(trips_data)
+    
     def get_trips(self, db: Session, skip: int = 0, limit: int = 100) -> List[models.Trip]:
         return db.query(models.Trip).offset(skip).limit(limit).all()
 
@@ -1,34 +1,33 @@
 # backend/app/database/database.py
 
-from sqlalchemy import create_engine, MetaData
+import logging
+from sqlalchemy import MetaData
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
-# Import settings để dùng cấu hình thống nhất
-try:
-    from app.config.settings import settings
-    DATABASE_URL = settings.DATABASE_URL
-    DATABASE_PATH = DATABASE_URL.replace("sqlite:///", "")
-    print(f"✅ Using DATABASE_URL from settings: {DATABASE_URL}")
-except ImportError:
-    # Fallback nếu không import được settings
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    DATABASE_DIR = os.path.join(BASE_DIR, "database")
-    DATABASE_PATH = os.path.join(DATABASE_DIR, "travel_calculator.db")
-    DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
-    print(f"⚠️ Using fallback DATABASE_URL: {DATABASE_URL}")
-
-# Tạo thư mục database nếu chưa tồn tại
-DATABASE_DIR = os.path.dirname(DATABASE_PATH)
-os.makedirs(DATABASE_DIR, exist_ok=True)
-
-# Tạo engine
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False},  # Cần cho SQLite
-    echo=True  # In SQL queries ra console (để debug)
-)
+from app.config.settings import settings
+from app.database.engine_config import create_app_engine
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = settings.DATABASE_URL
+_url = make_url(DATABASE_URL)
+logger.info("✅ Using DATABASE_URL from settings: %s (%s)", _url.render_as_string(hide_password=True), settings.APP_ENV)
+
+if _url.get_backend_name() == "sqlite" and _url.database not in (None, "", ":memory:"):
+    DATABASE_PATH = _url.database
+    # Tạo thư mục database nếu chưa tồn tại
+    DATABASE_DIR = os.path.dirname(DATABASE_PATH)
+    if DATABASE_DIR:
+        os.makedirs(DATABASE_DIR, exist_ok=True)
+else:
+    # Postgres / in-memory: chỉ để hiển thị trong các script
+    DATABASE_PATH = _url.render_as_string(hide_password=True)
+
+# Tạo engine theo profile (SQLite: WAL + pragmas, Postgres: connection pool)
+engine = create_app_engine(DATABASE_URL, settings)
 
 # Tạo SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
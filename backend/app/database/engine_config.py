@@ -0,0 +1,94 @@
+# backend/app/database/engine_config.py
+"""
+Cấu hình engine SQLAlchemy theo loại database và môi trường (APP_ENV).
+- SQLite: WAL + synchronous=NORMAL + mmap + busy_timeout cho mỗi kết nối, pool cố định
+- Postgres (DATABASE_URL=postgresql://...): QueuePool có pre-ping và recycle
+"""
+
+from typing import Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, URL, make_url
+
+
+def build_engine_options(url: URL, settings) -> Dict:
+    """Tham số create_engine() cho URL và môi trường hiện tại"""
+    options = {
+        "echo": settings.DB_ECHO,
+        "future": True,
+    }
+
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {
+            "check_same_thread": False,  # Session dùng ở threadpool của FastAPI + thread nền
+            "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        }
+        if url.database in (None, "", ":memory:"):
+            # In-memory: giữ nguyên pool mặc định (1 kết nối dùng chung)
+            return options
+        options.update({
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+        })
+        return options
+
+    options.update({
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    })
+    return options
+
+
+def sqlite_pragmas(settings) -> Dict[str, str]:
+    """PRAGMA chạy trên mỗi kết nối SQLite mới"""
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": str(settings.SQLITE_BUSY_TIMEOUT_MS),
+        "mmap_size": str(settings.SQLITE_MMAP_SIZE),
+        "cache_size": str(-settings.SQLITE_CACHE_SIZE_KB),  # Số âm = KB
+        "temp_store": "MEMORY",
+    }
+
+
+def _install_sqlite_pragmas(engine: Engine, pragmas: Dict[str, str]):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def create_app_engine(database_url: str, settings) -> Engine:
+    """Tạo engine theo profile phù hợp với DATABASE_URL"""
+    url = make_url(database_url)
+    engine = create_engine(url, **build_engine_options(url, settings))
+    if url.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine, sqlite_pragmas(settings))
+    return engine
+
+
+def get_engine_info(engine: Engine) -> Dict:
+    """Thông tin engine/pool cho API trạng thái"""
+    info = {
+        "dialect": engine.dialect.name,
+        "driver": engine.dialect.driver,
+        "url": engine.url.render_as_string(hide_password=True),
+        "echo": bool(engine.echo),
+        "pool": engine.pool.__class__.__name__,
+        "pool_status": engine.pool.status(),
+    }
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            info["pragmas"] = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ("journal_mode", "synchronous", "busy_timeout", "mmap_size")
+            }
+    return info
@@ -0,0 +1,75 @@
+# backend/app/database/migrations.py
+
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.models import models
+from app.utils.address_normalizer import route_address_columns
+
+logger = logging.getLogger(__name__)
+
+# Cột chuẩn hóa thêm vào fixed_price_routes
+FIXED_PRICE_ROUTE_NORMALIZED_COLUMNS = (
+    "from_address_norm", "to_address_norm",
+    "from_address_canonical", "to_address_canonical",
+    "from_province_key", "to_province_key",
+)
+
+
+def migrate_fixed_price_routes(engine: Engine, batch_size: int = 500) -> int:
+    """
+    Thêm cột địa chỉ chuẩn hóa + index cho fixed_price_routes và backfill các dòng cũ.
+    Chạy nhiều lần không sao (idempotent). Trả về số dòng đã backfill.
+    """
+    inspector = inspect(engine)
+    if "fixed_price_routes" not in inspector.get_table_names():
+        return 0
+
+    existing_columns = {column["name"] for column in inspector.get_columns("fixed_price_routes")}
+    with engine.begin() as conn:
+        for column in FIXED_PRICE_ROUTE_NORMALIZED_COLUMNS:
+            if column not in existing_columns:
+                conn.execute(text(f"ALTER TABLE fixed_price_routes ADD COLUMN {column} VARCHAR"))
+                logger.info("✓ Added column fixed_price_routes.%s", column)
+
+    for index in models.FixedPriceRoute.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    # Backfill theo lô
+    backfilled = 0
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(text("""
+                SELECT id, from_address_text, to_address_text
+                FROM fixed_price_routes
+                WHERE from_address_norm IS NULL OR to_address_norm IS NULL
+                LIMIT :limit
+            """), {"limit": batch_size}).fetchall()
+            if not rows:
+                break
+
+            params = []
+            for route_id, from_text, to_text in rows:
+                params.append({"id": route_id, **route_address_columns(from_text, to_text)})
+
+            conn.execute(text(f"""
+                UPDATE fixed_price_routes SET
+                    {", ".join(f"{column} = :{column}" for column in FIXED_PRICE_ROUTE_NORMALIZED_COLUMNS)}
+                WHERE id = :id
+            """), params)
+            backfilled += len(params)
+
+    if backfilled:
+        logger.info("✓ Backfilled normalized addresses for %s fixed price routes", backfilled)
+    return backfilled
+
+
+def ensure_notification_outbox(engine: Engine):
+    """Tạo bảng notification_outbox (kèm index) nếu chưa có, thêm cột claimed_at cho bảng cũ"""
+    models.NotificationOutbox.__table__.create(bind=engine, checkfirst=True)
+    existing_columns = {column["name"] for column in inspect(engine).get_columns("notification_outbox")}
+    if "claimed_at" not in existing_columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE notification_outbox ADD COLUMN claimed_at DATETIME"))
+        logger.info("✓ Added column notification_outbox.claimed_at")
@@ -1,10 +1,33 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import time
+
+from app.config.logging_config import setup_logging
+
+# Cấu hình logging trước khi import các module khác (một số module log ngay khi import)
+setup_logging()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 import uvicorn
 
 from app.api.routes import router as api_router
 from app.api.address import router as address_router
 from app.api.tier_routes import router as tier_router
+from app.utils.distance_providers import close_distance_providers
+from app.database.database import engine
+from app.database.migrations import migrate_fixed_price_routes, ensure_notification_outbox
+from app.utils.address_search_index import ensure_address_search_index
+from app.utils.admin_division_index import admin_division_index
+from app.utils.trip_log_writer import trip_log_writer
+from app.utils.notification_outbox import notification_dispatcher
+from app.services.geocoding_job import bulk_geocoding_job
+from app.utils.simple_email_service import simple_email_service
+from app.utils.metrics import metrics, CONTENT_TYPE, HTTP_REQUESTS, HTTP_REQUEST_DURATION
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
 
 # Khởi tạo FastAPI app
 app = FastAPI(
@@ -32,11 +55,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Đo thời gian mỗi request theo route template (VD: /api/bookings/{id}) để không bùng nổ số label
+if settings.METRICS_ENABLED:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method=request.method, route=path)
+            HTTP_REQUESTS.inc(method=request.method, route=path, status=status)
+
 # Include API routes
 app.include_router(api_router, prefix="/api", tags=["API"])
 app.include_router(address_router, prefix="/api/address", tags=["Address"])
 app.include_router(tier_router, prefix="/api", tags=["Tier Pricing"]) 
 
+# Đảm bảo schema đã có các cột/index mới (idempotent)
+@app.on_event("startup")
+async def run_migrations():
+    migrate_fixed_price_routes(engine)
+    ensure_notification_outbox(engine)
+    
+    # Index FTS5 cho /api/address/search (chỉ SQLite, dựng nếu chưa có)
+    if engine.dialect.name == "sqlite":
+        raw_conn = engine.raw_connection()
+        try:
+            built = ensure_address_search_index(raw_conn.driver_connection)
+            if built:
+                logger.info("✓ Built address search index: %s rows in %s ms", built['rows'], built['elapsed_ms'])
+        finally:
+            raw_conn.close()
+
+# Nạp cây tỉnh/huyện/xã vào memory cho /api/address/* (lỗi thì các API fallback về DB)
+@app.on_event("startup")
+async def load_admin_division_index():
+    if not settings.ADMIN_DIVISION_INDEX_ENABLED:
+        return
+    try:
+        admin_division_index.load()
+    except Exception as e:
+        logger.warning("⚠️ Admin division index not loaded: %s", e)
+
+# Thread nền ghi lịch sử chuyến đi theo batch
+@app.on_event("startup")
+async def start_trip_log_writer():
+    if settings.TRIP_LOG_ASYNC:
+        trip_log_writer.start()
+
+# Dispatcher gửi email/Telegram từ notification_outbox
+@app.on_event("startup")
+async def start_notification_dispatcher():
+    notification_dispatcher.start()
+
+# Đóng HTTP client/thread pool của distance provider khi tắt server
+@app.on_event("shutdown")
+async def shutdown_distance_providers():
+    await close_distance_providers()
+
+# Ghi nốt các trip còn trong queue trước khi tắt
+@app.on_event("shutdown")
+async def stop_trip_log_writer():
+    await asyncio.to_thread(trip_log_writer.stop)
+
+@app.on_event("shutdown")
+async def stop_notification_dispatcher():
+    await asyncio.to_thread(notification_dispatcher.stop)
+    simple_email_service.close()
+
+# Dừng job geocode hàng loạt sau lô hiện tại (lần chạy sau tiếp tục từ checkpoint)
+@app.on_event("shutdown")
+async def stop_bulk_geocoding_job():
+    await asyncio.to_thread(bulk_geocoding_job.stop)
+
 # Route cơ bản để test
 @app.get("/")
 async def root():
@@ -47,6 +143,11 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "API đang hoạt động tốt"}
 
+# Metrics cho Prometheus scrape
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
 # Chạy server nếu file được run trực tiếp
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -90,6 +90,14 @@ class FixedPriceRoute(Base):
     to_ward_id = Column(Integer)  # ID xã điểm đến (optional)
     to_address_text = Column(String, nullable=False)  # Tên địa chỉ đầy đủ điểm đến
     
+    # Dạng chuẩn hóa (tính khi ghi) để tìm kiếm bằng index
+    from_address_norm = Column(String)  # lowercase, bỏ dấu, bỏ dấu câu
+    to_address_norm = Column(String)
+    from_address_canonical = Column(String)  # tên tỉnh chuẩn + bỏ stopwords
+    to_address_canonical = Column(String)
+    from_province_key = Column(String)  # tỉnh chuẩn theo bảng synonyms (VD: "ho chi minh")
+    to_province_key = Column(String)
+    
     # Thông tin giá cố định
     fixed_price = Column(Float, nullable=False)  # Giá cố định cho tuyến này
     description = Column(String)  # Mô tả tuyến đường
@@ -100,6 +108,15 @@ class FixedPriceRoute(Base):
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        Index("ix_fixed_price_routes_norm_pair", "from_address_norm", "to_address_norm", "is_active"),
+        Index("ix_fixed_price_routes_to_norm", "to_address_norm"),
+        Index("ix_fixed_price_routes_province_key_pair", "from_province_key", "to_province_key", "is_active"),
+        Index("ix_fixed_price_routes_to_province_key", "to_province_key"),
+        Index("ix_fixed_price_routes_admin_ids", "from_province_id", "to_province_id", "from_district_id",
+              "to_district_id", "from_ward_id", "to_ward_id", "is_active"),
+    )
 
 class Booking(Base):
     """Bảng đặt chuyến đi với thông tin khách hàng"""
@@ -135,4 +152,55 @@ class Booking(Base):
     
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class RouteDistanceCache(Base):
+    """Bảng cache khoảng cách/thời gian theo cặp tọa độ (đã làm tròn)"""
+    __tablename__ = "route_distance_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, index=True, nullable=False)  # VD: "10.7626,106.6602|10.7326,106.7197"
+    distance_km = Column(Float, nullable=False)
+    duration_minutes = Column(Float)
+    method = Column(String)  # google_maps, ...
+    payload = Column(JSON)  # Kết quả đầy đủ (địa chỉ, polyline, route_info)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class GeocodingCacheInvalidation(Base):
+    """Nhật ký tọa độ vừa bị sửa - các worker đọc để xóa entry cũ trong cache geocoding của mình"""
+    __tablename__ = "geocoding_cache_invalidations"
+    
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, nullable=False)  # VD: "district:760", "*" = xóa toàn bộ
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class PricingConfigVersion(Base):
+    """Bảng 1 dòng lưu version cấu hình giá - tăng mỗi khi config/settings giá thay đổi"""
+    __tablename__ = "pricing_config_version"
+    
+    id = Column(Integer, primary_key=True)  # Luôn là 1
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class NotificationOutbox(Base):
+    """Hàng đợi thông báo (email/Telegram) ghi cùng transaction với booking, gửi bởi dispatcher nền"""
+    __tablename__ = "notification_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String, nullable=False)  # email, telegram
+    event = Column(String, nullable=False)  # new_booking
+    booking_id = Column(Integer, index=True)
+    payload = Column(JSON, nullable=False)  # Dữ liệu để dựng nội dung thông báo
+    status = Column(String, nullable=False, default="pending")  # pending, sending, sent, skipped, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = Column(DateTime)  # Lúc 1 dispatcher nhận dòng (lease cho trạng thái sending)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+    )
@@ -92,6 +92,8 @@ class TripCalculationRequest(BaseModel):
     # Thông tin bổ sung
     duration_minutes: Optional[float] = None
     vehicle_type: Optional[str] = "4_seats"
+    use_cache: Optional[bool] = True  # False = bỏ qua cache khoảng cách cho request này
+    include_breakdown: Optional[bool] = True  # False = không trả price_breakdown theo bậc (tier pricing)
     
     # Thông tin địa chỉ hành chính (cho fixed price)
     from_province_id: Optional[int] = None
@@ -101,6 +103,12 @@ class TripCalculationRequest(BaseModel):
     to_district_id: Optional[int] = None
     to_ward_id: Optional[int] = None
 
+class BatchTripCalculationRequest(BaseModel):
+    """Request tính giá hàng loạt nhiều chuyến đi"""
+    trips: List[TripCalculationRequest]
+    use_cache: Optional[bool] = True  # Áp dụng cho toàn bộ batch
+    save_trips: Optional[bool] = True
+
 class TripCalculationResponse(BaseModel):
     distance_km: float
     duration_minutes: float
@@ -0,0 +1,339 @@
+# backend/app/services/geocoding_job.py
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.database.database import SessionLocal
+from app.models import models
+from app.services.geocoding_service import GeocodingError, request_geocode
+from app.utils.admin_division_index import admin_division_index
+from app.utils.telegram_service import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+GEOCODING_LEVELS = ("province", "district", "ward")
+CHECKPOINT_SETTING_KEY = "geocoding_job_checkpoint"
+
+# Lấy từng lô đơn vị chưa có tọa độ theo id tăng dần, kèm tên các cấp cha để dựng địa chỉ
+_MISSING_QUERIES = {
+    "province": """
+        SELECT p.id, p.code, p.full_name, p.name
+        FROM provinces p
+        WHERE (p.latitude IS NULL OR p.longitude IS NULL) AND p.id > :last_id
+        ORDER BY p.id LIMIT :limit
+    """,
+    "district": """
+        SELECT d.id, d.code, d.full_name, d.name, p.full_name, p.name
+        FROM districts d
+        JOIN provinces p ON d.province_code = p.code
+        WHERE (d.latitude IS NULL OR d.longitude IS NULL) AND d.id > :last_id
+        ORDER BY d.id LIMIT :limit
+    """,
+    "ward": """
+        SELECT w.id, w.code, w.full_name, w.name, d.full_name, d.name, p.full_name, p.name
+        FROM wards w
+        JOIN districts d ON w.district_code = d.code
+        JOIN provinces p ON w.province_code = p.code
+        WHERE (w.latitude IS NULL OR w.longitude IS NULL) AND w.id > :last_id
+        ORDER BY w.id LIMIT :limit
+    """
+}
+
+# Lỗi tạm thời -> thử lại với backoff; REQUEST_DENIED (key sai/hết hạn) -> dừng cả job
+_RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "HTTP_ERROR"}
+_FATAL_STATUSES = {"REQUEST_DENIED"}
+
+# Đơn vị chưa được thử vì job đang dừng -> không tính là lỗi, checkpoint không vượt qua
+_SKIPPED = object()
+
+
+def build_division_address(row: Sequence) -> str:
+    """Địa chỉ geocode từ cấp nhỏ nhất lên tỉnh (cùng định dạng build_address_string)"""
+    names = row[2:]
+    parts = [names[i] or names[i + 1] for i in range(0, len(names), 2)]
+    return ", ".join(parts) + ", Vietnam"
+
+
+class BulkGeocodingJob:
+    """
+    Job nền điền tọa độ cho tỉnh/huyện/xã còn thiếu (province -> district -> ward).
+    - Mỗi lô batch_size đơn vị được geocode song song bằng pool max_workers thread,
+      tất cả cùng đi qua 1 token bucket rate_per_second
+    - Tọa độ của lô + checkpoint (cấp, id cuối) được commit trong cùng 1 transaction
+    - Chạy lại sau khi dừng/restart server thì tiếp tục từ checkpoint; các đơn vị geocode lỗi
+      được bỏ qua trong lượt đó và thử lại ở lượt sau (restart=True hoặc khi lượt trước đã xong)
+    """
+
+    def __init__(self, max_workers: int = 4, rate_per_second: float = 10, batch_size: int = 100,
+                 max_attempts: int = 3):
+        self.max_workers = max_workers
+        self.rate_per_second = rate_per_second
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._bucket: Optional[TokenBucket] = None
+        self._session: Optional[requests.Session] = None
+        self._fatal_error: Optional[str] = None
+        self._reset_progress()
+
+    def _reset_progress(self):
+        self.state = "idle"
+        self.levels: List[str] = list(GEOCODING_LEVELS)
+        self.current_level: Optional[str] = None
+        self.checkpoint: Optional[Dict] = None
+        self.limit: Optional[int] = None
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._started = 0.0
+        self._elapsed = 0.0
+        self.last_error: Optional[str] = None
+        self.stats_counters = {
+            "processed": 0,
+            "geocoded": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0
+        }
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ----- Điều khiển -----
+    def start(self, levels: Optional[List[str]] = None, restart: bool = False, limit: Optional[int] = None,
+              max_workers: Optional[int] = None, rate_per_second: Optional[float] = None) -> Dict:
+        """Bắt đầu (hoặc tiếp tục từ checkpoint) ở thread nền; trả về trạng thái"""
+        with self._lock:
+            if self.is_running:
+                raise RuntimeError("Geocoding job đang chạy")
+            levels = [level for level in GEOCODING_LEVELS if level in (levels or GEOCODING_LEVELS)]
+            if not levels:
+                raise ValueError("levels phải gồm province, district hoặc ward")
+
+            self._reset_progress()
+            self.levels = levels
+            self.limit = limit
+            if max_workers:
+                self.max_workers = max_workers
+            if rate_per_second:
+                self.rate_per_second = rate_per_second
+            self.state = "running"
+            self._stop.clear()
+            self._fatal_error = None
+            self._thread = threading.Thread(target=self._run, args=(restart,), name="bulk-geocoding", daemon=True)
+            self._thread.start()
+        return self.get_status()
+
+    def stop(self, timeout: float = 30.0):
+        """Dừng sau lô hiện tại (lô đó vẫn được commit cùng checkpoint)"""
+        if not self.is_running:
+            return
+        self.state = "stopping"
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+
+    # ----- Checkpoint (lưu trong bảng settings) -----
+    @staticmethod
+    def load_checkpoint(db: Session) -> Optional[Dict]:
+        setting = db.query(models.Settings).filter(models.Settings.key == CHECKPOINT_SETTING_KEY).first()
+        if not setting or not setting.value:
+            return None
+        try:
+            return json.loads(setting.value)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _save_checkpoint(db: Session, checkpoint: Dict):
+        """Ghi checkpoint vào transaction hiện tại (commit cùng tọa độ của lô)"""
+        value = json.dumps(checkpoint)
+        setting = db.query(models.Settings).filter(models.Settings.key == CHECKPOINT_SETTING_KEY).first()
+        if setting is None:
+            db.add(models.Settings(key=CHECKPOINT_SETTING_KEY, value=value,
+                                   description="Tiến độ job geocode hàng loạt (cấp, id cuối đã xử lý)"))
+        else:
+            setting.value = value
+
+    # ----- Geocode -----
+    def _acquire(self):
+        """Chờ tới lượt theo token bucket (dùng chung cho mọi worker)"""
+        with self._lock:
+            wait = self._bucket.wait_time()
+            self._bucket.take()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _geocode_one(self, api_key: str, level: str, row: Sequence):
+        """(id, code, lat, lng); None nếu không geocode được; _SKIPPED nếu job dừng trước khi có kết quả"""
+        address = build_division_address(row)
+        for attempt in range(1, self.max_attempts + 1):
+            if self._stop.is_set() or self._fatal_error:
+                return _SKIPPED
+            self._acquire()
+            try:
+                result = request_geocode(address, api_key, session=self._session)
+                return row[0], row[1], result["latitude"], result["longitude"]
+            except GeocodingError as e:
+                if e.status in _FATAL_STATUSES:
+                    self._fatal_error = str(e)
+                    return None
+                if e.status not in _RETRYABLE_STATUSES or attempt == self.max_attempts:
+                    logger.debug("❌ Geocode %s %s (%s) failed: %s", level, row[1], address, e)
+                    return None
+                self.stats_counters["retries"] += 1
+                time.sleep(min(2 ** attempt * 0.5, 10))
+        return None
+
+    def _run(self, restart: bool):
+        self._started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self._bucket = TokenBucket(self.rate_per_second, max(1.0, self.rate_per_second))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="geocode")
+        db = SessionLocal()
+        try:
+            api_key = self._api_key(db)
+            checkpoint = None if restart else self.load_checkpoint(db)
+            if checkpoint and (checkpoint.get("completed") or checkpoint.get("level") not in self.levels):
+                checkpoint = None
+            start_level = checkpoint["level"] if checkpoint else self.levels[0]
+            logger.info("🌍 Bulk geocoding started (%s, resume=%s)", ", ".join(self.levels), bool(checkpoint))
+
+            for level in self.levels[self.levels.index(start_level):]:
+                last_id = checkpoint["last_id"] if checkpoint and checkpoint["level"] == level else 0
+                self.current_level = level
+                if not self._run_level(db, executor, api_key, level, last_id):
+                    break
+            else:
+                self.checkpoint = {"completed": True, "finished_at": datetime.utcnow().isoformat()}
+                self._save_checkpoint(db, self.checkpoint)
+                db.commit()
+
+            if self._fatal_error:
+                self.state, self.last_error = "failed", self._fatal_error
+            elif self._stop.is_set():
+                self.state = "stopped"
+            elif self.limit is not None and self.stats_counters["processed"] >= self.limit:
+                self.state = "paused"
+            else:
+                self.state = "completed"
+        except Exception as e:
+            db.rollback()
+            self.state, self.last_error = "failed", str(e)
+            logger.exception("❌ Bulk geocoding failed")
+        finally:
+            executor.shutdown(wait=True)
+            self._session.close()
+            db.close()
+            self.finished_at = datetime.utcnow()
+            self._elapsed = time.perf_counter() - self._started
+            logger.info("🌍 Bulk geocoding %s: %s geocoded, %s failed in %.1fs",
+                        self.state, self.stats_counters["geocoded"], self.stats_counters["failed"], self._elapsed)
+
+    @staticmethod
+    def _api_key(db: Session) -> str:
+        setting = db.query(models.Settings).filter(models.Settings.key == "google_maps_api_key").first()
+        if not setting or not setting.value or setting.value == "YOUR_API_KEY_HERE":
+            raise RuntimeError("No Google Maps API key available")
+        return setting.value
+
+    def _run_level(self, db: Session, executor: ThreadPoolExecutor, api_key: str, level: str, last_id: int) -> bool:
+        """Xử lý 1 cấp theo từng lô; False nếu phải dừng giữa chừng"""
+        table = f"{level}s"
+        update = text(f"UPDATE {table} SET latitude = :lat, longitude = :lng WHERE id = :id")
+        while True:
+            if self._stop.is_set() or self._fatal_error:
+                return False
+            size = self.batch_size
+            if self.limit is not None:
+                size = min(size, self.limit - self.stats_counters["processed"])
+                if size <= 0:
+                    return False
+
+            rows = db.execute(text(_MISSING_QUERIES[level]), {"last_id": last_id, "limit": size}).fetchall()
+            if not rows:
+                return True
+
+            results = list(executor.map(lambda row: self._geocode_one(api_key, level, row), rows))
+            if self._fatal_error:
+                # Không ghi checkpoint: lô này chưa thực sự được thử
+                return False
+            if _SKIPPED in results:
+                # Dừng giữa lô: chỉ ghi phần đầu lô đã thử, phần còn lại làm ở lần chạy sau
+                attempted = results.index(_SKIPPED)
+                if not attempted:
+                    return False
+                rows, results = rows[:attempted], results[:attempted]
+            geocoded = [result for result in results if result is not None]
+            if geocoded:
+                db.execute(update, [{"id": row_id, "lat": lat, "lng": lng} for row_id, _, lat, lng in geocoded])
+            last_id = rows[-1][0]
+            self.checkpoint = {"level": level, "last_id": last_id, "updated_at": datetime.utcnow().isoformat()}
+            self._save_checkpoint(db, self.checkpoint)
+            db.commit()
+
+            for _, code, lat, lng in geocoded:
+                admin_division_index.update_coordinates(level, code, lat, lng)
+            self.stats_counters["batches"] += 1
+            self.stats_counters["processed"] += len(rows)
+            self.stats_counters["geocoded"] += len(geocoded)
+            self.stats_counters["failed"] += len(rows) - len(geocoded)
+
+    # ----- Trạng thái -----
+    @staticmethod
+    def count_missing(db: Session) -> Dict[str, int]:
+        return {
+            level: db.execute(text(
+                f"SELECT COUNT(*) FROM {level}s WHERE latitude IS NULL OR longitude IS NULL"
+            )).scalar()
+            for level in GEOCODING_LEVELS
+        }
+
+    def get_status(self, db: Optional[Session] = None) -> Dict:
+        elapsed = time.perf_counter() - self._started if self.is_running else self._elapsed
+        status = {
+            "state": self.state,
+            "running": self.is_running,
+            "levels": self.levels,
+            "current_level": self.current_level,
+            "checkpoint": self.checkpoint,
+            **self.stats_counters,
+            "limit": self.limit,
+            "workers": self.max_workers,
+            "rate_per_second": self.rate_per_second,
+            "batch_size": self.batch_size,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 1),
+            "items_per_second": round(self.stats_counters["processed"] / elapsed, 2) if elapsed > 0 else None,
+            "last_error": self.last_error
+        }
+        if db is not None:
+            status["missing"] = self.count_missing(db)
+            if not self.is_running and status["checkpoint"] is None:
+                status["checkpoint"] = self.load_checkpoint(db)
+        return status
+
+
+# Singleton instance
+bulk_geocoding_job = BulkGeocodingJob(
+    max_workers=settings.GEOCODING_JOB_WORKERS,
+    rate_per_second=settings.GEOCODING_JOB_RATE_PER_SECOND,
+    batch_size=settings.GEOCODING_JOB_BATCH_SIZE
+)
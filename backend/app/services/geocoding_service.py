@@ -1,3 +1,4 @@
+import logging
 import requests
 import asyncio
 from typing import Dict, Optional, Tuple
@@ -6,10 +7,55 @@ from sqlalchemy import text
 import os
 import json
 
+from app.config.settings import settings
+from app.utils.admin_division_index import admin_division_index
+from app.utils.geocoding_cache import geocoding_cache
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_PATH = "/maps/api/geocode/json"
+
+
+class GeocodingError(Exception):
+    """Geocoding API không trả tọa độ (status: ZERO_RESULTS, OVER_QUERY_LIMIT, REQUEST_DENIED, HTTP_ERROR, ...)"""
+
+    def __init__(self, status: str, message: str = ""):
+        super().__init__(f"{status} {message}".strip())
+        self.status = status
+
+
+def request_geocode(address: str, api_key: str, session: Optional[requests.Session] = None, timeout: float = 10) -> Dict:
+    """Gọi Google Geocoding API (đồng bộ), trả về dict tọa độ hoặc raise GeocodingError"""
+    params = {
+        'address': address,
+        'key': api_key,
+        'region': 'vn',  # Ưu tiên kết quả ở Vietnam
+        'language': 'vi'
+    }
+    try:
+        response = (session or requests).get(settings.GOOGLE_MAPS_BASE_URL.rstrip("/") + GEOCODE_PATH,
+                                             params=params, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise GeocodingError("HTTP_ERROR", str(e))
+
+    data = response.json()
+    if data.get('status') != 'OK' or not data.get('results'):
+        raise GeocodingError(data.get('status', 'UNKNOWN'), data.get('error_message', ''))
+
+    location = data['results'][0]['geometry']['location']
+    return {
+        "latitude": location['lat'],
+        "longitude": location['lng'],
+        "formatted_address": data['results'][0]['formatted_address'],
+        "source": "google_maps"
+    }
+
+
 class SmartGeocodingService:
     def __init__(self):
         self.google_maps_api_key = None
-        self.cache = {}  # In-memory cache cho session
+        self.cache = geocoding_cache  # LRU/TTL dùng chung, tự xóa entry khi tọa độ bị sửa
     
     def set_api_key(self, api_key: str):
         """Set Google Maps API key"""
@@ -24,7 +70,7 @@ class SmartGeocodingService:
                 self.google_maps_api_key = result[0]
                 return result[0]
         except Exception as e:
-            print(f"⚠️ Could not get API key from database: {e}")
+            logger.warning("⚠️ Could not get API key from database: %s", e)
         return None
     
     def build_address_string(self, level: str, code: str, db: Session) -> str:
@@ -70,54 +116,28 @@ class SmartGeocodingService:
             return ", ".join(address_parts) + ", Vietnam"
             
         except Exception as e:
-            print(f"❌ Error building address string: {e}")
+            logger.error("❌ Error building address string: %s", e)
             return ""
     
     async def geocode_with_google_maps(self, address: str) -> Optional[Dict]:
         """Gọi Google Maps Geocoding API"""
         if not self.google_maps_api_key:
-            print("❌ No Google Maps API key available")
+            logger.error("❌ No Google Maps API key available")
             return None
         
         try:
-            url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                'address': address,
-                'key': self.google_maps_api_key,
-                'region': 'vn',  # Ưu tiên kết quả ở Vietnam
-                'language': 'vi'
-            }
-            
-            print(f"🌍 Geocoding address: {address}")
-            
-            # Sử dụng requests để gọi API đồng bộ
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data['status'] == 'OK' and len(data['results']) > 0:
-                location = data['results'][0]['geometry']['location']
-                formatted_address = data['results'][0]['formatted_address']
-                
-                result = {
-                    "latitude": location['lat'],
-                    "longitude": location['lng'],
-                    "formatted_address": formatted_address,
-                    "source": "google_maps"
-                }
-                
-                print(f"✅ Geocoded successfully: ({result['latitude']}, {result['longitude']})")
-                return result
+            logger.debug("🌍 Geocoding address: %s", address)
+            result = request_geocode(address, self.google_maps_api_key)
+            logger.debug("✅ Geocoded successfully: (%s, %s)", result['latitude'], result['longitude'])
+            return result
+        except GeocodingError as e:
+            if e.status == "HTTP_ERROR":
+                logger.error("❌ Google Maps API request failed: %s", e)
             else:
-                print(f"❌ Geocoding failed: {data['status']}")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Google Maps API request failed: {e}")
+                logger.error("❌ Geocoding failed: %s", e.status)
             return None
         except Exception as e:
-            print(f"❌ Geocoding error: {e}")
+            logger.error("❌ Geocoding error: %s", e)
             return None
     
     async def save_coordinates_to_db(
@@ -144,12 +164,14 @@ class SmartGeocodingService:
                 "code": code
             })
             db.commit()
+            admin_division_index.update_coordinates(level, code, latitude, longitude)
+            self.cache.invalidate(level, code, db)
             
-            print(f"✅ Saved coordinates for {level} {code}: ({latitude}, {longitude})")
+            logger.info("✅ Saved coordinates for %s %s: (%s, %s)", level, code, latitude, longitude)
             return True
             
         except Exception as e:
-            print(f"❌ Failed to save coordinates: {e}")
+            logger.error("❌ Failed to save coordinates: %s", e)
             db.rollback()
             return False
     
@@ -163,9 +185,10 @@ class SmartGeocodingService:
         
         # Kiểm tra in-memory cache trước
         cache_key = f"{level}:{code}"
-        if cache_key in self.cache:
-            print(f"🎯 Cache hit for {cache_key}")
-            return self.cache[cache_key]
+        cached = self.cache.get(level, code, db)
+        if cached:
+            logger.debug("🎯 Cache hit for %s", cache_key)
+            return cached
         
         # Kiểm tra database
         try:
@@ -188,15 +211,15 @@ class SmartGeocodingService:
                 }
                 
                 # Lưu vào cache
-                self.cache[cache_key] = coordinates
-                print(f"💾 Database hit for {cache_key}")
+                self.cache.set(level, code, coordinates)
+                logger.debug("💾 Database hit for %s", cache_key)
                 return coordinates
             
-            print(f"❌ No coordinates found for {cache_key}")
+            logger.debug("❌ No coordinates found for %s", cache_key)
             return None
             
         except Exception as e:
-            print(f"❌ Error getting coordinates from DB: {e}")
+            logger.error("❌ Error getting coordinates from DB: %s", e)
             return None
     
     async def smart_geocode(
@@ -266,12 +289,11 @@ class SmartGeocodingService:
         
         if saved:
             # Cập nhật cache
-            cache_key = f"{level}:{code}"
-            self.cache[cache_key] = {
+            self.cache.set(level, code, {
                 "latitude": geocoded["latitude"],
                 "longitude": geocoded["longitude"],
                 "source": "google_maps_cached"
-            }
+            })
         
         return {
             "success": True,
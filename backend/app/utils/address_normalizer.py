@@ -0,0 +1,167 @@
+# backend/app/utils/address_normalizer.py
+
+import re
+import unicodedata
+from typing import Dict, FrozenSet, List, Optional
+
+# Từ khóa đồng nghĩa cho các tỉnh/thành phố phổ biến (tên chuẩn -> các cách viết khác)
+PROVINCE_SYNONYMS: Dict[str, List[str]] = {
+    'hồ chí minh': ['tp.hcm', 'tphcm', 'ho chi minh', 'thành phố hồ chí minh', 'saigon', 'sài gòn', 'hcm'],
+    'hà nội': ['hanoi', 'thủ đô', 'thành phố hà nội', 'hn'],
+    'đà nẵng': ['da nang', 'thành phố đà nẵng', 'danang'],
+    'cần thơ': ['can tho', 'thành phố cần thơ', 'cantho'],
+    'bến tre': ['ben tre', 'tỉnh bến tre', 'bentre'],
+    'an giang': ['angiang', 'tỉnh an giang'],
+    'bà rịa vũng tàu': ['ba ria vung tau', 'vung tau', 'vũng tàu', 'brvt'],
+    'bắc giang': ['bac giang', 'tỉnh bắc giang'],
+    'bắc kạn': ['bac kan', 'tỉnh bắc kạn'],
+    'bạc liêu': ['bac lieu', 'tỉnh bạc liêu'],
+    'bắc ninh': ['bac ninh', 'tỉnh bắc ninh'],
+    'bình định': ['binh dinh', 'tỉnh bình định'],
+    'bình dương': ['binh duong', 'tỉnh bình dương'],
+    'bình phước': ['binh phuoc', 'tỉnh bình phước'],
+    'bình thuận': ['binh thuan', 'tỉnh bình thuận'],
+    'cà mau': ['ca mau', 'tỉnh cà mau'],
+    'cao bằng': ['cao bang', 'tỉnh cao bằng'],
+    'đắk lắk': ['dak lak', 'đắk lắk', 'daklak'],
+    'đắk nông': ['dak nong', 'đắk nông'],
+    'điện biên': ['dien bien', 'tỉnh điện biên'],
+    'đồng nai': ['dong nai', 'tỉnh đồng nai'],
+    'đồng tháp': ['dong thap', 'tỉnh đồng tháp'],
+    'gia lai': ['gialai', 'tỉnh gia lai'],
+    'hà giang': ['ha giang', 'tỉnh hà giang'],
+    'hà nam': ['ha nam', 'tỉnh hà nam'],
+    'hà tĩnh': ['ha tinh', 'tỉnh hà tĩnh'],
+    'hải dương': ['hai duong', 'tỉnh hải dương'],
+    'hải phòng': ['hai phong', 'thành phố hải phòng'],
+    'hậu giang': ['hau giang', 'tỉnh hậu giang'],
+    'hòa bình': ['hoa binh', 'tỉnh hòa bình'],
+    'hưng yên': ['hung yen', 'tỉnh hưng yên'],
+    'khánh hòa': ['khanh hoa', 'tỉnh khánh hòa', 'nha trang'],
+    'kiên giang': ['kien giang', 'tỉnh kiên giang'],
+    'kon tum': ['kontum', 'tỉnh kon tum'],
+    'lai châu': ['lai chau', 'tỉnh lai châu'],
+    'lâm đồng': ['lam dong', 'tỉnh lâm đồng', 'đà lạt'],
+    'lạng sơn': ['lang son', 'tỉnh lạng sơn'],
+    'lào cai': ['lao cai', 'tỉnh lào cai'],
+    'long an': ['longan', 'tỉnh long an'],
+    'nam định': ['nam dinh', 'tỉnh nam định'],
+    'nghệ an': ['nghe an', 'tỉnh nghệ an'],
+    'ninh bình': ['ninh binh', 'tỉnh ninh bình'],
+    'ninh thuận': ['ninh thuan', 'tỉnh ninh thuận'],
+    'phú thọ': ['phu tho', 'tỉnh phú thọ'],
+    'phú yên': ['phu yen', 'tỉnh phú yên'],
+    'quảng bình': ['quang binh', 'tỉnh quảng bình'],
+    'quảng nam': ['quang nam', 'tỉnh quảng nam'],
+    'quảng ngãi': ['quang ngai', 'tỉnh quảng ngãi'],
+    'quảng ninh': ['quang ninh', 'tỉnh quảng ninh', 'hạ long'],
+    'quảng trị': ['quang tri', 'tỉnh quảng trị'],
+    'sóc trăng': ['soc trang', 'tỉnh sóc trăng'],
+    'sơn la': ['son la', 'tỉnh sơn la'],
+    'tây ninh': ['tay ninh', 'tỉnh tây ninh'],
+    'thái bình': ['thai binh', 'tỉnh thái bình'],
+    'thái nguyên': ['thai nguyen', 'tỉnh thái nguyên'],
+    'thanh hóa': ['thanh hoa', 'tỉnh thanh hóa'],
+    'thừa thiên huế': ['thua thien hue', 'huế', 'hue', 'tỉnh thừa thiên huế'],
+    'tiền giang': ['tien giang', 'tỉnh tiền giang'],
+    'trà vinh': ['tra vinh', 'tỉnh trà vinh'],
+    'tuyên quang': ['tuyen quang', 'tỉnh tuyên quang'],
+    'vĩnh long': ['vinh long', 'tỉnh vĩnh long'],
+    'vĩnh phúc': ['vinh phuc', 'tỉnh vĩnh phúc'],
+    'yên bái': ['yen bai', 'tỉnh yên bái']
+}
+
+# Từ bỏ qua khi so khớp mờ (đã bỏ dấu)
+ADDRESS_STOPWORDS = {'tinh', 'thanh', 'pho', 'tp', 'vietnam', 'vn'}
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def remove_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt (NFD + loại ký tự tổ hợp, đ -> d)"""
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+
+
+def normalize_address(text: Optional[str]) -> str:
+    """Chuẩn hóa địa chỉ: lowercase, bỏ dấu, bỏ dấu câu, gộp khoảng trắng"""
+    if not text:
+        return ""
+    folded = remove_diacritics(text.lower().strip())
+    return _NON_WORD.sub(' ', folded).strip()
+
+
+def clean_address(normalized: str) -> str:
+    """Bỏ stopwords và từ 1 ký tự (trừ số, VD: "quan 1") khỏi địa chỉ đã chuẩn hóa"""
+    if normalized.endswith(' viet nam'):
+        normalized = normalized[:-len(' viet nam')]
+    return ' '.join(
+        word for word in normalized.split()
+        if word not in ADDRESS_STOPWORDS and (len(word) > 1 or word.isdigit())
+    )
+
+
+def _build_province_lookup() -> Dict[str, str]:
+    """Dựng bảng tra: mọi cách viết (đã chuẩn hóa) -> tên tỉnh chuẩn (đã chuẩn hóa)"""
+    lookup = {}
+    for main_name, synonym_list in PROVINCE_SYNONYMS.items():
+        canonical = normalize_address(main_name)
+        for variant in [main_name] + synonym_list:
+            lookup[normalize_address(variant)] = canonical
+    return lookup
+
+
+# Bảng tra tỉnh chuẩn, dựng 1 lần khi import
+PROVINCE_LOOKUP: Dict[str, str] = _build_province_lookup()
+_MAX_VARIANT_WORDS = max(len(variant.split()) for variant in PROVINCE_LOOKUP)
+
+
+def canonical_provinces(normalized: str) -> FrozenSet[str]:
+    """Các tỉnh (tên chuẩn) được nhắc tới trong địa chỉ đã chuẩn hóa"""
+    words = normalized.split()
+    found = set()
+    for size in range(1, _MAX_VARIANT_WORDS + 1):
+        for start in range(0, len(words) - size + 1):
+            canonical = PROVINCE_LOOKUP.get(' '.join(words[start:start + size]))
+            if canonical:
+                found.add(canonical)
+    return frozenset(found)
+
+
+def canonical_province(normalized: str) -> Optional[str]:
+    """Tỉnh chuẩn duy nhất của địa chỉ (None nếu không có hoặc nhắc tới nhiều tỉnh)"""
+    provinces = canonical_provinces(normalized)
+    return next(iter(provinces)) if len(provinces) == 1 else None
+
+
+def canonicalize_address(normalized: str) -> str:
+    """
+    Dạng chuẩn để so khớp: thay mọi cách viết tỉnh bằng tên chuẩn (ưu tiên cụm dài nhất)
+    và bỏ stopwords. VD: "quan 1 tp hcm" và "quan 1 thanh pho ho chi minh" -> "quan 1 ho chi minh"
+    """
+    words = normalized.split()
+    result = []
+    i = 0
+    while i < len(words):
+        for size in range(min(_MAX_VARIANT_WORDS, len(words) - i), 0, -1):
+            canonical = PROVINCE_LOOKUP.get(' '.join(words[i:i + size]))
+            if canonical:
+                result.append(canonical)
+                i += size
+                break
+        else:
+            result.append(words[i])
+            i += 1
+    return clean_address(' '.join(result))
+
+
+def route_address_columns(from_address: Optional[str], to_address: Optional[str]) -> Dict[str, Optional[str]]:
+    """Giá trị các cột chuẩn hóa của fixed_price_routes (tính khi ghi)"""
+    columns = {}
+    for prefix, text in (("from", from_address), ("to", to_address)):
+        normalized = normalize_address(text)
+        columns[f"{prefix}_address_norm"] = normalized
+        columns[f"{prefix}_address_canonical"] = canonicalize_address(normalized)
+        columns[f"{prefix}_province_key"] = canonical_province(normalized)
+    return columns
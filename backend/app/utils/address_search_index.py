@@ -0,0 +1,205 @@
+# backend/app/utils/address_search_index.py
+"""
+Index FTS5 cho tìm kiếm tỉnh/huyện/xã (autocomplete).
+Chỉ phụ thuộc sqlite3 + address_normalizer để script import_vietnam_address.py dùng chung được.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+from app.utils.address_normalizer import normalize_address
+
+FTS_TABLE = "address_search_fts"
+
+# Tiền tố cấp hành chính (đã bỏ dấu) - bỏ đi để có tên ngắn, VD: "phuong phuc xa" -> "phuc xa"
+ADMIN_PREFIXES = (
+    "thanh pho", "thi tran", "thi xa", "tinh", "quan", "huyen", "phuong", "xa"
+)
+
+# Thứ tự ưu tiên khi điểm bằng nhau
+LEVEL_ORDER = {"province": 0, "district": 1, "ward": 2}
+
+
+def short_name(normalized_name: str) -> str:
+    """Tên đã bỏ dấu, không kèm tiền tố cấp hành chính"""
+    for prefix in ADMIN_PREFIXES:
+        if normalized_name.startswith(prefix + " "):
+            return normalized_name[len(prefix) + 1:]
+    return normalized_name
+
+
+def fts5_available(conn) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.__fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE IF EXISTS temp.__fts5_probe")
+        return True
+    except Exception:
+        return False
+
+
+def create_address_search_index(conn):
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            name_folded,
+            short_folded,
+            context_folded,
+            level UNINDEXED,
+            code UNINDEXED,
+            name UNINDEXED,
+            full_name UNINDEXED,
+            parent_code UNINDEXED,
+            parent_name UNINDEXED,
+            district_name UNINDEXED,
+            province_name UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+
+
+def rebuild_address_search_index(conn) -> Dict:
+    """
+    Dựng lại toàn bộ index từ bảng provinces/districts/wards.
+    conn: kết nối sqlite3 (DB-API). Gọi sau khi import dữ liệu địa chỉ.
+    """
+    started = time.perf_counter()
+    create_address_search_index(conn)
+    conn.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def row(level, code, name, full_name, context, parent_code=None, parent_name=None,
+            district_name=None, province_name=None):
+        folded = normalize_address(name)
+        return (folded, short_name(folded), normalize_address(context), level, code, name, full_name,
+                parent_code, parent_name, district_name, province_name)
+
+    rows = []
+    for code, name, full_name in conn.execute("SELECT code, name, full_name FROM provinces"):
+        rows.append(row("province", code, name, full_name, ""))
+
+    for code, name, full_name, province_code, province_name in conn.execute("""
+        SELECT d.code, d.name, d.full_name, d.province_code, p.name
+        FROM districts d JOIN provinces p ON d.province_code = p.code
+    """):
+        rows.append(row("district", code, name, full_name, province_name,
+                        parent_code=province_code, parent_name=province_name))
+
+    for code, name, full_name, district_code, district_name, province_name in conn.execute("""
+        SELECT w.code, w.name, w.full_name, w.district_code, d.name, p.name
+        FROM wards w
+        JOIN districts d ON w.district_code = d.code
+        JOIN provinces p ON w.province_code = p.code
+    """):
+        rows.append(row("ward", code, name, full_name, f"{district_name} {province_name}",
+                        parent_code=district_code, district_name=district_name, province_name=province_name))
+
+    conn.executemany(f"""
+        INSERT INTO {FTS_TABLE} (name_folded, short_folded, context_folded, level, code, name, full_name,
+                                 parent_code, parent_name, district_name, province_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    conn.commit()
+
+    return {"rows": len(rows), "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def ensure_address_search_index(conn) -> Optional[Dict]:
+    """Dựng index nếu chưa có hoặc lệch số dòng với dữ liệu gốc. None nếu không cần/không thể"""
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not {"provinces", "districts", "wards"} <= tables or not fts5_available(conn):
+        return None
+
+    expected = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in ("provinces", "districts", "wards"))
+    if FTS_TABLE in tables:
+        indexed = conn.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}").fetchone()[0]
+        if indexed == expected:
+            return None
+    return rebuild_address_search_index(conn)
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """Chuyển từ khóa người dùng thành biểu thức MATCH: mọi từ đều phải khớp tiền tố"""
+    tokens = normalize_address(q).split()
+    if not tokens:
+        return None
+    return " AND ".join(f'"{token}"*' for token in tokens)
+
+
+def search_address_index(conn, q: str, level: str = "all", limit: int = 20) -> List[Dict]:
+    """
+    Tìm trong index, xếp hạng: khớp tiền tố tên ngắn > khớp trong tên > khớp theo tỉnh/huyện cha,
+    sau đó theo bm25 và cấp hành chính.
+    """
+    match = build_match_query(q)
+    if not match:
+        return []
+
+    params = {"match": match, "candidates": max(limit * 5, 50)}
+    level_filter = ""
+    if level in LEVEL_ORDER:
+        level_filter = "AND level = :level"
+        params["level"] = level
+
+    query_folded = normalize_address(q)
+    query_tokens = query_folded.split()
+    select = f"""
+        SELECT level, code, name, full_name, parent_code, parent_name, district_name, province_name,
+               name_folded, short_folded, bm25({FTS_TABLE}, 5.0, 10.0, 1.0) AS score
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH :match {level_filter}
+        ORDER BY score
+        LIMIT :candidates
+    """
+
+    # 1. Tên (bỏ tiền tố cấp hành chính) bắt đầu bằng cụm từ khóa - ứng viên tốt nhất cho autocomplete
+    rows = conn.execute(select, {
+        **params, "match": f'short_folded : ^"{query_folded}"*', "candidates": limit
+    }).fetchall()
+    # 2. Mọi từ khớp tiền tố ở tên hoặc tên tỉnh/huyện cha
+    seen = {(r[0], r[1]) for r in rows}
+    rows += [r for r in conn.execute(select, params).fetchall() if (r[0], r[1]) not in seen]
+
+    def rank(r):
+        name_folded, short_folded, score = r[8], r[9], r[10]
+        short_words = short_folded.split()
+        if short_folded.startswith(query_folded) or name_folded.startswith(query_folded):
+            tier = 0
+        elif all(any(word.startswith(token) for word in short_words) for token in query_tokens):
+            tier = 1
+        else:
+            tier = 2
+        return tier, LEVEL_ORDER.get(r[0], 3), score, len(name_folded)
+
+    results = []
+    for r in sorted(rows, key=rank)[:limit]:
+        level_name, code, name, full_name, parent_code, parent_name, district_name, province_name = r[:8]
+        if level_name == "province":
+            results.append({
+                "type": "province",
+                "code": code,
+                "name": name,
+                "full_name": full_name,
+                "display_name": full_name or name
+            })
+        elif level_name == "district":
+            results.append({
+                "type": "district",
+                "code": code,
+                "name": name,
+                "full_name": full_name,
+                "parent_code": parent_code,
+                "parent_name": parent_name,
+                "display_name": f"{full_name or name}, {parent_name}"
+            })
+        else:
+            results.append({
+                "type": "ward",
+                "code": code,
+                "name": name,
+                "full_name": full_name,
+                "district_code": parent_code,
+                "district_name": district_name,
+                "province_name": province_name,
+                "display_name": f"{full_name or name}, {district_name}, {province_name}"
+            })
+    return results
@@ -0,0 +1,432 @@
+# backend/app/utils/admin_division_index.py
+
+import logging
+import math
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.database.database import SessionLocal
+from app.utils.address_normalizer import normalize_address
+from app.utils.address_search_index import short_name, LEVEL_ORDER
+
+logger = logging.getLogger(__name__)
+
+
+class DivisionNode:
+    """1 đơn vị hành chính (tỉnh/huyện/xã) kèm con trỏ tới cấp cha"""
+    __slots__ = ("level", "id", "code", "name", "full_name", "division_type",
+                 "latitude", "longitude", "parent", "children", "name_folded", "short_folded")
+
+    def __init__(self, level: str, id: int, code: str, name: str, full_name: Optional[str],
+                 latitude=None, longitude=None, division_type: Optional[str] = None,
+                 parent: Optional["DivisionNode"] = None):
+        self.level = level
+        self.id = id
+        self.code = code
+        self.name = name
+        self.full_name = full_name
+        self.division_type = division_type
+        self.latitude = float(latitude) if latitude is not None else None
+        self.longitude = float(longitude) if longitude is not None else None
+        self.parent = parent
+        self.children: List["DivisionNode"] = []
+        self.name_folded = normalize_address(name)
+        self.short_folded = short_name(self.name_folded)
+
+    @property
+    def has_coordinates(self) -> bool:
+        return self.latitude is not None and self.longitude is not None
+
+    def to_search_result(self) -> Dict:
+        """Cùng định dạng với kết quả /api/address/search"""
+        if self.level == "province":
+            return {
+                "type": "province",
+                "code": self.code,
+                "name": self.name,
+                "full_name": self.full_name,
+                "display_name": self.full_name or self.name
+            }
+        if self.level == "district":
+            province = self.parent
+            return {
+                "type": "district",
+                "code": self.code,
+                "name": self.name,
+                "full_name": self.full_name,
+                "parent_code": province.code,
+                "parent_name": province.name,
+                "display_name": f"{self.full_name or self.name}, {province.name}"
+            }
+        district = self.parent
+        province = district.parent
+        return {
+            "type": "ward",
+            "code": self.code,
+            "name": self.name,
+            "full_name": self.full_name,
+            "district_code": district.code,
+            "district_name": district.name,
+            "province_name": province.name,
+            "display_name": f"{self.full_name or self.name}, {district.name}, {province.name}"
+        }
+
+
+KM_PER_DEGREE_LAT = 110.57
+KM_PER_DEGREE_LNG = 111.32  # Tại xích đạo, nhân cos(vĩ độ)
+
+
+def approx_distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Khoảng cách xấp xỉ (equirectangular) - đủ chính xác ở cự ly vài chục km, nhanh hơn Haversine"""
+    dx = (lng2 - lng1) * KM_PER_DEGREE_LNG * math.cos(math.radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * KM_PER_DEGREE_LAT
+    return math.hypot(dx, dy)
+
+
+class _PointGrid:
+    """Lưới đều theo độ: ô (hàng, cột) -> các node có tọa độ nằm trong ô, dùng tìm điểm gần nhất"""
+
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        self.cells: Dict[tuple, List[DivisionNode]] = {}
+        self.size = 0
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add(self, node: DivisionNode):
+        self.cells.setdefault(self._cell(node.latitude, node.longitude), []).append(node)
+        self.size += 1
+
+    def remove(self, node: DivisionNode):
+        cell = self._cell(node.latitude, node.longitude)
+        nodes = self.cells.get(cell)
+        if nodes and node in nodes:
+            nodes.remove(node)
+            self.size -= 1
+            if not nodes:
+                del self.cells[cell]
+
+    def nearest(self, lat: float, lng: float, max_km: float) -> Optional[tuple]:
+        """(node, km) gần nhất trong bán kính max_km: quét các vòng ô quanh điểm, dừng khi vòng kế tiếp chắc chắn xa hơn"""
+        if not self.size:
+            return None
+        row, col = self._cell(lat, lng)
+        # Cận dưới (km) của 1 ô theo phương kinh độ - hẹp hơn phương vĩ độ
+        cell_km = self.cell_degrees * KM_PER_DEGREE_LNG * math.cos(math.radians(min(abs(lat) + self.cell_degrees, 89)))
+        max_ring = int(max_km / cell_km) + 1
+        best, best_km = None, max_km
+        for ring in range(max_ring + 1):
+            if best is not None and (ring - 1) * cell_km > best_km:
+                break
+            for r in range(row - ring, row + ring + 1):
+                edge = r in (row - ring, row + ring)
+                for c in (range(col - ring, col + ring + 1) if edge else (col - ring, col + ring)):
+                    for node in self.cells.get((r, c), ()):
+                        km = approx_distance_km(lat, lng, node.latitude, node.longitude)
+                        if km <= best_km:
+                            best, best_km = node, km
+        return (best, best_km) if best is not None else None
+
+
+class _IndexData:
+    """Dữ liệu bất biến của 1 lần build (thay nguyên khối khi reload)"""
+
+    def __init__(self):
+        self.nodes: List[DivisionNode] = []
+        self.by_code: Dict[str, Dict[str, DivisionNode]] = {"province": {}, "district": {}, "ward": {}}
+        self.provinces: List[DivisionNode] = []
+        # Mảng đã sắp xếp cho tìm tiền tố: cụm tên (và các hậu tố theo từ) -> node
+        self.phrase_keys: List[str] = []
+        self.phrase_nodes: List[int] = []
+        # Mảng từ đã sắp xếp (tên + tên cấp cha) -> danh sách node
+        self.words: List[str] = []
+        self.word_nodes: List[List[int]] = []
+        # Lưới tọa độ theo cấp cho reverse lookup (tọa độ -> đơn vị hành chính)
+        self.grids: Dict[str, _PointGrid] = {
+            level: _PointGrid(cell) for level, cell in (("province", 0.5), ("district", 0.1), ("ward", 0.03))
+        }
+
+
+class AdminDivisionIndex:
+    """
+    Cây tỉnh/huyện/xã trong memory cho autocomplete và các API danh sách.
+    - Danh sách con đã sắp xếp theo tên (giống ORDER BY name)
+    - Tìm kiếm bằng bisect trên mảng đã sắp xếp (tên đã bỏ dấu), không truy vấn SQLite
+    """
+
+    def __init__(self):
+        self._data: Optional[_IndexData] = None
+        self._lock = threading.Lock()
+        self.build_ms = None
+        self.memory_bytes = None
+        self.loaded_at = None
+        self.stats_counters = {"searches": 0, "list_requests": 0, "reloads": 0, "reverse_lookups": 0, "reverse_hits": 0}
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._data is not None
+
+    # ----- Build -----
+    def load(self, db: Optional[Session] = None) -> Dict:
+        """Đọc toàn bộ 3 bảng và build index mới, thay thế index cũ"""
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            data = self._build(db)
+            build_ms = round((time.perf_counter() - started) * 1000, 1)
+        finally:
+            if own_session:
+                db.close()
+
+        with self._lock:
+            self._data = data
+            self.build_ms = build_ms
+            self.memory_bytes = self._estimate_memory(data)
+            self.loaded_at = time.time()
+            self.stats_counters["reloads"] += 1
+
+        logger.info("🌳 Admin division index loaded: %s nodes in %s ms (~%s MB)",
+                    len(data.nodes), build_ms, round(self.memory_bytes / 1024 / 1024, 1))
+        return self.get_stats()
+
+    def _build(self, db: Session) -> _IndexData:
+        data = _IndexData()
+
+        def add(node: DivisionNode):
+            data.nodes.append(node)
+            data.by_code[node.level][node.code] = node
+
+        for row in db.execute(text(
+            "SELECT id, code, name, full_name, latitude, longitude FROM provinces ORDER BY name"
+        )):
+            add(DivisionNode("province", row[0], row[1], row[2], row[3], row[4], row[5]))
+
+        for row in db.execute(text(
+            "SELECT id, code, name, full_name, latitude, longitude, province_code FROM districts ORDER BY name"
+        )):
+            province = data.by_code["province"].get(row[6])
+            if province is None:
+                continue
+            node = DivisionNode("district", row[0], row[1], row[2], row[3], row[4], row[5], parent=province)
+            province.children.append(node)
+            add(node)
+
+        for row in db.execute(text("""
+            SELECT id, code, name, full_name, latitude, longitude, division_type, district_code
+            FROM wards ORDER BY name
+        """)):
+            district = data.by_code["district"].get(row[7])
+            if district is None:
+                continue
+            node = DivisionNode("ward", row[0], row[1], row[2], row[3], row[4], row[5],
+                                division_type=row[6], parent=district)
+            district.children.append(node)
+            add(node)
+
+        data.provinces = [node for node in data.nodes if node.level == "province"]
+        for node in data.nodes:
+            if node.has_coordinates:
+                data.grids[node.level].add(node)
+
+        phrase_entries = []
+        word_map: Dict[str, List[int]] = {}
+        for index, node in enumerate(data.nodes):
+            keys = {node.name_folded}
+            short_words = node.short_folded.split()
+            for start in range(len(short_words)):
+                keys.add(" ".join(short_words[start:]))
+            phrase_entries.extend((key, index) for key in keys if key)
+
+            words = set(node.name_folded.split())
+            parent = node.parent
+            while parent is not None:
+                words.update(parent.name_folded.split())
+                parent = parent.parent
+            for word in words:
+                word_map.setdefault(word, []).append(index)
+
+        phrase_entries.sort()
+        data.phrase_keys = [key for key, _ in phrase_entries]
+        data.phrase_nodes = [index for _, index in phrase_entries]
+        data.words = sorted(word_map)
+        data.word_nodes = [word_map[word] for word in data.words]
+        return data
+
+    @staticmethod
+    def _estimate_memory(data: _IndexData) -> int:
+        """Ước lượng bộ nhớ (byte) của index"""
+        size = sys.getsizeof(data.nodes) + sys.getsizeof(data.phrase_keys) + sys.getsizeof(data.phrase_nodes)
+        size += sys.getsizeof(data.words) + sys.getsizeof(data.word_nodes)
+        for node in data.nodes:
+            size += sys.getsizeof(node) + sys.getsizeof(node.children)
+            size += sum(sys.getsizeof(value) for value in (node.name, node.full_name, node.code,
+                                                             node.name_folded, node.short_folded))
+        size += sum(sys.getsizeof(key) for key in data.phrase_keys)
+        size += sum(sys.getsizeof(word) for word in data.words)
+        size += sum(sys.getsizeof(nodes) for nodes in data.word_nodes)
+        return size
+
+    # ----- Truy vấn -----
+    def list_provinces(self) -> Optional[List[DivisionNode]]:
+        data = self._data
+        if data is None:
+            return None
+        self.stats_counters["list_requests"] += 1
+        return data.provinces
+
+    def list_children(self, level: str, code: str) -> Optional[List[DivisionNode]]:
+        """Danh sách huyện của tỉnh (level="province") hoặc xã của huyện (level="district")"""
+        data = self._data
+        if data is None:
+            return None
+        self.stats_counters["list_requests"] += 1
+        node = data.by_code[level].get(code)
+        return node.children if node else []
+
+    def get(self, level: str, code: str) -> Optional[DivisionNode]:
+        data = self._data
+        return data.by_code[level].get(code) if data else None
+
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> range:
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "￿", lo=start)
+        return range(start, end)
+
+    def search(self, q: str, level: str = "all", limit: int = 20) -> Optional[List[Dict]]:
+        """
+        Tìm kiếm autocomplete. Xếp hạng giống index FTS5:
+        tên bắt đầu bằng từ khóa > mọi từ khớp trong tên > khớp qua tên tỉnh/huyện cha
+        """
+        data = self._data
+        if data is None:
+            return None
+        self.stats_counters["searches"] += 1
+
+        query = normalize_address(q)
+        tokens = query.split()
+        if not tokens:
+            return []
+
+        def allowed(node: DivisionNode) -> bool:
+            return level not in LEVEL_ORDER or node.level == level
+
+        candidates: Dict[int, tuple] = {}  # node index -> (tier, -số từ khóa khớp trong tên)
+
+        # 1. Cụm từ khóa là tiền tố của tên / của 1 đoạn cuối trong tên
+        for position in self._prefix_range(data.phrase_keys, query):
+            index = data.phrase_nodes[position]
+            node = data.nodes[index]
+            if not allowed(node):
+                continue
+            tier = 0 if node.short_folded.startswith(query) or node.name_folded.startswith(query) else 1
+            candidates[index] = min((tier, 0), candidates.get(index, (tier, 0)))
+
+        # 2. Mọi từ khóa khớp tiền tố với 1 từ trong tên hoặc tên cấp cha
+        if sum(1 for rank in candidates.values() if rank[0] == 0) < limit:
+            matched = None
+            for token in sorted(tokens, key=len, reverse=True):
+                token_nodes = set()
+                for position in self._prefix_range(data.words, token):
+                    token_nodes.update(data.word_nodes[position])
+                matched = token_nodes if matched is None else matched & token_nodes
+                if not matched:
+                    break
+
+            for index in matched or ():
+                if index in candidates:
+                    continue
+                node = data.nodes[index]
+                if not allowed(node):
+                    continue
+                short_words = node.short_folded.split()
+                if all(any(word.startswith(token) for word in short_words) for token in tokens):
+                    candidates[index] = (1, 0)
+                else:
+                    # Khớp qua tên cấp cha: ưu tiên node có nhiều từ khóa khớp trong tên chính nó
+                    name_words = node.name_folded.split()
+                    own_hits = sum(1 for token in tokens if any(word.startswith(token) for word in name_words))
+                    candidates[index] = (2, -own_hits)
+
+        ranked = sorted(
+            candidates.items(),
+            key=lambda item: (item[1], LEVEL_ORDER[data.nodes[item[0]].level],
+                              len(data.nodes[item[0]].name_folded), data.nodes[item[0]].name_folded)
+        )
+        return [data.nodes[index].to_search_result() for index, _ in ranked[:limit]]
+
+    def locate(self, latitude: float, longitude: float) -> Optional[Dict]:
+        """
+        Reverse lookup tọa độ -> tỉnh/huyện/xã theo tâm gần nhất (chưa có ranh giới hành chính).
+        Lấy cấp nhỏ nhất có tâm trong bán kính cho phép (xã -> huyện -> tỉnh), các cấp cha suy ra từ node đó.
+        None nếu index chưa load hoặc điểm nằm ngoài mọi bán kính.
+        """
+        data = self._data
+        if data is None:
+            return None
+        self.stats_counters["reverse_lookups"] += 1
+        for level, max_km in (("ward", settings.REVERSE_GEOCODE_WARD_MAX_KM),
+                              ("district", settings.REVERSE_GEOCODE_DISTRICT_MAX_KM),
+                              ("province", settings.REVERSE_GEOCODE_PROVINCE_MAX_KM)):
+            found = data.grids[level].nearest(latitude, longitude, max_km)
+            if found is None:
+                continue
+            node, km = found
+            match = {"level": level, "distance_km": round(km, 3), "ward": None, "district": None, "province": None}
+            while node is not None:
+                match[node.level] = node
+                node = node.parent
+            self.stats_counters["reverse_hits"] += 1
+            return match
+        return None
+
+    def locate_ids(self, latitude: float, longitude: float) -> Optional[tuple]:
+        """(province_id, district_id, ward_id) cho tra cứu giá cố định theo ID hành chính"""
+        match = self.locate(latitude, longitude)
+        if match is None:
+            return None
+        return tuple(match[level].id if match[level] else None for level in ("province", "district", "ward"))
+
+    # ----- Cập nhật -----
+    def update_coordinates(self, level: str, code: str, latitude: float, longitude: float):
+        """Đồng bộ tọa độ sau khi DB được cập nhật (geocode / PATCH coordinates)"""
+        data = self._data
+        node = self.get(level, code)
+        if node is not None:
+            with self._lock:
+                grid = data.grids[level]
+                if node.has_coordinates:
+                    grid.remove(node)
+                node.latitude = float(latitude)
+                node.longitude = float(longitude)
+                grid.add(node)
+
+    def get_stats(self) -> Dict:
+        data = self._data
+        counts = {name: len(nodes) for name, nodes in data.by_code.items()} if data else {}
+        return {
+            **self.stats_counters,
+            "loaded": data is not None,
+            "counts": counts,
+            "phrase_keys": len(data.phrase_keys) if data else 0,
+            "words": len(data.words) if data else 0,
+            "located_points": {level: grid.size for level, grid in data.grids.items()} if data else {},
+            "build_ms": self.build_ms,
+            "memory_bytes": self.memory_bytes,
+            "memory_mb": round(self.memory_bytes / 1024 / 1024, 2) if self.memory_bytes else None,
+            "loaded_at": self.loaded_at
+        }
+
+
+# Singleton instance
+admin_division_index = AdminDivisionIndex()
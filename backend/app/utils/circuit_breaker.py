@@ -0,0 +1,194 @@
+# backend/app/utils/circuit_breaker.py
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.config.settings import settings
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho 1 dịch vụ ngoài (VD: google_maps), thread-safe.
+    - closed: gọi bình thường; lỗi/gọi chậm liên tiếp >= failure_threshold -> open
+    - open: từ chối ngay (caller dùng fallback) trong reset_timeout giây
+    - half_open: cho tối đa half_open_max_calls lời gọi thăm dò; thành công -> closed, lỗi -> open lại.
+      Lời gọi thăm dò bị hủy trả lại lượt qua release_probe(); lượt giữ quá reset_timeout giây tính là lỗi
+    Gọi chậm hơn slow_call_seconds (> 0) tính như lỗi dù có kết quả.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30,
+                 slow_call_seconds: float = 0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_leases: List[float] = []  # Thời điểm cấp từng lượt thăm dò đang chạy
+        self.probe_round = 0  # Tăng mỗi lần vào half_open (lượt của vòng cũ không trả nhầm vào vòng mới)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_latency_ms = None
+        self.stats_counters = {
+            "successes": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "rejected": 0,
+            "opened": 0
+        }
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _transition(self, state: str):
+        """Đổi trạng thái (gọi khi đang giữ lock)"""
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self.stats_counters["opened"] += 1
+            logger.warning("⚡ Circuit %s %s -> open after %s consecutive failures (last: %s), retry in %ss",
+                           self.name, previous, self.consecutive_failures, self.last_error, self.reset_timeout)
+        elif state == self.HALF_OPEN:
+            self._probe_leases = []
+            self.probe_round += 1
+            logger.info("🔌 Circuit %s half-open, probing", self.name)
+        else:
+            logger.info("💚 Circuit %s closed", self.name)
+
+    def allow_request(self) -> bool:
+        """True nếu được gọi dịch vụ; False = dùng fallback ngay"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.stats_counters["rejected"] += 1
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN:
+                now = time.monotonic()
+                if len(self._probe_leases) >= self.half_open_max_calls:
+                    if now - self._probe_leases[0] < self.reset_timeout:
+                        self.stats_counters["rejected"] += 1
+                        return False
+                    # Lượt thăm dò không bao giờ báo kết quả (VD: task bị hủy trước khi chạy) -> tính là lỗi
+                    self.stats_counters["failures"] += 1
+                    self.consecutive_failures += 1
+                    self.last_error = "probe lease expired"
+                    self._transition(self.OPEN)
+                    self.stats_counters["rejected"] += 1
+                    return False
+                self._probe_leases.append(now)
+            return True
+
+    def release_probe(self, probe_round: int):
+        """Lời gọi bị hủy trước khi có kết quả: trả lại lượt thăm dò, không tính thành công hay lỗi"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and probe_round == self.probe_round and self._probe_leases:
+                self._probe_leases.pop(0)
+
+    def record_success(self, elapsed: Optional[float] = None):
+        if elapsed is not None:
+            self.last_latency_ms = round(elapsed * 1000, 1)
+            if 0 < self.slow_call_seconds < elapsed:
+                self.record_failure("slow", f"slow call {elapsed:.2f}s")
+                return
+        with self._lock:
+            self.stats_counters["successes"] += 1
+            self.consecutive_failures = 0
+            self._transition(self.CLOSED)
+
+    def record_failure(self, kind: str = "error", error: Optional[str] = None):
+        with self._lock:
+            self.stats_counters["slow_calls" if kind == "slow" else "failures"] += 1
+            self.consecutive_failures += 1
+            self.last_error = error or kind
+            if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self._state == self.OPEN:
+                    self._opened_at = time.monotonic()
+                else:
+                    self._transition(self.OPEN)
+
+    def reset(self):
+        """Đóng lại circuit thủ công (VD: sau khi đổi API key)"""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._transition(self.CLOSED)
+
+    def get_status(self) -> Dict:
+        retry_in = 0.0
+        if self._state == self.OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        return {
+            "name": self.name,
+            "state": self._state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "retry_in_seconds": round(retry_in, 1),
+            "probes_in_flight": len(self._probe_leases),
+            "slow_call_seconds": self.slow_call_seconds,
+            "last_error": self.last_error,
+            "last_latency_ms": self.last_latency_ms,
+            **self.stats_counters
+        }
+
+
+class CircuitBreakerRegistry:
+    """Breaker dùng chung theo tên dịch vụ (đường sync và async cùng nhìn 1 trạng thái)"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = self._breakers[name] = CircuitBreaker(
+                        name,
+                        failure_threshold=settings.DISTANCE_PROVIDER_FAILURE_THRESHOLD,
+                        reset_timeout=settings.DISTANCE_PROVIDER_COOLDOWN_SECONDS,
+                        slow_call_seconds=settings.DISTANCE_PROVIDER_SLOW_CALL_SECONDS
+                    )
+        return breaker
+
+    def reset(self, name: str) -> bool:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            return False
+        breaker.reset()
+        return True
+
+    def get_status(self) -> Dict[str, Dict]:
+        return {name: breaker.get_status() for name, breaker in list(self._breakers.items())}
+
+    def collect_metrics(self):
+        """Collector cho /metrics"""
+        breakers = list(self._breakers.items())
+        yield ("circuit_breaker_state", "gauge", "Trạng thái circuit breaker (1 = đang ở trạng thái đó)",
+               ("name", "state"),
+               [((name, state), int(breaker.state == state))
+                for name, breaker in breakers
+                for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)])
+        yield ("circuit_breaker_rejected_total", "counter", "Số lời gọi bị circuit breaker chặn (dùng fallback ngay)",
+               ("name",), [((name,), breaker.stats_counters["rejected"]) for name, breaker in breakers])
+
+
+# Singleton registry
+circuit_breakers = CircuitBreakerRegistry()
+metrics.register_collector(circuit_breakers.collect_metrics)
@@ -0,0 +1,644 @@
+# backend/app/utils/distance_providers.py
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.utils.google_maps_calculator import GoogleMapsDistanceCalculator, google_maps_client_registry
+from app.utils.haversine import enhanced_haversine
+from app.utils.circuit_breaker import CircuitBreaker, circuit_breakers
+from app.utils.metrics import DISTANCE_LOOKUP_DURATION, UPSTREAM_ERRORS
+
+# httpx là tùy chọn - nếu không có thì dùng thread pool với googlemaps client đồng bộ
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+Coordinate = Tuple[float, float]
+
+# Giới hạn của Google Distance Matrix API cho mỗi request
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 25
+MATRIX_MAX_ELEMENTS = 100
+
+
+class DistanceProviderError(Exception):
+    """Provider không tính được khoảng cách (lỗi API, không có tuyến, ...)"""
+    pass
+
+
+class DistanceProvider:
+    """
+    Interface async cho các nguồn tính khoảng cách.
+    route(): 1 cặp điểm -> dict kết quả chuẩn (distance_km, duration_minutes, method, ...)
+    matrix(): nhiều điểm đi x nhiều điểm đến -> ma trận dict (None nếu cặp đó lỗi)
+    """
+    name = "base"
+    source = "base"  # Label "source" của metric distance_lookup_duration_seconds
+
+    def is_available(self) -> bool:
+        return True
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        raise NotImplementedError
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        """Mặc định: gọi route() song song cho từng cặp"""
+        async def safe_route(origin: Coordinate, destination: Coordinate) -> Optional[Dict]:
+            try:
+                return await self.route(origin[0], origin[1], destination[0], destination[1])
+            except Exception:
+                return None
+
+        rows = []
+        for origin in origins:
+            rows.append(await asyncio.gather(*[safe_route(origin, dest) for dest in destinations]))
+        return [list(row) for row in rows]
+
+    async def aclose(self):
+        pass
+
+
+def chunk_matrix_request(origins: List[Coordinate], destinations: List[Coordinate]):
+    """
+    Chia ma trận origins x destinations thành các khối thỏa giới hạn của Distance Matrix API.
+    Trả về list (origin_offset, origin_chunk, destination_offset, destination_chunk)
+    """
+    dest_size = min(len(destinations), MATRIX_MAX_DESTINATIONS) or 1
+    origin_size = max(1, min(MATRIX_MAX_ORIGINS, MATRIX_MAX_ELEMENTS // dest_size))
+
+    chunks = []
+    for o in range(0, len(origins), origin_size):
+        for d in range(0, len(destinations), dest_size):
+            chunks.append((o, origins[o:o + origin_size], d, destinations[d:d + dest_size]))
+    return chunks
+
+
+def parse_matrix_element(element: Dict) -> Optional[Dict]:
+    """Chuyển 1 element của Distance Matrix thành dict kết quả chuẩn"""
+    if not element or element.get("status") != "OK":
+        return None
+
+    distance_km = element["distance"]["value"] / 1000
+    duration_minutes = element["duration"]["value"] / 60
+    return {
+        "distance_km": round(distance_km, 2),
+        "duration_minutes": round(duration_minutes, 1),
+        "polyline": None,
+        "method": "google_maps",
+        "success": True,
+        "route_info": {
+            "distance_text": element["distance"].get("text"),
+            "duration_text": element["duration"].get("text"),
+            "source": "distance_matrix"
+        }
+    }
+
+
+def _format_coordinate(point: Coordinate) -> str:
+    return f"{point[0]},{point[1]}"
+
+
+def build_routing_result(distance_km: float, duration_seconds: Optional[float], method: str, source: str) -> Dict:
+    """Dict kết quả chuẩn cho các routing engine tự host (OSRM, Valhalla)"""
+    duration_minutes = (duration_seconds or 0) / 60
+    return {
+        "distance_km": round(distance_km, 2),
+        "duration_minutes": round(duration_minutes, 1),
+        "polyline": None,
+        "method": method,
+        "success": True,
+        "route_info": {
+            "distance_text": f"{round(distance_km, 1)} km",
+            "duration_text": f"{round(duration_minutes)} phút",
+            "source": source
+        }
+    }
+
+
+class HttpDistanceProvider(DistanceProvider):
+    """Provider gọi HTTP qua httpx.AsyncClient dùng chung (keep-alive)"""
+
+    def __init__(self, base_url: str, pool_size: int = 10, timeout: float = 10):
+        self.base_url = (base_url or "").rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self):
+        """AsyncClient dùng chung (keep-alive), tạo lại nếu event loop thay đổi"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+            self._client_loop = loop
+        return self._client
+
+    def is_available(self) -> bool:
+        return HTTPX_AVAILABLE and bool(self.base_url)
+
+    async def _request_json(self, method: str, path: str, **kwargs) -> Dict:
+        try:
+            response = await self._get_client().request(method, self.base_url + path, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise DistanceProviderError(f"{self.name} HTTP Error: {str(e)}")
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+
+class GoogleHttpxDistanceProvider(HttpDistanceProvider):
+    """Gọi Google Directions/Distance Matrix API bằng httpx.AsyncClient (không block event loop)"""
+    name = "google_httpx"
+    source = "google_maps"
+
+    DIRECTIONS_PATH = "/maps/api/directions/json"
+    DISTANCE_MATRIX_PATH = "/maps/api/distancematrix/json"
+
+    def __init__(self, pool_size: int = 10, timeout: float = 10, base_url: str = "https://maps.googleapis.com"):
+        super().__init__(base_url, pool_size=pool_size, timeout=timeout)
+
+    def is_available(self) -> bool:
+        return HTTPX_AVAILABLE and bool(google_maps_client_registry.get_api_key())
+
+    async def _get_json(self, url: str, params: Dict) -> Dict:
+        api_key = google_maps_client_registry.get_api_key()
+        if not api_key:
+            raise DistanceProviderError("No Google Maps API key")
+
+        try:
+            response = await self._get_client().get(url, params={**params, "key": api_key})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise DistanceProviderError(f"Google Maps HTTP Error: {str(e)}")
+
+        data = response.json()
+        if data.get("status") != "OK":
+            raise DistanceProviderError(
+                f"Google Maps API Error: {data.get('status')} {data.get('error_message', '')}".strip()
+            )
+        return data
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        data = await self._get_json(self.base_url + self.DIRECTIONS_PATH, {
+            "origin": f"{lat1},{lng1}",
+            "destination": f"{lat2},{lng2}",
+            "mode": "driving",
+            "avoid": "tolls",  # Tránh đường thu phí
+            "language": "vi",
+            "region": "vn"
+        })
+        return GoogleMapsDistanceCalculator.build_directions_result(data.get("routes"))
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        results: List[List[Optional[Dict]]] = [[None] * len(destinations) for _ in origins]
+
+        async def fetch_chunk(o_offset, o_chunk, d_offset, d_chunk):
+            data = await self._get_json(self.base_url + self.DISTANCE_MATRIX_PATH, {
+                "origins": "|".join(_format_coordinate(p) for p in o_chunk),
+                "destinations": "|".join(_format_coordinate(p) for p in d_chunk),
+                "mode": "driving",
+                "avoid": "tolls",
+                "language": "vi",
+                "region": "vn"
+            })
+            for i, row in enumerate(data.get("rows", [])):
+                for j, element in enumerate(row.get("elements", [])):
+                    results[o_offset + i][d_offset + j] = parse_matrix_element(element)
+
+        await asyncio.gather(*[fetch_chunk(*chunk) for chunk in chunk_matrix_request(origins, destinations)])
+        return results
+
+
+class GoogleThreadPoolDistanceProvider(DistanceProvider):
+    """Chạy googlemaps client đồng bộ trong thread pool riêng để không block event loop"""
+    name = "google_thread_pool"
+    source = "google_maps"
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gmaps")
+        return self._executor
+
+    def is_available(self) -> bool:
+        return google_maps_client_registry.get_client() is not None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        calculator = GoogleMapsDistanceCalculator()
+        if not calculator.has_api_key:
+            raise DistanceProviderError("No Google Maps API key")
+        return await self._run(calculator._google_maps_calculation, lat1, lng1, lat2, lng2)
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        gmaps = google_maps_client_registry.get_client()
+        if gmaps is None:
+            raise DistanceProviderError("No Google Maps API key")
+
+        results: List[List[Optional[Dict]]] = [[None] * len(destinations) for _ in origins]
+
+        def fetch_chunk(o_offset, o_chunk, d_offset, d_chunk):
+            data = gmaps.distance_matrix(
+                origins=o_chunk,
+                destinations=d_chunk,
+                mode="driving",
+                avoid="tolls",
+                language="vi",
+                region="vn"
+            )
+            for i, row in enumerate(data.get("rows", [])):
+                for j, element in enumerate(row.get("elements", [])):
+                    results[o_offset + i][d_offset + j] = parse_matrix_element(element)
+
+        await asyncio.gather(*[self._run(fetch_chunk, *chunk) for chunk in chunk_matrix_request(origins, destinations)])
+        return results
+
+    async def aclose(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class HaversineDistanceProvider(DistanceProvider):
+    """Ước tính Haversine offline - không bao giờ lỗi, đặt cuối chuỗi làm lưới an toàn"""
+    name = "haversine"
+    source = "haversine"
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        return enhanced_haversine(lat1, lng1, lat2, lng2)
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        return [[enhanced_haversine(o[0], o[1], d[0], d[1]) for d in destinations] for o in origins]
+
+
+class OSRMDistanceProvider(HttpDistanceProvider):
+    """
+    OSRM tự host (osrm-routed): /route cho 1 cặp điểm, /table cho ma trận.
+    Tọa độ theo thứ tự lng,lat; khoảng cách trả về mét, thời gian giây.
+    """
+    name = "osrm"
+    source = "osrm"
+
+    MAX_TABLE_SIZE = 100  # Mặc định --max-table-size của osrm-routed (tổng số điểm mỗi request)
+
+    def __init__(self, base_url: str, profile: str = "driving", pool_size: int = 10, timeout: float = 10):
+        super().__init__(base_url, pool_size=pool_size, timeout=timeout)
+        self.profile = profile
+
+    async def _get(self, service: str, points: List[Coordinate], params: Dict) -> Dict:
+        coordinates = ";".join(f"{lng},{lat}" for lat, lng in points)
+        data = await self._request_json("GET", f"/{service}/v1/{self.profile}/{coordinates}", params=params)
+        if data.get("code") != "Ok":
+            raise DistanceProviderError(f"OSRM Error: {data.get('code')} {data.get('message', '')}".strip())
+        return data
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        data = await self._get("route", [(lat1, lng1), (lat2, lng2)], {"overview": "false"})
+        routes = data.get("routes") or []
+        if not routes:
+            raise DistanceProviderError("No route found")
+        return build_routing_result(routes[0]["distance"] / 1000, routes[0].get("duration"), "osrm", "osrm_route")
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        results: List[List[Optional[Dict]]] = [[None] * len(destinations) for _ in origins]
+        dest_size = max(1, min(len(destinations), self.MAX_TABLE_SIZE - min(len(origins), self.MAX_TABLE_SIZE // 2)))
+        origin_size = max(1, self.MAX_TABLE_SIZE - dest_size)
+
+        async def fetch_chunk(o_offset, o_chunk, d_offset, d_chunk):
+            data = await self._get("table", list(o_chunk) + list(d_chunk), {
+                "sources": ";".join(str(i) for i in range(len(o_chunk))),
+                "destinations": ";".join(str(len(o_chunk) + j) for j in range(len(d_chunk))),
+                "annotations": "duration,distance"
+            })
+            durations = data.get("durations") or []
+            for i, row in enumerate(data.get("distances") or []):
+                for j, distance in enumerate(row):
+                    if distance is not None:
+                        duration = durations[i][j] if i < len(durations) else None
+                        results[o_offset + i][d_offset + j] = build_routing_result(
+                            distance / 1000, duration, "osrm", "osrm_table")
+
+        await asyncio.gather(*[
+            fetch_chunk(o, origins[o:o + origin_size], d, destinations[d:d + dest_size])
+            for o in range(0, len(origins), origin_size)
+            for d in range(0, len(destinations), dest_size)
+        ])
+        return results
+
+
+class ValhallaDistanceProvider(HttpDistanceProvider):
+    """
+    Valhalla tự host: POST /route cho 1 cặp điểm, POST /sources_to_targets cho ma trận.
+    Dùng units=kilometers nên khoảng cách trả về km, thời gian giây.
+    """
+    name = "valhalla"
+    source = "valhalla"
+
+    MAX_MATRIX_LOCATIONS = 50  # 50 x 50 = max_matrix_location_pairs mặc định (2500)
+
+    def __init__(self, base_url: str, costing: str = "auto", pool_size: int = 10, timeout: float = 10):
+        super().__init__(base_url, pool_size=pool_size, timeout=timeout)
+        self.costing = costing
+
+    @staticmethod
+    def _locations(points: List[Coordinate]) -> List[Dict]:
+        return [{"lat": lat, "lon": lng} for lat, lng in points]
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        data = await self._request_json("POST", "/route", json={
+            "locations": self._locations([(lat1, lng1), (lat2, lng2)]),
+            "costing": self.costing,
+            "units": "kilometers"
+        })
+        summary = (data.get("trip") or {}).get("summary")
+        if not summary:
+            raise DistanceProviderError("No route found")
+        return build_routing_result(summary["length"], summary.get("time"), "valhalla", "valhalla_route")
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate]) -> List[List[Optional[Dict]]]:
+        results: List[List[Optional[Dict]]] = [[None] * len(destinations) for _ in origins]
+        size = self.MAX_MATRIX_LOCATIONS
+
+        async def fetch_chunk(o_offset, o_chunk, d_offset, d_chunk):
+            data = await self._request_json("POST", "/sources_to_targets", json={
+                "sources": self._locations(o_chunk),
+                "targets": self._locations(d_chunk),
+                "costing": self.costing,
+                "units": "kilometers"
+            })
+            for i, row in enumerate(data.get("sources_to_targets") or []):
+                for j, element in enumerate(row):
+                    if element and element.get("distance") is not None:
+                        results[o_offset + i][d_offset + j] = build_routing_result(
+                            element["distance"], element.get("time"), "valhalla", "valhalla_matrix")
+
+        await asyncio.gather(*[
+            fetch_chunk(o, origins[o:o + size], d, destinations[d:d + size])
+            for o in range(0, len(origins), size)
+            for d in range(0, len(destinations), size)
+        ])
+        return results
+
+
+class DistanceProviderChain:
+    """
+    Chuỗi provider theo thứ tự ưu tiên, mỗi provider đi qua circuit breaker theo source
+    (2 provider Google dùng chung breaker "google_maps" với đường sync):
+    - Breaker đang mở -> bỏ qua provider ngay, không chờ timeout
+    - route(): provider đầu tiên trả kết quả thắng; hedge_after > 0 thì quá ngưỡng đó
+      gọi song song provider kế tiếp và lấy kết quả về trước (provider chậm bị hủy, tính là gọi chậm)
+    - sla_seconds > 0: route() không chạy quá hạn này (DistanceProviderError -> caller dùng Haversine)
+    - matrix(): các ô provider trước không tính được chuyển cho provider kế tiếp
+    """
+
+    def __init__(self, providers: List[DistanceProvider], timeout: float = 8,
+                 hedge_after: float = 0, sla_seconds: float = 0):
+        self.providers = list(providers)
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.sla_seconds = sla_seconds
+        self.stats_counters = {"hedged": 0, "hedge_wins": 0, "sla_exceeded": 0}
+
+    @staticmethod
+    def _breaker(provider: DistanceProvider) -> CircuitBreaker:
+        return circuit_breakers.get(provider.source)
+
+    def _next_allowed(self, pending: List[DistanceProvider]) -> Optional[DistanceProvider]:
+        """Lấy provider kế tiếp trong hàng đợi mà breaker cho gọi"""
+        while pending:
+            provider = pending.pop(0)
+            if provider.is_available() and self._breaker(provider).allow_request():
+                return provider
+        return None
+
+    def _record_success(self, provider: DistanceProvider, elapsed: float):
+        DISTANCE_LOOKUP_DURATION.observe(elapsed, source=provider.source)
+        self._breaker(provider).record_success(elapsed)
+
+    def _record_failure(self, provider: DistanceProvider, kind: str, error: str):
+        UPSTREAM_ERRORS.inc(upstream=provider.source, kind=kind)
+        self._breaker(provider).record_failure(kind, error)
+
+    def _call(self, provider: DistanceProvider, call, timeout: Optional[float]):
+        """
+        Gọi provider với timeout, ghi nhận vào breaker; None nếu lỗi.
+        Gọi ngay sau _next_allowed để ghi lại vòng thăm dò half-open của lượt vừa được cấp.
+        """
+        return self._guarded_call(provider, call, timeout, self._breaker(provider).probe_round)
+
+    async def _guarded_call(self, provider: DistanceProvider, call, timeout: Optional[float], probe_round: int):
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(call, timeout=timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._record_failure(provider, "timeout", "timeout")
+            logger.warning("⏱️ Distance provider %s timeout, failover", provider.name)
+            return None
+        except asyncio.CancelledError:
+            # Thua hedge / quá SLA / client ngắt kết nối: không có kết quả -> trả lại lượt thăm dò
+            self._breaker(provider).release_probe(probe_round)
+            raise
+        except Exception as e:
+            self._record_failure(provider, "error", str(e))
+            logger.warning("❌ Distance provider %s error: %s", provider.name, e)
+            return None
+        self._record_success(provider, time.perf_counter() - started)
+        return result
+
+    async def route(self, lat1: float, lng1: float, lat2: float, lng2: float, timeout: Optional[float] = None) -> Dict:
+        if self.sla_seconds <= 0:
+            return await self._route((lat1, lng1, lat2, lng2), timeout)
+        try:
+            return await asyncio.wait_for(self._route((lat1, lng1, lat2, lng2), timeout), timeout=self.sla_seconds)
+        except asyncio.TimeoutError:
+            self.stats_counters["sla_exceeded"] += 1
+            raise DistanceProviderError(f"Distance SLA {self.sla_seconds}s exceeded")
+
+    async def _route(self, points: Tuple[float, float, float, float], timeout: Optional[float]) -> Dict:
+        pending = list(self.providers)
+        while True:
+            provider = self._next_allowed(pending)
+            if provider is None:
+                raise DistanceProviderError("No distance provider available")
+            primary = asyncio.ensure_future(self._call(provider, provider.route(*points), timeout))
+            try:
+                result = await self._await_with_hedge(primary, provider, pending, points, timeout)
+            finally:
+                primary.cancel()
+            if result is not None:
+                logger.debug("✅ Distance via %s: %s km", result.get("method"), result["distance_km"])
+                return result
+
+    async def _await_with_hedge(self, primary: asyncio.Future, provider: DistanceProvider,
+                                pending: List[DistanceProvider], points, timeout: Optional[float]) -> Optional[Dict]:
+        """Chờ provider chính; quá hedge_after giây thì gọi song song provider kế tiếp"""
+        if self.hedge_after <= 0:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        backup_provider = self._next_allowed(pending)
+        if backup_provider is None:
+            return await primary
+        self.stats_counters["hedged"] += 1
+        logger.debug("🪁 %s slower than %ss, hedging with %s", provider.name, self.hedge_after, backup_provider.name)
+        backup = asyncio.ensure_future(self._call(backup_provider, backup_provider.route(*points), timeout))
+        try:
+            for next_done in asyncio.as_completed((primary, backup)):
+                result = await next_done
+                if result is not None:
+                    if not primary.done():
+                        # Provider chính thua -> bị hủy, ghi nhận là gọi chậm để breaker có thể mở
+                        self.stats_counters["hedge_wins"] += 1
+                        self._record_failure(provider, "slow", f"slower than hedge budget {self.hedge_after}s")
+                    return result
+            return None
+        finally:
+            backup.cancel()
+
+    async def matrix(self, origins: List[Coordinate], destinations: List[Coordinate],
+                     timeout: Optional[float] = None) -> List[List[Optional[Dict]]]:
+        results: List[List[Optional[Dict]]] = [[None] * len(destinations) for _ in origins]
+        pending = list(self.providers)
+        while True:
+            missing = [(i, j) for i, row in enumerate(results) for j, cell in enumerate(row) if cell is None]
+            if not missing:
+                break
+            provider = self._next_allowed(pending)
+            if provider is None:
+                break
+            rows = sorted({i for i, _ in missing})
+            cols = sorted({j for _, j in missing})
+            sub_matrix = await self._call(
+                provider, provider.matrix([origins[i] for i in rows], [destinations[j] for j in cols]), timeout)
+            if sub_matrix is None:
+                continue
+            for r, i in enumerate(rows):
+                for c, j in enumerate(cols):
+                    if results[i][j] is None:
+                        results[i][j] = sub_matrix[r][c]
+        return results
+
+    def get_status(self) -> Dict:
+        return {
+            "order": [provider.name for provider in self.providers],
+            "hedge_after_seconds": self.hedge_after,
+            "sla_seconds": self.sla_seconds,
+            **self.stats_counters,
+            "providers": [
+                {
+                    "name": provider.name,
+                    "available": provider.is_available(),
+                    "circuit": self._breaker(provider).get_status()
+                }
+                for provider in self.providers
+            ]
+        }
+
+
+# Singleton instances
+google_httpx_provider = GoogleHttpxDistanceProvider(
+    pool_size=settings.GOOGLE_MAPS_POOL_SIZE,
+    timeout=settings.DISTANCE_PROVIDER_TIMEOUT_SECONDS,
+    base_url=settings.GOOGLE_MAPS_BASE_URL
+)
+google_thread_pool_provider = GoogleThreadPoolDistanceProvider(
+    max_workers=settings.DISTANCE_THREAD_POOL_SIZE
+)
+osrm_provider = OSRMDistanceProvider(
+    settings.OSRM_BASE_URL,
+    profile=settings.OSRM_PROFILE,
+    pool_size=settings.GOOGLE_MAPS_POOL_SIZE,
+    timeout=settings.DISTANCE_PROVIDER_TIMEOUT_SECONDS
+)
+valhalla_provider = ValhallaDistanceProvider(
+    settings.VALHALLA_BASE_URL,
+    costing=settings.VALHALLA_COSTING,
+    pool_size=settings.GOOGLE_MAPS_POOL_SIZE,
+    timeout=settings.DISTANCE_PROVIDER_TIMEOUT_SECONDS
+)
+haversine_provider = HaversineDistanceProvider()
+
+
+def get_google_distance_provider() -> DistanceProvider:
+    """Provider Google async: ưu tiên httpx, fallback thread pool nếu không có httpx"""
+    if settings.GOOGLE_DISTANCE_BACKEND == "httpx" and HTTPX_AVAILABLE:
+        return google_httpx_provider
+    return google_thread_pool_provider
+
+
+# Plugin: tên dùng trong DISTANCE_PROVIDERS -> hàm trả về provider
+_provider_factories: Dict[str, Callable[[], DistanceProvider]] = {
+    "google": get_google_distance_provider,
+    "osrm": lambda: osrm_provider,
+    "valhalla": lambda: valhalla_provider,
+    "haversine": lambda: haversine_provider
+}
+_chain: Optional[DistanceProviderChain] = None
+
+
+def register_distance_provider(name: str, factory: Callable[[], DistanceProvider]):
+    """Đăng ký nguồn khoảng cách mới (VD: GraphHopper) để bật qua DISTANCE_PROVIDERS"""
+    global _chain
+    _provider_factories[name.strip().lower()] = factory
+    _chain = None  # Build lại chuỗi ở lần dùng tiếp theo
+
+
+def build_distance_provider_chain(names: str) -> DistanceProviderChain:
+    """Dựng chuỗi provider từ danh sách tên, VD: "osrm,google,haversine" """
+    providers = []
+    for name in names.split(","):
+        name = name.strip().lower()
+        if not name:
+            continue
+        factory = _provider_factories.get(name)
+        if factory is None:
+            logger.warning("⚠️ Unknown distance provider %r in DISTANCE_PROVIDERS, skipped", name)
+            continue
+        providers.append(factory())
+    return DistanceProviderChain(
+        providers,
+        timeout=settings.DISTANCE_PROVIDER_TIMEOUT_SECONDS,
+        hedge_after=settings.DISTANCE_HEDGE_AFTER_SECONDS,
+        sla_seconds=settings.DISTANCE_QUOTE_SLA_SECONDS
+    )
+
+
+def get_distance_provider_chain() -> DistanceProviderChain:
+    """Chuỗi provider theo DISTANCE_PROVIDERS (build 1 lần)"""
+    global _chain
+    if _chain is None:
+        _chain = build_distance_provider_chain(settings.DISTANCE_PROVIDERS)
+        logger.info("🧭 Distance providers: %s", " -> ".join(provider.name for provider in _chain.providers))
+    return _chain
+
+
+async def close_distance_providers():
+    """Đóng HTTP client/thread pool khi tắt app"""
+    await google_httpx_provider.aclose()
+    await google_thread_pool_provider.aclose()
+    await osrm_provider.aclose()
+    await valhalla_provider.aclose()
@@ -0,0 +1,337 @@
+# backend/app/utils/fixed_price_matcher.py
+
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config.logging_config import DebugSampler
+from app.config.settings import settings
+from app.models import models
+from app.utils.metrics import metrics
+from app.utils.address_normalizer import normalize_address, canonicalize_address, canonical_provinces
+
+logger = logging.getLogger(__name__)
+
+# (from_province_id, from_district_id, from_ward_id, to_province_id, to_district_id, to_ward_id)
+AdminKey = Tuple[int, Optional[int], Optional[int], int, Optional[int], Optional[int]]
+
+
+class _AddressForm:
+    """Các dạng đã tính sẵn của 1 địa chỉ để so khớp"""
+    __slots__ = ("normalized", "cleaned", "words", "provinces")
+
+    def __init__(self, text: Optional[str], normalized: Optional[str] = None, canonical: Optional[str] = None):
+        # Dùng cột đã chuẩn hóa sẵn trong DB nếu có
+        self.normalized = normalized if normalized is not None else normalize_address(text)
+        self.cleaned = canonical if canonical is not None else canonicalize_address(self.normalized)
+        self.words = frozenset(self.cleaned.split())
+        self.provinces: FrozenSet[str] = canonical_provinces(self.normalized)
+
+    def contains_match(self, other: "_AddressForm") -> bool:
+        """Khớp kiểu contains (sau khi chuẩn hóa hoặc trên dạng chuẩn tỉnh/bỏ stopwords)"""
+        if self.normalized and other.normalized and (
+                self.normalized in other.normalized or other.normalized in self.normalized):
+            return True
+        return bool(self.cleaned and other.cleaned) and (
+            self.cleaned in other.cleaned or other.cleaned in self.cleaned)
+
+    def covered_by(self, other: "_AddressForm") -> bool:
+        """Địa chỉ này nằm trọn trong địa chỉ kia (route tổng quát hơn input)"""
+        return bool(self.normalized) and (
+            self.normalized in other.normalized or bool(self.cleaned) and self.cleaned in other.cleaned)
+
+    def word_match(self, other: "_AddressForm") -> bool:
+        """Khớp theo tỉ lệ từ chung (>= 60% cả 2 phía hoặc >= 80% một phía)"""
+        if not self.words or not other.words:
+            return False
+        common = len(self.words & other.words)
+        ratio_self = common / len(self.words)
+        ratio_other = common / len(other.words)
+        return (ratio_self >= 0.6 and ratio_other >= 0.6) or ratio_self >= 0.8 or ratio_other >= 0.8
+
+    def matches(self, other: "_AddressForm") -> bool:
+        """Cùng logic với bản cũ: contains -> synonym tỉnh -> so khớp mờ"""
+        return (self.contains_match(other)
+                or bool(self.provinces & other.provinces)
+                or self.word_match(other))
+
+
+class _RouteEntry:
+    __slots__ = ("route_id", "from_form", "to_form", "admin_key")
+
+    def __init__(self, route: models.FixedPriceRoute):
+        self.route_id = route.id
+        self.admin_key: AdminKey = (route.from_province_id, route.from_district_id, route.from_ward_id,
+                                    route.to_province_id, route.to_district_id, route.to_ward_id)
+        self.from_form = _AddressForm(route.from_address_text, route.from_address_norm, route.from_address_canonical)
+        self.to_form = _AddressForm(route.to_address_text, route.to_address_norm, route.to_address_canonical)
+
+    @property
+    def exact_key(self) -> Tuple[str, str]:
+        return self.from_form.normalized, self.to_form.normalized
+
+    @property
+    def province_keys(self) -> List[Tuple[str, str]]:
+        return [(p_from, p_to) for p_from in self.from_form.provinces for p_to in self.to_form.provinces]
+
+
+class FixedPriceRouteMatcher:
+    """
+    Index trong memory cho tìm giá cố định theo text địa chỉ.
+    - Địa chỉ của route được chuẩn hóa 1 lần khi build/upsert
+    - Tầng 1: khớp chính xác theo (from, to) đã chuẩn hóa
+    - Tầng 2: khớp theo cặp tỉnh chuẩn (bảng synonyms đã biên dịch)
+    - Tầng 3: so khớp mờ (contains / tỉ lệ từ chung) trên dạng đã tính sẵn
+    Kèm index theo bộ ID hành chính (tỉnh/huyện/xã đi-đến) cho tra xã -> huyện -> tỉnh O(1).
+    Cập nhật từng route khi create/update/delete, tự build lại nếu bảng thay đổi từ nơi khác.
+    """
+
+    def __init__(self, check_interval: float = 5.0, debug_sample_rate: float = 0.01):
+        self.check_interval = check_interval
+        self._debug_sampler = DebugSampler(logger, debug_sample_rate)
+        self._entries: Dict[int, _RouteEntry] = {}
+        self._exact: Dict[Tuple[str, str], List[int]] = {}
+        self._by_province: Dict[Tuple[str, str], List[int]] = {}
+        self._by_admin: Dict[AdminKey, List[int]] = {}
+        self._lock = threading.RLock()
+        self._built = False
+        self._signature = None
+        self._last_check = 0.0
+
+        self.stats_counters = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "province_hits": 0,
+            "fuzzy_hits": 0,
+            "misses": 0,
+            "admin_lookups": 0,
+            "admin_hits": 0,
+            "builds": 0,
+            "upserts": 0,
+            "removals": 0
+        }
+        self.last_build_ms = None
+
+    # ----- Build / cập nhật index -----
+    @staticmethod
+    def _table_signature(db: Session):
+        """Chữ ký rẻ của bảng để phát hiện thay đổi từ worker/script khác"""
+        return db.query(
+            func.count(models.FixedPriceRoute.id),
+            func.max(models.FixedPriceRoute.id),
+            func.max(models.FixedPriceRoute.updated_at)
+        ).filter(models.FixedPriceRoute.is_active == True).one()
+
+    def build(self, db: Session):
+        """Build lại toàn bộ index từ các route active"""
+        started = time.perf_counter()
+        routes = db.query(models.FixedPriceRoute).filter(
+            models.FixedPriceRoute.is_active == True
+        ).order_by(models.FixedPriceRoute.id).all()
+
+        with self._lock:
+            self._entries = {}
+            self._exact = {}
+            self._by_province = {}
+            self._by_admin = {}
+            for route in routes:
+                self._add_entry(_RouteEntry(route))
+            self._signature = tuple(self._table_signature(db))
+            self._last_check = time.monotonic()
+            self._built = True
+            self.stats_counters["builds"] += 1
+
+        self.last_build_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("🗂️ Fixed price matcher built: %s routes in %s ms", len(routes), self.last_build_ms)
+
+    def _add_entry(self, entry: _RouteEntry):
+        self._entries[entry.route_id] = entry
+        self._exact.setdefault(entry.exact_key, []).append(entry.route_id)
+        for key in entry.province_keys:
+            self._by_province.setdefault(key, []).append(entry.route_id)
+        self._by_admin.setdefault(entry.admin_key, []).append(entry.route_id)
+
+    def _remove_entry(self, route_id: int):
+        entry = self._entries.pop(route_id, None)
+        if not entry:
+            return
+        for index, keys in ((self._exact, [entry.exact_key]), (self._by_province, entry.province_keys),
+                            (self._by_admin, [entry.admin_key])):
+            for key in keys:
+                ids = index.get(key)
+                if ids and route_id in ids:
+                    ids.remove(route_id)
+                    if not ids:
+                        del index[key]
+
+    def upsert(self, db: Session, route: models.FixedPriceRoute):
+        """Cập nhật 1 route trong index (gọi sau create/update)"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove_entry(route.id)
+            if route.is_active:
+                self._add_entry(_RouteEntry(route))
+                self._sort_buckets(route.id)
+            self._signature = tuple(self._table_signature(db))
+            self.stats_counters["upserts"] += 1
+
+    def remove(self, db: Session, route_id: int):
+        """Xóa 1 route khỏi index (gọi sau delete)"""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove_entry(route_id)
+            self._signature = tuple(self._table_signature(db))
+            self.stats_counters["removals"] += 1
+
+    def _sort_buckets(self, route_id: int):
+        """Giữ thứ tự id tăng dần trong các bucket chứa route vừa thêm"""
+        entry = self._entries[route_id]
+        self._exact[entry.exact_key].sort()
+        for key in entry.province_keys:
+            self._by_province[key].sort()
+        self._by_admin[entry.admin_key].sort()
+
+    def invalidate(self):
+        """Buộc build lại ở lần tìm kiếm tiếp theo"""
+        with self._lock:
+            self._built = False
+
+    def _ensure_fresh(self, db: Session):
+        now = time.monotonic()
+        if self._built and now - self._last_check < self.check_interval:
+            return
+        if self._built:
+            self._last_check = now
+            if tuple(self._table_signature(db)) == self._signature:
+                return
+        self.build(db)
+
+    # ----- Tìm kiếm -----
+    def match(self, db: Session, from_address: str, to_address: str) -> Optional[int]:
+        """Trả về id route khớp nhất, None nếu không có"""
+        self._ensure_fresh(db)
+        self.stats_counters["lookups"] += 1
+        trace = self._debug_sampler.sample()
+        started = time.perf_counter() if trace else 0.0
+
+        from_form = _AddressForm(from_address)
+        to_form = _AddressForm(to_address)
+        tier, route_id, candidates = self._match_forms(from_form, to_form)
+        self.stats_counters[f"{tier}_hits" if route_id is not None else "misses"] += 1
+
+        if trace:
+            logger.debug("🔎 Fixed price match %r -> %r: tier=%s route=%s candidates=%s "
+                         "(from=%r provinces=%s, to=%r provinces=%s) in %.3f ms",
+                         from_address, to_address, tier, route_id, candidates,
+                         from_form.cleaned, sorted(from_form.provinces),
+                         to_form.cleaned, sorted(to_form.provinces),
+                         (time.perf_counter() - started) * 1000)
+        return route_id
+
+    def _match_forms(self, from_form: _AddressForm, to_form: _AddressForm) -> Tuple[str, Optional[int], int]:
+        """(tầng khớp, id route, số ứng viên đã xét)"""
+        with self._lock:
+            # Tầng 1: khớp chính xác
+            ids = self._exact.get((from_form.normalized, to_form.normalized))
+            if ids:
+                return "exact", ids[0], len(ids)
+
+            # Tầng 2: cặp tỉnh chuẩn - ưu tiên route khớp cả phần chi tiết (quận/huyện)
+            candidates = []
+            for p_from in from_form.provinces:
+                for p_to in to_form.provinces:
+                    candidates.extend(self._by_province.get((p_from, p_to), []))
+            if candidates:
+                candidates = sorted(set(candidates))
+                return "province", self._best_candidate(candidates, from_form, to_form), len(candidates)
+
+            # Tầng 3: so khớp mờ trên toàn bộ route
+            for route_id in sorted(self._entries):
+                entry = self._entries[route_id]
+                if entry.from_form.matches(from_form) and entry.to_form.matches(to_form):
+                    return "fuzzy", route_id, len(self._entries)
+
+        return "none", None, len(self._entries)
+
+    def _best_candidate(self, candidates: List[int], from_form: _AddressForm, to_form: _AddressForm) -> int:
+        """
+        Chọn route cụ thể nhất trong các route cùng cặp tỉnh:
+        route nằm trọn trong input và dài nhất (VD: "Quận 1, TP.HCM" hơn "TP.HCM"),
+        sau đó route khớp contains, cuối cùng route có id nhỏ nhất
+        """
+        best_id, best_length = None, -1
+        for route_id in candidates:
+            entry = self._entries[route_id]
+            if entry.from_form.covered_by(from_form) and entry.to_form.covered_by(to_form):
+                length = len(entry.from_form.normalized) + len(entry.to_form.normalized)
+                if length > best_length:
+                    best_id, best_length = route_id, length
+        if best_id is not None:
+            return best_id
+
+        for route_id in candidates:
+            entry = self._entries[route_id]
+            if entry.from_form.contains_match(from_form) and entry.to_form.contains_match(to_form):
+                return route_id
+        return candidates[0]
+
+    def match_admin_ids(self, db: Session, keys: List[AdminKey]) -> List[Optional[int]]:
+        """
+        Tra giá cố định theo ID hành chính cho nhiều cặp điểm (cùng thứ tự với keys).
+        Ưu tiên xã -> huyện -> tỉnh như find_matching_route cũ, mỗi tầng 1 lần tra dict.
+        """
+        self._ensure_fresh(db)
+        with self._lock:
+            route_ids = [self._match_admin_key(key) for key in keys]
+        self.stats_counters["admin_lookups"] += len(keys)
+        self.stats_counters["admin_hits"] += sum(route_id is not None for route_id in route_ids)
+        return route_ids
+
+    def _match_admin_key(self, key: AdminKey) -> Optional[int]:
+        from_province, from_district, from_ward, to_province, to_district, to_ward = key
+        candidates = []
+        if from_ward and to_ward:
+            candidates.append(key)
+        if from_district and to_district:
+            candidates.append((from_province, from_district, None, to_province, to_district, None))
+        candidates.append((from_province, None, None, to_province, None, None))
+        for candidate in candidates:
+            ids = self._by_admin.get(candidate)
+            if ids:
+                return ids[0]
+        return None
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            "routes": len(self._entries),
+            "exact_keys": len(self._exact),
+            "province_keys": len(self._by_province),
+            "admin_keys": len(self._by_admin),
+            "built": self._built,
+            "last_build_ms": self.last_build_ms
+        }
+
+    def collect_metrics(self):
+        """Collector cho /metrics"""
+        counters = dict(self.stats_counters)
+        yield ("fixed_price_lookups_total", "counter", "Số lần tìm giá cố định theo tầng khớp", ("result",),
+               [((tier,), counters[f"{tier}_hits"]) for tier in ("exact", "province", "fuzzy")]
+               + [(("miss",), counters["misses"])])
+        yield ("fixed_price_admin_lookups_total", "counter", "Số lần tra giá cố định theo ID hành chính", ("result",),
+               [(("hit",), counters["admin_hits"]), (("miss",), counters["admin_lookups"] - counters["admin_hits"])])
+        yield ("fixed_price_routes", "gauge", "Số tuyến giá cố định trong index", (), [((), len(self._entries))])
+
+
+# Singleton instance
+fixed_price_route_matcher = FixedPriceRouteMatcher(
+    check_interval=settings.FIXED_PRICE_MATCHER_CHECK_SECONDS,
+    debug_sample_rate=settings.FIXED_PRICE_MATCHER_DEBUG_SAMPLE_RATE
+)
+metrics.register_collector(fixed_price_route_matcher.collect_metrics)
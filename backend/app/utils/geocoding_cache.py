@@ -0,0 +1,224 @@
+# backend/app/utils/geocoding_cache.py
+
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.database.database import SessionLocal, engine
+from app.models import models
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLEAR_ALL_KEY = "*"
+
+
+class GeocodingCache:
+    """
+    Cache tọa độ tỉnh/huyện/xã theo "level:code" cho SmartGeocodingService.
+    - LRU giới hạn max_items phần tử + TTL -> bộ nhớ không tăng theo thời gian chạy
+    - Tầng dùng chung là chính các bảng provinces/districts/wards (1 query theo code khi miss)
+    - shared=True: mỗi lần sửa tọa độ ghi 1 dòng vào geocoding_cache_invalidations; các worker
+      đọc nhật ký này (tối đa mỗi check_interval giây) và xóa entry cũ của mình
+    """
+
+    # Số lần invalidate giữa 2 lần dọn nhật ký (dòng cũ hơn TTL không còn tác dụng)
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_items: int = 5000, ttl_seconds: int = 24 * 3600,
+                 shared: bool = True, check_interval: float = 1.0):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.check_interval = check_interval
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at monotonic, coordinates)
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._last_seen_id: Optional[int] = None
+        self._own_ids = set()  # Dòng nhật ký do chính worker này ghi (đã áp dụng lúc invalidate)
+        self._last_check = 0.0
+        self._invalidations_since_prune = 0
+
+        self.stats_counters = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "remote_invalidations": 0,
+            "errors": 0
+        }
+
+    @staticmethod
+    def make_key(level: str, code: str) -> str:
+        return f"{level}:{code}"
+
+    def _ensure_table(self):
+        """Tạo bảng nhật ký invalidation nếu chưa có (chỉ chạy 1 lần)"""
+        if not self._table_ready:
+            models.GeocodingCacheInvalidation.__table__.create(bind=engine, checkfirst=True)
+            self._table_ready = True
+
+    # ----- Đọc/ghi -----
+    def get(self, level: str, code: str, db: Optional[Session] = None) -> Optional[Dict]:
+        """Tọa độ trong cache, None nếu miss/hết hạn/đã bị sửa ở worker khác"""
+        self.sync(db)
+        key = self.make_key(level, code)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, coordinates = entry
+                if expires_at > time.monotonic():
+                    self._memory.move_to_end(key)
+                    self.stats_counters["hits"] += 1
+                    return copy.copy(coordinates)
+                del self._memory[key]
+                self.stats_counters["expired"] += 1
+            self.stats_counters["misses"] += 1
+        return None
+
+    def set(self, level: str, code: str, coordinates: Dict):
+        key = self.make_key(level, code)
+        with self._lock:
+            self._memory[key] = (time.monotonic() + self.ttl_seconds, dict(coordinates))
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+
+    # ----- Invalidation -----
+    def invalidate(self, level: str, code: str, db: Optional[Session] = None):
+        """Gọi sau khi commit tọa độ mới của 1 đơn vị: xóa ở worker này và báo các worker khác"""
+        key = self.make_key(level, code)
+        with self._lock:
+            self._memory.pop(key, None)
+            self.stats_counters["invalidations"] += 1
+        self._publish(key, db)
+
+    def clear(self, db: Optional[Session] = None):
+        """Xóa toàn bộ cache (VD: sau khi import lại dữ liệu địa chỉ)"""
+        with self._lock:
+            self._memory.clear()
+            self.stats_counters["invalidations"] += 1
+        self._publish(CLEAR_ALL_KEY, db)
+
+    def _publish(self, key: str, db: Optional[Session]):
+        if not self.shared:
+            return
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            self._ensure_table()
+            row = models.GeocodingCacheInvalidation(cache_key=key)
+            db.add(row)
+            db.commit()
+            with self._lock:
+                self._own_ids.add(row.id)
+                self._invalidations_since_prune += 1
+                prune = self._invalidations_since_prune >= self.PRUNE_EVERY
+                if prune:
+                    self._invalidations_since_prune = 0
+            if prune:
+                self._prune(db)
+        except Exception as e:
+            db.rollback()
+            self.stats_counters["errors"] += 1
+            logger.warning("⚠️ Geocoding cache invalidation publish error: %s", e)
+        finally:
+            if own_session:
+                db.close()
+
+    def _prune(self, db: Session):
+        """Xóa dòng nhật ký cũ hơn TTL (entry tương ứng ở mọi worker đều đã hết hạn)"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        table = models.GeocodingCacheInvalidation
+        removed = db.query(table).filter(table.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        if removed:
+            logger.debug("🧹 Pruned %s geocoding cache invalidations", removed)
+
+    def sync(self, db: Optional[Session] = None):
+        """Áp dụng các invalidation mới từ worker khác (tối đa mỗi check_interval giây)"""
+        if not self.shared:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            self._ensure_table()
+            table = models.GeocodingCacheInvalidation
+            if self._last_seen_id is None:
+                # Lần đầu: cache đang rỗng, chỉ cần đánh dấu vị trí hiện tại của nhật ký
+                self._last_seen_id = db.query(table.id).order_by(table.id.desc()).limit(1).scalar() or 0
+                self._own_ids.clear()
+                return
+            rows = db.query(table.id, table.cache_key).filter(table.id > self._last_seen_id).order_by(table.id).all()
+            if not rows:
+                return
+            with self._lock:
+                for row_id, key in rows:
+                    if row_id in self._own_ids:
+                        self._own_ids.discard(row_id)
+                    elif key == CLEAR_ALL_KEY:
+                        self._memory.clear()
+                    elif self._memory.pop(key, None) is not None:
+                        self.stats_counters["remote_invalidations"] += 1
+                self._last_seen_id = rows[-1][0]
+        except Exception as e:
+            self.stats_counters["errors"] += 1
+            logger.warning("⚠️ Geocoding cache sync error: %s", e)
+        finally:
+            if own_session:
+                db.close()
+
+    # ----- Thống kê -----
+    def get_stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self.stats_counters)
+            items = len(self._memory)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups * 100, 1) if lookups else 0,
+            "items": items,
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl_seconds,
+            "shared": self.shared,
+            "check_interval": self.check_interval,
+            "last_seen_invalidation_id": self._last_seen_id
+        }
+
+    def collect_metrics(self):
+        """Collector cho /metrics"""
+        with self._lock:
+            counters = dict(self.stats_counters)
+            items = len(self._memory)
+        yield ("geocoding_cache_lookups_total", "counter", "Số lần tra cache tọa độ theo kết quả", ("result",),
+               [(("hit",), counters["hits"]), (("miss",), counters["misses"])])
+        yield ("geocoding_cache_invalidations_total", "counter", "Số entry tọa độ bị xóa do sửa tọa độ", ("origin",),
+               [(("local",), counters["invalidations"]), (("remote",), counters["remote_invalidations"])])
+        yield ("geocoding_cache_items", "gauge", "Số tọa độ trong LRU memory", (), [((), items)])
+
+
+# Singleton instance
+geocoding_cache = GeocodingCache(
+    max_items=settings.GEOCODING_CACHE_SIZE,
+    ttl_seconds=settings.GEOCODING_CACHE_TTL_SECONDS,
+    shared=settings.GEOCODING_CACHE_SHARED,
+    check_interval=settings.GEOCODING_CACHE_CHECK_SECONDS
+)
+metrics.register_collector(geocoding_cache.collect_metrics)
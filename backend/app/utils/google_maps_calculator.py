@@ -1,59 +1,162 @@
 # backend/app/utils/google_maps_calculator.py - FIXED VERSION
 
 import googlemaps
+import logging
 import math
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Tuple, Optional
+from app.config.settings import settings
 from app.database.database import SessionLocal
 from app.models import models
+from app.utils.circuit_breaker import circuit_breakers
 
-class GoogleMapsDistanceCalculator:
-    def __init__(self, api_key: str = None):
-        """
-        Khởi tạo Google Maps client với fallback mechanism
-        """
-        if not api_key:
-            api_key = self._get_api_key_from_db()
-        
-        if api_key and api_key != "YOUR_API_KEY_HERE":
-            try:
-                self.gmaps = googlemaps.Client(key=api_key)
-                self.has_api_key = True
-                print("✅ Google Maps client initialized successfully")
-            except Exception as e:
-                print(f"❌ Lỗi khởi tạo Google Maps client: {e}")
-                self.gmaps = None
-                self.has_api_key = False
-        else:
-            self.gmaps = None
-            self.has_api_key = False
-            print("⚠️ No Google Maps API key found")
+logger = logging.getLogger(__name__)
+
+class GoogleMapsClientRegistry:
+    """
+    Giữ 1 googlemaps.Client dùng chung cho cả process (lazy init).
+    - Dùng chung 1 requests.Session có connection pool (tránh bắt tay TCP/TLS mỗi request)
+    - API key đọc từ DB tối đa mỗi KEY_REFRESH_SECONDS giây, client chỉ tạo lại khi key thay đổi
+    """
     
-    def _get_api_key_from_db(self) -> Optional[str]:
+    def __init__(self, key_refresh_seconds: int = 60, pool_size: int = 10):
+        self.key_refresh_seconds = key_refresh_seconds
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._client: Optional[googlemaps.Client] = None
+        self._api_key: Optional[str] = None
+        self._client_key: Optional[str] = None  # Key đã dùng để tạo _client (get_api_key có thể đổi _api_key trước)
+        self._key_loaded_at = 0.0
+        self._session: Optional[requests.Session] = None
+        self.reload_count = 0
+    
+    def _get_session(self) -> requests.Session:
+        """Tạo requests.Session dùng chung với connection pool"""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+    
+    def _load_api_key_from_db(self) -> Optional[str]:
         """Lấy API key từ database"""
         try:
             db = SessionLocal()
-            setting = db.query(models.Settings).filter(
-                models.Settings.key == "google_maps_api_key"
-            ).first()
-            db.close()
+            try:
+                setting = db.query(models.Settings).filter(
+                    models.Settings.key == "google_maps_api_key"
+                ).first()
+            finally:
+                db.close()
             
             if setting and setting.value and setting.value != "YOUR_API_KEY_HERE":
                 return setting.value
             return None
         except Exception as e:
-            print(f"Lỗi lấy API key từ database: {e}")
+            logger.error("Lỗi lấy API key từ database: %s", e)
             return None
     
+    def _current_api_key(self) -> Optional[str]:
+        """API key hiện tại, chỉ đọc lại từ DB khi quá key_refresh_seconds (gọi khi đang giữ lock)"""
+        now = time.monotonic()
+        if now - self._key_loaded_at < self.key_refresh_seconds:
+            return self._api_key
+        self._key_loaded_at = now
+        return self._load_api_key_from_db()
+    
+    def get_api_key(self) -> Optional[str]:
+        """API key đang dùng (cho các provider không dùng googlemaps.Client, VD: httpx)"""
+        with self._lock:
+            api_key = self._current_api_key()
+            self._api_key = api_key
+            return api_key
+    
+    def get_client(self, api_key: Optional[str] = None) -> Optional[googlemaps.Client]:
+        """
+        Lấy client dùng chung. Nếu truyền api_key thì dùng key đó,
+        ngược lại đọc key từ DB (có cache theo key_refresh_seconds)
+        """
+        with self._lock:
+            if not api_key:
+                api_key = self._current_api_key()
+            
+            if not api_key or api_key == "YOUR_API_KEY_HERE":
+                self._client = None
+                self._client_key = None
+                self._api_key = None
+                return None
+            
+            if self._client is None or api_key != self._client_key:
+                try:
+                    self._client = googlemaps.Client(
+                        key=api_key,
+                        requests_session=self._get_session(),
+                        base_url=settings.GOOGLE_MAPS_BASE_URL
+                    )
+                    self._client_key = api_key
+                    self._api_key = api_key
+                    self.reload_count += 1
+                    logger.info("✅ Google Maps client initialized successfully")
+                except Exception as e:
+                    logger.error("❌ Lỗi khởi tạo Google Maps client: %s", e)
+                    self._client = None
+                    self._client_key = None
+                    self._api_key = None
+            
+            return self._client
+    
+    def invalidate(self):
+        """Buộc đọc lại API key ở lần gọi tiếp theo (gọi khi setting google_maps_api_key thay đổi)"""
+        with self._lock:
+            self._key_loaded_at = 0.0
+    
+    def get_status(self) -> Dict:
+        """Trạng thái của client dùng chung"""
+        return {
+            "has_client": self._client is not None,
+            "reload_count": self.reload_count,
+            "key_refresh_seconds": self.key_refresh_seconds,
+            "pool_size": self.pool_size
+        }
+
+# Registry dùng chung cho cả process
+google_maps_client_registry = GoogleMapsClientRegistry(
+    key_refresh_seconds=settings.GOOGLE_MAPS_KEY_REFRESH_SECONDS,
+    pool_size=settings.GOOGLE_MAPS_POOL_SIZE
+)
+
+class GoogleMapsDistanceCalculator:
+    def __init__(self, api_key: str = None):
+        """
+        Khởi tạo Google Maps calculator với fallback mechanism
+        (client lấy từ registry dùng chung, không tạo mới mỗi request)
+        """
+        self.gmaps = google_maps_client_registry.get_client(api_key)
+        self.has_api_key = self.gmaps is not None
+    
     def calculate_driving_distance(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
         """
         Tính khoảng cách và thời gian lái xe - Google Maps với fallback
         """
-        # Thử Google Maps trước
+        # Thử Google Maps trước (circuit mở thì trả Haversine ngay, không chờ Google)
         if self.has_api_key and self.gmaps:
-            try:
-                return self._google_maps_calculation(lat1, lng1, lat2, lng2)
-            except Exception as e:
-                print(f"❌ Google Maps failed, fallback to Haversine: {e}")
+            breaker = circuit_breakers.get("google_maps")
+            if breaker.allow_request():
+                started = time.perf_counter()
+                try:
+                    result = self._google_maps_calculation(lat1, lng1, lat2, lng2)
+                    breaker.record_success(time.perf_counter() - started)
+                    return result
+                except Exception as e:
+                    breaker.record_failure("error", str(e))
+                    logger.warning("❌ Google Maps failed, fallback to Haversine: %s", e)
+            else:
+                logger.debug("⚡ Google Maps circuit open, fallback to Haversine")
         
         # Fallback về Haversine khi Google Maps không có hoặc lỗi
         return self._haversine_calculation(lat1, lng1, lat2, lng2)
@@ -62,7 +165,7 @@ class GoogleMapsDistanceCalculator:
         """
         Tính toán sử dụng Google Maps Directions API
         """
-        print(f"🗺️ Using Google Maps for: ({lat1}, {lng1}) -> ({lat2}, {lng2})")
+        logger.debug("🗺️ Using Google Maps for: (%s, %s) -> (%s, %s)", lat1, lng1, lat2, lng2)
         
         try:
             # Gọi Google Maps Directions API
@@ -75,39 +178,7 @@ class GoogleMapsDistanceCalculator:
                 region="vn"
             )
             
-            if not directions_result or len(directions_result) == 0:
-                raise Exception("No route found")
-            
-            route = directions_result[0]
-            leg = route['legs'][0]
-            
-            # Lấy thông tin từ Google Maps
-            distance_km = leg['distance']['value'] / 1000  # m -> km
-            duration_minutes = leg['duration']['value'] / 60  # s -> phút
-            
-            # Lấy địa chỉ chi tiết
-            start_address = leg['start_address']
-            end_address = leg['end_address']
-            
-            # Lấy polyline để vẽ đường đi
-            polyline = route['overview_polyline']['points']
-            
-            return {
-                "distance_km": round(distance_km, 2),
-                "duration_minutes": round(duration_minutes, 1),
-                "start_address": start_address,
-                "end_address": end_address,
-                "polyline": polyline,
-                "method": "google_maps",
-                "success": True,
-                "route_info": {
-                    "summary": route.get('summary', ''),
-                    "warnings": route.get('warnings', []),
-                    "distance_text": leg['distance']['text'],
-                    "duration_text": leg['duration']['text'],
-                    "steps_count": len(leg['steps'])
-                }
-            }
+            return self.build_directions_result(directions_result)
             
         except googlemaps.exceptions.ApiError as e:
             raise Exception(f"Google Maps API Error: {str(e)}")
@@ -116,11 +187,51 @@ class GoogleMapsDistanceCalculator:
         except Exception as e:
             raise Exception(f"Google Maps Error: {str(e)}")
     
+    @staticmethod
+    def build_directions_result(directions_result) -> Dict:
+        """
+        Chuyển kết quả Directions API (list routes) thành dict kết quả chuẩn
+        (dùng chung cho client đồng bộ và async provider)
+        """
+        if not directions_result or len(directions_result) == 0:
+            raise Exception("No route found")
+
+        route = directions_result[0]
+        leg = route['legs'][0]
+
+        # Lấy thông tin từ Google Maps
+        distance_km = leg['distance']['value'] / 1000  # m -> km
+        duration_minutes = leg['duration']['value'] / 60  # s -> phút
+
+        # Lấy địa chỉ chi tiết
+        start_address = leg['start_address']
+        end_address = leg['end_address']
+
+        # Lấy polyline để vẽ đường đi
+        polyline = route['overview_polyline']['points']
+
+        return {
+            "distance_km": round(distance_km, 2),
+            "duration_minutes": round(duration_minutes, 1),
+            "start_address": start_address,
+            "end_address": end_address,
+            "polyline": polyline,
+            "method": "google_maps",
+            "success": True,
+            "route_info": {
+                "summary": route.get('summary', ''),
+                "warnings": route.get('warnings', []),
+                "distance_text": leg['distance']['text'],
+                "duration_text": leg['duration']['text'],
+                "steps_count": len(leg['steps'])
+            }
+        }
+    
     def _haversine_calculation(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
         """
         Fallback: Tính khoảng cách theo công thức Haversine (điều chỉnh thực tế)
         """
-        print(f"🧮 Using Haversine calculation (fallback)")
+        logger.debug("🧮 Using Haversine calculation (fallback)")
         
         # Chuyển độ sang radian
         lat1_rad, lng1_rad, lat2_rad, lng2_rad = map(math.radians, [lat1, lng1, lat2, lng2])
@@ -0,0 +1,83 @@
+# backend/app/utils/haversine.py
+
+import bisect
+import math
+from typing import Dict
+
+import numpy as np
+
+# Điều chỉnh Haversine theo địa hình Việt Nam, chia theo khoảng cách đường chim bay:
+# < 5km nội thành (TP.HCM, Hà Nội - nhiều ngã tư, đường vòng), < 15km ngoại thành, < 50km liên quận, còn lại liên tỉnh
+HAVERSINE_THRESHOLDS_KM = (5, 15, 50)
+HAVERSINE_MULTIPLIERS = (1.5, 1.35, 1.25, 1.15)
+HAVERSINE_AVG_SPEEDS = (25, 35, 45, 55)  # km/h
+HAVERSINE_AREA_TYPES = ("nội thành", "ngoại thành", "liên quận", "liên tỉnh")
+EARTH_RADIUS_KM = 6371
+
+
+def enhanced_haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+    """Khoảng cách/thời gian ước tính từ đường chim bay, điều chỉnh theo đặc điểm giao thông Việt Nam"""
+    # Chuyển độ sang radian
+    lat1_rad, lng1_rad, lat2_rad, lng2_rad = map(math.radians, [lat1, lng1, lat2, lng2])
+
+    # Công thức Haversine
+    dlat = lat2_rad - lat1_rad
+    dlng = lng2_rad - lng1_rad
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+
+    straight_distance = EARTH_RADIUS_KM * c
+
+    # Điều chỉnh theo địa hình Việt Nam
+    area = bisect.bisect_right(HAVERSINE_THRESHOLDS_KM, straight_distance)
+    distance_multiplier = HAVERSINE_MULTIPLIERS[area]
+    avg_speed = HAVERSINE_AVG_SPEEDS[area]
+    area_type = HAVERSINE_AREA_TYPES[area]
+
+    # Tính khoảng cách và thời gian thực tế
+    adjusted_distance = straight_distance * distance_multiplier
+    estimated_duration = (adjusted_distance / avg_speed) * 60
+
+    return {
+        "distance_km": round(adjusted_distance, 2),
+        "duration_minutes": round(estimated_duration, 1),
+        "start_address": f"Tọa độ {lat1:.4f}, {lng1:.4f}",
+        "end_address": f"Tọa độ {lat2:.4f}, {lng2:.4f}",
+        "polyline": None,
+        "method": "enhanced_haversine",
+        "success": True,
+        "route_info": {
+            "summary": f"Ước tính {area_type} (hệ số ×{distance_multiplier})",
+            "warnings": ["Khoảng cách ước tính dựa trên đặc điểm giao thông Việt Nam"],
+            "distance_text": f"{round(adjusted_distance, 2)} km",
+            "duration_text": f"~{round(estimated_duration)} phút",
+            "calculation_details": {
+                "straight_distance": round(straight_distance, 2),
+                "multiplier": distance_multiplier,
+                "avg_speed": avg_speed,
+                "area_type": area_type
+            }
+        }
+    }
+
+
+def enhanced_haversine_arrays(lat1, lng1, lat2, lng2) -> Dict[str, np.ndarray]:
+    """
+    Bản mảng của enhanced_haversine: nhận các cột tọa độ, trả về các cột
+    distance_km, duration_minutes (đã làm tròn như bản scalar), straight_distance và area (chỉ số vùng)
+    """
+    lat1_rad, lng1_rad, lat2_rad, lng2_rad = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+
+    a = np.sin((lat2_rad - lat1_rad) / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin((lng2_rad - lng1_rad) / 2) ** 2
+    straight_distance = EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+    area = np.searchsorted(HAVERSINE_THRESHOLDS_KM, straight_distance, side="right")
+    adjusted_distance = straight_distance * np.asarray(HAVERSINE_MULTIPLIERS)[area]
+    estimated_duration = adjusted_distance / np.asarray(HAVERSINE_AVG_SPEEDS)[area] * 60
+
+    return {
+        "distance_km": np.round(adjusted_distance, 2),
+        "duration_minutes": np.round(estimated_duration, 1),
+        "straight_distance": straight_distance,
+        "area": area
+    }
@@ -0,0 +1,198 @@
+# backend/app/utils/metrics.py
+"""
+Metrics trong process, xuất theo định dạng text của Prometheus (GET /metrics).
+- Counter / Histogram có label, thread-safe (request async + thread nền cùng ghi)
+- Collector: hàm đọc số liệu có sẵn (VD: route cache get_stats()) lúc scrape, không tốn chi phí ở đường nóng
+Không phụ thuộc prometheus_client - chỉ cần phần nhỏ của format 0.0.4.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Đủ chi tiết cho cả bước rẻ (tra index ~µs) lẫn gọi Google Maps (~giây)
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} cần đúng các label {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Mỗi bộ label: [đếm theo từng bucket (không cộng dồn, phần tử cuối là +Inf), tổng, số lần]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with histogram.time(stage="pricing"): ... - ghi thời gian chạy (giây), kể cả khi lỗi"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get_count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series_items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = self._header()
+        bounds = self.buckets + (math.inf,)
+        for key, (counts, total, count) in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# Collector trả về các family: (name, type, help, labelnames, [(label values, value), ...])
+CollectorResult = Iterable[Tuple[str, str, str, Sequence[str], Iterable[Tuple[Sequence, float]]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], CollectorResult]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} đã được đăng ký với kiểu/label khác")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], CollectorResult]):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                families = list(collector())
+            except Exception:
+                # Lỗi 1 collector không được làm hỏng cả lần scrape
+                continue
+            for name, type_name, documentation, labelnames, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for values, value in samples:
+                    lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Singleton registry + các metric dùng chung
+metrics = MetricsRegistry()
+
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "Số request HTTP đã xử lý", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP (giây)", ("method", "route"))
+QUOTE_STAGE_DURATION = metrics.histogram(
+    "quote_stage_duration_seconds",
+    "Thời gian từng bước báo giá: config_load, fixed_price_lookup, distance, pricing, trip_persistence",
+    ("stage",))
+DISTANCE_LOOKUP_DURATION = metrics.histogram(
+    "distance_lookup_duration_seconds", "Thời gian lấy khoảng cách theo nguồn (google_maps, haversine, cache)",
+    ("source",))
+UPSTREAM_ERRORS = metrics.counter(
+    "upstream_errors_total", "Lỗi khi gọi dịch vụ ngoài", ("upstream", "kind"))
@@ -0,0 +1,291 @@
+# backend/app/utils/notification_outbox.py
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.database.database import SessionLocal
+from app.models import models
+from app.utils.simple_email_service import simple_email_service
+from app.utils.telegram_service import telegram_service
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_CHANNELS = ("email", "telegram")
+
+
+def enqueue_notifications(db: Session, event: str, payload: Dict, booking_id: Optional[int] = None,
+                          channels=NOTIFICATION_CHANNELS) -> List[models.NotificationOutbox]:
+    """
+    Thêm thông báo vào outbox trong transaction hiện tại (chưa commit).
+    Caller commit cùng lúc với dữ liệu nghiệp vụ rồi gọi notification_dispatcher.wake().
+    """
+    rows = [
+        models.NotificationOutbox(
+            channel=channel,
+            event=event,
+            booking_id=booking_id,
+            payload=payload,
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.utcnow()
+        )
+        for channel in channels
+    ]
+    db.add_all(rows)
+    return rows
+
+
+class NotificationDispatcher:
+    """
+    Thread nền gửi các thông báo trong bảng notification_outbox.
+    - Nhận dòng pending đến hạn bằng UPDATE có điều kiện (status còn pending) -> mỗi worker uvicorn
+      chạy 1 dispatcher riêng nhưng 1 dòng chỉ được 1 worker gửi
+    - Lỗi thì thử lại với exponential backoff + jitter, quá max_attempts thì đánh dấu failed
+    - Dòng kẹt ở trạng thái sending quá claim_lease_seconds (worker tắt/chết giữa chừng) được đưa về pending
+    """
+
+    def __init__(self, poll_interval: float = 5.0, batch_size: int = 20, max_attempts: int = 6,
+                 retry_base_seconds: float = 30.0, retry_max_seconds: float = 3600.0,
+                 claim_lease_seconds: float = 300.0):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.claim_lease_seconds = claim_lease_seconds
+        self._last_recovery = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats_counters = {
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "skipped": 0,
+            "rate_limited": 0,
+            "recovered": 0,
+            "claim_conflicts": 0
+        }
+        self.last_error = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop.clear()
+        self._recover_stale()
+        self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("📨 Notification dispatcher started (poll %ss, max %s attempts)", self.poll_interval, self.max_attempts)
+
+    def stop(self, timeout: float = 15.0):
+        """Dừng sau khi gửi xong batch đang xử lý (các dòng còn lại gửi ở lần chạy sau)"""
+        if not self.is_running:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info("📨 Notification dispatcher stopped")
+
+    def wake(self):
+        """Báo có thông báo mới để gửi ngay, không chờ hết poll_interval"""
+        self._wake.set()
+
+    def _recover_stale(self):
+        """Đưa về pending các dòng sending đã quá lease (dòng worker khác đang gửi thì không đụng tới)"""
+        self._last_recovery = time.monotonic()
+        db = SessionLocal()
+        try:
+            Outbox = models.NotificationOutbox
+            cutoff = datetime.utcnow() - timedelta(seconds=self.claim_lease_seconds)
+            recovered = db.query(Outbox).filter(
+                Outbox.status == "sending",
+                or_(Outbox.claimed_at.is_(None), Outbox.claimed_at < cutoff)
+            ).update({"status": "pending", "claimed_at": None}, synchronize_session=False)
+            db.commit()
+            if recovered:
+                self.stats_counters["recovered"] += recovered
+                logger.info("📨 Recovered %s notifications stuck in 'sending' past %ss lease", recovered, self.claim_lease_seconds)
+        except Exception as e:
+            db.rollback()
+            logger.warning("⚠️ Could not recover outbox rows: %s", e)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_recovery >= self.claim_lease_seconds / 2:
+                self._recover_stale()
+            try:
+                processed = self.dispatch_due()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("❌ Notification dispatcher error: %s", e)
+                processed = 0
+
+            # Còn dòng đến hạn thì xử lý tiếp, không thì chờ tới lần poll sau hoặc khi được wake
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim_due(self, db: Session) -> List[models.NotificationOutbox]:
+        """Nhận các dòng đến hạn; dòng nào worker khác vừa nhận trước (rowcount = 0) thì bỏ qua"""
+        Outbox = models.NotificationOutbox
+        now = datetime.utcnow()
+        candidate_ids = [row_id for (row_id,) in db.query(Outbox.id).filter(
+            Outbox.status == "pending",
+            Outbox.next_attempt_at <= now
+        ).order_by(Outbox.next_attempt_at, Outbox.id).limit(self.batch_size).all()]
+
+        claimed_ids = []
+        for row_id in candidate_ids:
+            claimed = db.query(Outbox).filter(
+                Outbox.id == row_id,
+                Outbox.status == "pending",
+                Outbox.next_attempt_at <= now
+            ).update({
+                "status": "sending",
+                "claimed_at": now,
+                "attempts": func.coalesce(Outbox.attempts, 0) + 1
+            }, synchronize_session=False)
+            if claimed:
+                claimed_ids.append(row_id)
+            else:
+                self.stats_counters["claim_conflicts"] += 1
+        db.commit()
+        if not claimed_ids:
+            return []
+        return db.query(Outbox).filter(Outbox.id.in_(claimed_ids)).order_by(Outbox.next_attempt_at, Outbox.id).all()
+
+    def dispatch_due(self) -> int:
+        """Gửi 1 lượt các thông báo đến hạn, trả về số dòng đã xử lý"""
+        db = SessionLocal()
+        try:
+            rows = self._claim_due(db)
+
+            # Email gửi chung 1 kết nối SMTP, Telegram gộp theo batch (có thể thành tin tổng hợp)
+            email_rows = [row for row in rows if row.channel == "email" and row.event == "new_booking"]
+            telegram_rows = [row for row in rows if row.channel == "telegram" and row.event == "new_booking"]
+            if email_rows:
+                self._deliver_emails(email_rows)
+                db.commit()
+            if telegram_rows:
+                self._deliver_telegram(db, telegram_rows)
+                db.commit()
+
+            for row in rows:
+                if row in email_rows or row in telegram_rows:
+                    continue
+                self._record_result(row, False, f"Unknown notification '{row.channel}:{row.event}'")
+                db.commit()
+            return len(rows)
+        finally:
+            db.close()
+
+    def _deliver_emails(self, rows: List[models.NotificationOutbox]):
+        try:
+            results = simple_email_service.send_new_booking_notifications([row.payload for row in rows])
+        except Exception as e:
+            simple_email_service.smtp.last_error = str(e)
+            results = [False] * len(rows)
+        for row, ok in zip(rows, results):
+            self._record_result(row, ok, None if ok else (simple_email_service.smtp.last_error or "SMTP send failed"))
+
+    def _deliver_telegram(self, db: Session, rows: List[models.NotificationOutbox]):
+        # Lấy config Telegram từ database ở thời điểm gửi
+        values = dict(db.query(models.Settings.key, models.Settings.value).filter(
+            models.Settings.key.in_(("telegram_bot_token", "telegram_chat_id"))
+        ).all())
+        if not values.get("telegram_bot_token") or not values.get("telegram_chat_id"):
+            for row in rows:
+                self._record_result(row, True, "skipped: chưa cấu hình bot token/chat ID")
+            return
+
+        telegram_service.set_credentials(values["telegram_bot_token"], values["telegram_chat_id"])
+        try:
+            results = telegram_service.send_new_booking_notifications([row.payload for row in rows])
+        except Exception as e:
+            results = [{"success": False, "error": str(e)}] * len(rows)
+        for row, result in zip(rows, results):
+            self._record_result(row, result.get("success", False), result.get("error"),
+                                retry_after=result.get("retry_after") if result.get("rate_limited") else None)
+
+    def _record_result(self, row: models.NotificationOutbox, ok: bool, error: Optional[str],
+                       retry_after: Optional[float] = None):
+        row.last_error = error
+        if ok:
+            row.status = "skipped" if error else "sent"
+            row.sent_at = datetime.utcnow()
+            self.stats_counters["skipped" if error else "sent"] += 1
+            return
+
+        if retry_after is not None:
+            # Bị giới hạn tốc độ: gửi lại đúng lúc được phép, không tính là 1 lần thất bại
+            row.status = "pending"
+            row.attempts = max(0, (row.attempts or 0) - 1)
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_after)
+            self.stats_counters["rate_limited"] += 1
+            return
+
+        self.last_error = error
+        if row.attempts >= self.max_attempts:
+            row.status = "failed"
+            self.stats_counters["failed"] += 1
+            logger.error("❌ Notification #%s (%s) failed after %s attempts: %s", row.id, row.channel, row.attempts, error)
+            return
+
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** (row.attempts - 1)))
+        delay *= random.uniform(0.8, 1.2)
+        row.status = "pending"
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        self.stats_counters["retried"] += 1
+        logger.warning("⚠️ Notification #%s (%s) attempt %s failed, retry in %ss: %s", row.id, row.channel, row.attempts, round(delay), error)
+
+    def retry(self, db: Session, notification_id: int) -> Optional[models.NotificationOutbox]:
+        """Đưa 1 thông báo (thường là failed) về pending để gửi lại ngay"""
+        row = db.query(models.NotificationOutbox).filter(models.NotificationOutbox.id == notification_id).first()
+        if not row:
+            return None
+        row.status = "pending"
+        row.attempts = 0
+        row.next_attempt_at = datetime.utcnow()
+        db.commit()
+        self.wake()
+        return row
+
+    def get_stats(self, db: Optional[Session] = None) -> Dict:
+        stats = {
+            **self.stats_counters,
+            "running": self.is_running,
+            "poll_interval": self.poll_interval,
+            "max_attempts": self.max_attempts,
+            "claim_lease_seconds": self.claim_lease_seconds,
+            "last_error": self.last_error
+        }
+        if db is not None:
+            stats["by_status"] = dict(db.query(
+                models.NotificationOutbox.status, func.count(models.NotificationOutbox.id)
+            ).group_by(models.NotificationOutbox.status).all())
+        return stats
+
+
+# Singleton instance
+notification_dispatcher = NotificationDispatcher(
+    poll_interval=settings.NOTIFICATION_POLL_SECONDS,
+    max_attempts=settings.NOTIFICATION_MAX_ATTEMPTS,
+    retry_base_seconds=settings.NOTIFICATION_RETRY_BASE_SECONDS,
+    claim_lease_seconds=settings.NOTIFICATION_CLAIM_LEASE_SECONDS
+)
@@ -1,16 +1,27 @@
 # backend/app/utils/price_calculator.py
 
-import math
+import asyncio
+import logging
+import time
 from typing import Dict, Optional
+
+import numpy as np
 from app.models.schemas import TripCalculationRequest
 
+logger = logging.getLogger(__name__)
+
 # Import Google Maps calculator với error handling
 try:
     from app.utils.google_maps_calculator import GoogleMapsDistanceCalculator
     GOOGLE_MAPS_AVAILABLE = True
 except ImportError:
     GOOGLE_MAPS_AVAILABLE = False
-    print("⚠️ Google Maps calculator không có sẵn, sử dụng Haversine")
+    logger.warning("⚠️ Google Maps calculator không có sẵn, sử dụng Haversine")
+
+from app.utils.route_cache import route_distance_cache
+from app.utils.distance_providers import DistanceProviderError, get_distance_provider_chain, get_google_distance_provider
+from app.utils.metrics import DISTANCE_LOOKUP_DURATION, UPSTREAM_ERRORS
+from app.utils.haversine import enhanced_haversine, enhanced_haversine_arrays
 
 class PriceCalculator:
     def __init__(self, base_price: float, price_per_km: float, min_price: float, max_price: float, use_google_maps: bool = True):
@@ -18,6 +29,7 @@ class PriceCalculator:
         self.price_per_km = price_per_km
         self.min_price = min_price
         self.max_price = max_price
+        self.use_google_maps = use_google_maps and GOOGLE_MAPS_AVAILABLE
         
         # Khởi tạo Google Maps calculator nếu có thể
         self.google_maps_calculator = None
@@ -25,94 +37,100 @@ class PriceCalculator:
             try:
                 self.google_maps_calculator = GoogleMapsDistanceCalculator()
                 if self.google_maps_calculator.has_api_key:
-                    print("✅ Google Maps calculator ready")
+                    logger.info("✅ Google Maps calculator ready")
                 else:
-                    print("⚠️ Google Maps calculator initialized but no API key")
+                    logger.warning("⚠️ Google Maps calculator initialized but no API key")
             except Exception as e:
-                print(f"❌ Cannot initialize Google Maps calculator: {e}")
+                logger.error("❌ Cannot initialize Google Maps calculator: %s", e)
                 self.google_maps_calculator = None
     
-    def calculate_distance_and_duration(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+    def calculate_distance_and_duration(self, lat1: float, lng1: float, lat2: float, lng2: float, use_cache: bool = True) -> Dict:
         """
         Tính khoảng cách và thời gian - Smart calculation với fallback
+        use_cache=False để bỏ qua cache khoảng cách (luôn gọi Google Maps)
         """
-        print(f"🚀 Calculating distance: ({lat1}, {lng1}) -> ({lat2}, {lng2})")
+        logger.debug("🚀 Calculating distance: (%s, %s) -> (%s, %s)", lat1, lng1, lat2, lng2)
         
         # Thử Google Maps trước nếu có
         if self.google_maps_calculator:
+            # Kiểm tra cache trước khi gọi Google Maps
+            if use_cache:
+                cached = route_distance_cache.get(lat1, lng1, lat2, lng2)
+                if cached:
+                    logger.debug("🎯 Route cache hit: %s km", cached['distance_km'])
+                    cached["from_cache"] = True
+                    return cached
+            
             try:
-                print(f"✅ Google Maps start: ----------------------------------------------------")
+                started = time.perf_counter()
                 result = self.google_maps_calculator.calculate_driving_distance(lat1, lng1, lat2, lng2)
-                print(f"✅ Google Maps response: {result} ----------------------------------------------------")
+                logger.debug("✅ Google Maps response: %s", result)
                 if result.get('success'):
-                    print(f"✅ Google Maps success: {result['distance_km']} km in {result['duration_minutes']} min")
+                    logger.debug("✅ Google Maps success: %s km in %s min", result['distance_km'], result['duration_minutes'])
+                    # Chỉ cache kết quả đường đi thực tế, không cache ước tính Haversine
+                    if result.get("method") == "google_maps":
+                        DISTANCE_LOOKUP_DURATION.observe(time.perf_counter() - started, source="google_maps")
+                        route_distance_cache.set(lat1, lng1, lat2, lng2, result)
                     return result
             except Exception as e:
-                print(f"❌ Google Maps error: {e}")
+                UPSTREAM_ERRORS.inc(upstream="google_maps", kind="error")
+                logger.warning("❌ Google Maps error: %s", e)
         
         # Fallback về Haversine calculation
-        print("🔄 Fallback to enhanced Haversine calculation")
+        logger.debug("🔄 Fallback to enhanced Haversine calculation")
         return self._enhanced_haversine_calculation(lat1, lng1, lat2, lng2)
     
-    def _enhanced_haversine_calculation(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+    async def calculate_distance_and_duration_async(self, lat1: float, lng1: float, lat2: float, lng2: float,
+                                                    use_cache: bool = True, timeout: Optional[float] = None) -> Dict:
         """
-        Enhanced Haversine calculation với điều chỉnh thực tế cho Việt Nam
+        Bản async của calculate_distance_and_duration - không block event loop.
+        Đi qua chuỗi provider (DISTANCE_PROVIDERS) với timeout cho từng provider:
+        provider lỗi/hết giờ thì chuyển sang provider kế tiếp, cuối cùng là Haversine.
+        Nếu request bị hủy (client ngắt kết nối), lời gọi upstream cũng bị hủy theo.
         """
-        # Chuyển độ sang radian
-        lat1_rad, lng1_rad, lat2_rad, lng2_rad = map(math.radians, [lat1, lng1, lat2, lng2])
-        
-        # Công thức Haversine
-        dlat = lat2_rad - lat1_rad
-        dlng = lng2_rad - lng1_rad
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Bán kính trái đất
-        earth_radius = 6371
-        straight_distance = earth_radius * c
+        logger.debug("🚀 Calculating distance (async): (%s, %s) -> (%s, %s)", lat1, lng1, lat2, lng2)
         
-        # Điều chỉnh theo địa hình Việt Nam
-        if straight_distance < 5:  # Nội thành (TP.HCM, Hà Nội)
-            distance_multiplier = 1.5  # Nhiều ngã tư, đường vòng
-            avg_speed = 25  # km/h
-            area_type = "nội thành"
-        elif straight_distance < 15:  # Ngoại thành
-            distance_multiplier = 1.35
-            avg_speed = 35  # km/h
-            area_type = "ngoại thành"
-        elif straight_distance < 50:  # Liên quận/huyện
-            distance_multiplier = 1.25
-            avg_speed = 45  # km/h
-            area_type = "liên quận"
-        else:  # Liên tỉnh
-            distance_multiplier = 1.15
-            avg_speed = 55  # km/h
-            area_type = "liên tỉnh"
-        
-        # Tính khoảng cách và thời gian thực tế
-        adjusted_distance = straight_distance * distance_multiplier
-        estimated_duration = (adjusted_distance / avg_speed) * 60
+        if self.use_google_maps:
+            if use_cache:
+                started = time.perf_counter()
+                cached = await asyncio.to_thread(route_distance_cache.get, lat1, lng1, lat2, lng2)
+                if cached:
+                    DISTANCE_LOOKUP_DURATION.observe(time.perf_counter() - started, source="cache")
+                    logger.debug("🎯 Route cache hit: %s km", cached['distance_km'])
+                    cached["from_cache"] = True
+                    return cached
+            
+            try:
+                result = await get_distance_provider_chain().route(lat1, lng1, lat2, lng2, timeout=timeout)
+                # Chỉ cache kết quả đường đi thực tế, không cache ước tính Haversine
+                if result.get("method") != "enhanced_haversine":
+                    await asyncio.to_thread(route_distance_cache.set, lat1, lng1, lat2, lng2, result)
+                return result
+            except DistanceProviderError as e:
+                logger.warning("❌ %s, fallback to Haversine", e)
         
+        # Fallback về Haversine calculation
+        logger.debug("🔄 Fallback to enhanced Haversine calculation")
+        return self._enhanced_haversine_calculation(lat1, lng1, lat2, lng2)
+    
+    def _enhanced_haversine_calculation(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Dict:
+        """
+        Enhanced Haversine calculation với điều chỉnh thực tế cho Việt Nam
+        """
+        with DISTANCE_LOOKUP_DURATION.time(source="haversine"):
+            return enhanced_haversine(lat1, lng1, lat2, lng2)
+    
+    # Bản mảng (NumPy) - dùng cho định giá lại hàng loạt
+    enhanced_haversine_arrays = staticmethod(enhanced_haversine_arrays)
+    
+    def calculate_prices(self, distances_km) -> Dict[str, np.ndarray]:
+        """Bản mảng của calculate_price(): final_price cho cả cột khoảng cách"""
+        distances = np.asarray(distances_km, dtype=float)
+        calculated = self.base_price + distances * self.price_per_km
         return {
-            "distance_km": round(adjusted_distance, 2),
-            "duration_minutes": round(estimated_duration, 1),
-            "start_address": f"Tọa độ {lat1:.4f}, {lng1:.4f}",
-            "end_address": f"Tọa độ {lat2:.4f}, {lng2:.4f}",
-            "polyline": None,
-            "method": "enhanced_haversine",
-            "success": True,
-            "route_info": {
-                "summary": f"Ước tính {area_type} (hệ số ×{distance_multiplier})",
-                "warnings": ["Khoảng cách ước tính dựa trên đặc điểm giao thông Việt Nam"],
-                "distance_text": f"{round(adjusted_distance, 2)} km",
-                "duration_text": f"~{round(estimated_duration)} phút",
-                "calculation_details": {
-                    "straight_distance": round(straight_distance, 2),
-                    "multiplier": distance_multiplier,
-                    "avg_speed": avg_speed,
-                    "area_type": area_type
-                }
-            }
+            "distance_km": distances,
+            "calculated_price": calculated,
+            "final_price": np.maximum(self.min_price, np.minimum(calculated, self.max_price))
         }
     
     def calculate_distance(self, lat1: float, lng1: float, lat2: float, lng2: float) -> float:
@@ -152,14 +170,34 @@ class PriceCalculator:
         """
         Tính toán đầy đủ cho một chuyến đi với smart calculation
         """
-        print(f"🎯 Calculating trip: {request.from_address} -> {request.to_address}")
+        logger.debug("🎯 Calculating trip: %s -> %s", request.from_address, request.to_address)
         
         # Tính khoảng cách và thời gian với smart method
         distance_result = self.calculate_distance_and_duration(
             request.from_lat, request.from_lng,
-            request.to_lat, request.to_lng
+            request.to_lat, request.to_lng,
+            use_cache=getattr(request, "use_cache", True)
         )
         
+        return self._build_trip_result(request, distance_result)
+    
+    async def calculate_trip_async(self, request: TripCalculationRequest, timeout: Optional[float] = None) -> Dict:
+        """
+        Bản async của calculate_trip (dùng trong các handler async của FastAPI)
+        """
+        logger.debug("🎯 Calculating trip (async): %s -> %s", request.from_address, request.to_address)
+        
+        distance_result = await self.calculate_distance_and_duration_async(
+            request.from_lat, request.from_lng,
+            request.to_lat, request.to_lng,
+            use_cache=getattr(request, "use_cache", True),
+            timeout=timeout
+        )
+        
+        return self._build_trip_result(request, distance_result)
+    
+    def _build_trip_result(self, request: TripCalculationRequest, distance_result: Dict) -> Dict:
+        """Tính giá và kết hợp với kết quả khoảng cách"""
         # Tính giá
         price_info = self.calculate_price(distance_result["distance_km"])
         
@@ -177,10 +215,11 @@ class PriceCalculator:
             "route_info": distance_result.get("route_info", {}),
             "calculation_method": distance_result.get("method", "unknown"),
             "polyline": distance_result.get("polyline"),
+            "from_cache": distance_result.get("from_cache", False),
             "success": distance_result.get("success", True)
         }
         
-        print(f"✅ Trip calculation complete: {result['distance_km']} km, {result['calculated_price']} VND")
+        logger.debug("✅ Trip calculation complete: %s km, %s VND", result['distance_km'], result['calculated_price'])
         return result
     
     def get_calculation_status(self) -> Dict:
@@ -191,5 +230,8 @@ class PriceCalculator:
             "google_maps_available": GOOGLE_MAPS_AVAILABLE,
             "google_maps_ready": self.google_maps_calculator is not None and self.google_maps_calculator.has_api_key,
             "fallback_method": "enhanced_haversine",
+            "async_provider": get_google_distance_provider().name,
+            "distance_providers": get_distance_provider_chain().get_status(),
+            "route_cache": route_distance_cache.get_stats(),
             "status": "ready"
         }
\ No newline at end of file
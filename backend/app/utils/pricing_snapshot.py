@@ -0,0 +1,249 @@
+# backend/app/utils/pricing_snapshot.py
+
+import copy
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.database.database import SessionLocal, engine
+from app.models import models
+from app.utils.tier_calculator import TierPriceCalculator, tier_calculator_cache
+
+logger = logging.getLogger(__name__)
+
+# Các setting ảnh hưởng tới cấu hình tính giá
+PRICING_SETTING_KEYS = ("active_pricing_config", "use_fixed_price")
+
+
+@dataclass(frozen=True)
+class PricingSnapshot:
+    """Ảnh chụp bất biến của cấu hình tính giá đang active"""
+    version: int
+    config_type: str                 # simple | tier
+    config_name: str
+    config: Optional[Dict]           # None nếu chưa set active_pricing_config
+    use_fixed_price: bool
+    default_config: Optional[Dict] = None  # simple:default - dùng khi config là None
+    error: Optional[str] = None      # Config active không tồn tại
+    loaded_at: float = field(default_factory=time.time)
+
+    def as_active_config(self) -> Dict:
+        """Định dạng response của /active-config (bản copy, không chia sẻ state)"""
+        return {
+            "type": self.config_type,
+            "config_name": self.config_name,
+            "use_fixed_price": self.use_fixed_price,
+            "config": copy.deepcopy(self.config)
+        }
+
+    def effective_config(self):
+        """(type, name, config) dùng để tính giá, fallback về simple:default"""
+        if self.config:
+            return self.config_type, self.config_name, copy.deepcopy(self.config)
+        if self.default_config:
+            return "simple", "default", copy.deepcopy(self.default_config)
+        return self.config_type, self.config_name, None
+
+    def tier_calculator(self) -> TierPriceCalculator:
+        """Calculator đã biên dịch của config tier active - biên dịch 1 lần cho mỗi version snapshot"""
+        return tier_calculator_cache.get(
+            ("snapshot", self.version, self.config_name), self.config["base_price"], self.config["tiers"]
+        )
+
+
+class PricingSnapshotStore:
+    """
+    Giữ PricingSnapshot trong memory, thay thế nguyên khối khi cấu hình giá thay đổi.
+    Mỗi worker so sánh version trong bảng pricing_config_version (1 query theo primary key,
+    tối đa mỗi check_interval giây) để phát hiện snapshot cũ do worker khác ghi.
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._snapshot: Optional[PricingSnapshot] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+        self.stats_counters = {
+            "hits": 0,
+            "reloads": 0,
+            "version_checks": 0,
+            "invalidations": 0
+        }
+
+    def _ensure_table(self):
+        """Tạo bảng version nếu chưa có (chỉ chạy 1 lần)"""
+        if not self._table_ready:
+            models.PricingConfigVersion.__table__.create(bind=engine, checkfirst=True)
+            self._table_ready = True
+
+    def _read_version(self, db: Session) -> int:
+        self._ensure_table()
+        row = db.query(models.PricingConfigVersion.version).filter(
+            models.PricingConfigVersion.id == 1
+        ).first()
+        return row[0] if row else 0
+
+    def _bump_version(self, db: Session) -> int:
+        """Tăng version trong DB để các worker khác biết snapshot đã cũ"""
+        self._ensure_table()
+        row = db.query(models.PricingConfigVersion).filter(
+            models.PricingConfigVersion.id == 1
+        ).first()
+        if row:
+            row.version = (row.version or 0) + 1
+        else:
+            row = models.PricingConfigVersion(id=1, version=1)
+            db.add(row)
+        db.commit()
+        return row.version
+
+    def _load(self, db: Session, version: int) -> PricingSnapshot:
+        """Đọc cấu hình từ DB và dựng snapshot mới"""
+        settings_rows = db.query(models.Settings).filter(
+            models.Settings.key.in_(PRICING_SETTING_KEYS)
+        ).all()
+        values = {row.key: row.value for row in settings_rows}
+        use_fixed_price = values.get("use_fixed_price") == "true"
+
+        config_value = values.get("active_pricing_config")
+        if not config_value:
+            # Mặc định là simple pricing
+            default_config = db.query(models.PriceConfig).filter(
+                models.PriceConfig.config_name == "default"
+            ).first()
+            return PricingSnapshot(
+                version=version,
+                config_type="simple",
+                config_name="default",
+                config=None,
+                use_fixed_price=use_fixed_price,
+                default_config=self._simple_config_dict(default_config) if default_config else None
+            )
+
+        config_type, config_name, config, error = self.load_config(db, config_value)
+        return PricingSnapshot(
+            version=version,
+            config_type=config_type,
+            config_name=config_name,
+            config=config,
+            use_fixed_price=use_fixed_price,
+            error=error
+        )
+
+    def load_config(self, db: Session, config_value: str):
+        """
+        Đọc 1 cấu hình giá theo chuỗi "simple:default" / "tier:standard" (không qua snapshot).
+        Trả về (type, name, config dict hoặc None, lỗi hoặc None)
+        """
+        # Parse config value: "simple:default" hoặc "tier:standard"
+        if ":" in config_value:
+            config_type, config_name = config_value.split(":", 1)
+        else:
+            config_type = "simple"
+            config_name = config_value
+
+        config = None
+        error = None
+        if config_type == "tier":
+            tier_config = db.query(models.TierPriceConfigModel).filter(
+                models.TierPriceConfigModel.name == config_name,
+                models.TierPriceConfigModel.is_active == True
+            ).first()
+            if tier_config:
+                config = {
+                    "name": tier_config.name,
+                    "base_price": tier_config.base_price,
+                    "tiers": copy.deepcopy(tier_config.tiers)
+                }
+            else:
+                error = f"Tier config '{config_name}' không tồn tại"
+        else:
+            simple_config = db.query(models.PriceConfig).filter(
+                models.PriceConfig.config_name == config_name
+            ).first()
+            if simple_config:
+                config = self._simple_config_dict(simple_config)
+            else:
+                error = f"Simple config '{config_name}' không tồn tại"
+
+        return config_type, config_name, config, error
+
+    @staticmethod
+    def _simple_config_dict(config: models.PriceConfig) -> Dict:
+        return {
+            "name": config.config_name,
+            "base_price": config.base_price,
+            "price_per_km": config.price_per_km,
+            "min_price": config.min_price,
+            "max_price": config.max_price
+        }
+
+    def get(self, db: Optional[Session] = None) -> PricingSnapshot:
+        """Lấy snapshot hiện tại, tự reload nếu version trong DB đã thay đổi"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._last_check < self.check_interval:
+            self.stats_counters["hits"] += 1
+            return snapshot
+
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            version = self._read_version(db)
+            self.stats_counters["version_checks"] += 1
+            self._last_check = now
+
+            if snapshot is not None and snapshot.version == version:
+                self.stats_counters["hits"] += 1
+                return snapshot
+
+            with self._lock:
+                # Thread khác có thể đã reload trong lúc chờ lock
+                if self._snapshot is not None and self._snapshot.version == version:
+                    return self._snapshot
+                self._snapshot = self._load(db, version)
+                self.stats_counters["reloads"] += 1
+                logger.info("🔄 Pricing snapshot loaded: %s:%s (v%s)", self._snapshot.config_type, self._snapshot.config_name, version)
+                return self._snapshot
+        finally:
+            if own_session:
+                db.close()
+
+    def invalidate(self, db: Optional[Session] = None) -> PricingSnapshot:
+        """Gọi sau khi ghi config/settings giá: tăng version và dựng snapshot mới ngay"""
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            with self._lock:
+                version = self._bump_version(db)
+                self._snapshot = self._load(db, version)
+                self._last_check = time.monotonic()
+                self.stats_counters["invalidations"] += 1
+                logger.info("♻️ Pricing snapshot invalidated -> v%s", version)
+                return self._snapshot
+        finally:
+            if own_session:
+                db.close()
+
+    def get_status(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            **self.stats_counters,
+            "check_interval": self.check_interval,
+            "version": snapshot.version if snapshot else None,
+            "active": f"{snapshot.config_type}:{snapshot.config_name}" if snapshot else None,
+            "loaded_at": snapshot.loaded_at if snapshot else None
+        }
+
+
+# Singleton instance
+pricing_snapshot_store = PricingSnapshotStore(check_interval=settings.PRICING_SNAPSHOT_CHECK_SECONDS)
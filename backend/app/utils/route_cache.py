@@ -0,0 +1,257 @@
+# backend/app/utils/route_cache.py
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.database.database import SessionLocal, engine
+from app.models import models
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RouteDistanceCache:
+    """
+    Cache khoảng cách/thời gian theo cặp tọa độ đã làm tròn.
+    Tầng 1: LRU trong process (nhanh nhất)
+    Tầng 2: Bảng route_distance_cache trong SQLite (giữ lại sau khi restart)
+    """
+
+    # Số lần ghi giữa 2 lần dọn dẹp bảng SQLite
+    EVICT_EVERY = 100
+
+    def __init__(self, max_memory_items: int = 2000, max_db_items: int = 50000,
+                 ttl_seconds: int = 7 * 24 * 3600, precision: int = 4, enabled: bool = True):
+        self.max_memory_items = max_memory_items
+        self.max_db_items = max_db_items
+        self.ttl_seconds = ttl_seconds
+        self.precision = precision
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._writes_since_evict = 0
+
+        self.stats_counters = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "errors": 0
+        }
+
+    def make_key(self, lat1: float, lng1: float, lat2: float, lng2: float) -> str:
+        """Tạo cache key từ tọa độ đã làm tròn"""
+        p = self.precision
+        return f"{round(lat1, p)},{round(lng1, p)}|{round(lat2, p)},{round(lng2, p)}"
+
+    def _ensure_table(self):
+        """Tạo bảng cache nếu chưa có (chỉ chạy 1 lần)"""
+        if not self._table_ready:
+            models.RouteDistanceCache.__table__.create(bind=engine, checkfirst=True)
+            self._table_ready = True
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats_counters[name] += amount
+
+    def get(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Optional[Dict]:
+        """Lấy kết quả từ cache (memory -> SQLite), None nếu miss hoặc hết hạn"""
+        if not self.enabled:
+            return None
+
+        key = self.make_key(lat1, lng1, lat2, lng2)
+        now = datetime.utcnow()
+
+        # Tầng 1: memory
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats_counters["memory_hits"] += 1
+                    return copy.deepcopy(result)
+                del self._memory[key]
+
+        # Tầng 2: SQLite
+        try:
+            self._ensure_table()
+            db = SessionLocal()
+            try:
+                row = db.query(models.RouteDistanceCache).filter(
+                    models.RouteDistanceCache.cache_key == key
+                ).first()
+
+                if row and row.expires_at and row.expires_at > now:
+                    result = row.payload or {
+                        "distance_km": row.distance_km,
+                        "duration_minutes": row.duration_minutes,
+                        "method": row.method,
+                        "success": True
+                    }
+                    row.hit_count = (row.hit_count or 0) + 1
+                    db.commit()
+
+                    self._remember(key, row.expires_at, result)
+                    self._count("db_hits")
+                    return copy.deepcopy(result)
+            finally:
+                db.close()
+        except Exception as e:
+            self._count("errors")
+            logger.warning("⚠️ Route cache read error: %s", e)
+
+        self._count("misses")
+        return None
+
+    def set(self, lat1: float, lng1: float, lat2: float, lng2: float, result: Dict):
+        """Lưu kết quả vào cả 2 tầng cache"""
+        self.set_many([(lat1, lng1, lat2, lng2, result)])
+
+    def set_many(self, entries: List[Tuple[float, float, float, float, Dict]]):
+        """Lưu nhiều kết quả (lat1, lng1, lat2, lng2, result) trong 1 transaction, VD: các ô Distance Matrix"""
+        if not self.enabled:
+            return
+
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        payloads = {}
+        for lat1, lng1, lat2, lng2, result in entries:
+            if not result or not result.get("success"):
+                continue
+            key = self.make_key(lat1, lng1, lat2, lng2)
+            payloads[key] = {k: v for k, v in result.items() if k != "from_cache"}
+            self._remember(key, expires_at, payloads[key])
+        if not payloads:
+            return
+
+        try:
+            self._ensure_table()
+            db = SessionLocal()
+            try:
+                table = models.RouteDistanceCache
+                rows = {row.cache_key: row for row in db.query(table).filter(table.cache_key.in_(list(payloads)))}
+                for key, payload in payloads.items():
+                    row = rows.get(key)
+                    if not row:
+                        row = table(cache_key=key, hit_count=0)
+                        db.add(row)
+                    row.distance_km = payload["distance_km"]
+                    row.duration_minutes = payload.get("duration_minutes")
+                    row.method = payload.get("method")
+                    row.payload = payload
+                    row.created_at = datetime.utcnow()
+                    row.expires_at = expires_at
+                db.commit()
+            finally:
+                db.close()
+
+            self._count("writes", len(payloads))
+            self._maybe_evict_db(len(payloads))
+        except Exception as e:
+            self._count("errors")
+            logger.warning("⚠️ Route cache write error: %s", e)
+
+    def _remember(self, key: str, expires_at: datetime, result: Dict):
+        """Đưa vào LRU memory, loại bỏ phần tử cũ nhất nếu đầy"""
+        with self._lock:
+            self._memory[key] = (expires_at, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+
+    def _maybe_evict_db(self, writes: int = 1):
+        """Định kỳ xóa dòng hết hạn và giới hạn kích thước bảng SQLite"""
+        with self._lock:
+            self._writes_since_evict += writes
+            if self._writes_since_evict < self.EVICT_EVERY:
+                return
+            self._writes_since_evict = 0
+        self.evict_db()
+
+    def evict_db(self) -> int:
+        """Xóa các dòng hết hạn, sau đó xóa dòng cũ nhất nếu vượt max_db_items"""
+        self._ensure_table()
+        db = SessionLocal()
+        try:
+            table = models.RouteDistanceCache
+            removed = db.query(table).filter(
+                table.expires_at <= datetime.utcnow()
+            ).delete(synchronize_session=False)
+
+            overflow = db.query(table).count() - self.max_db_items
+            if overflow > 0:
+                oldest_ids = [
+                    row.id for row in db.query(table.id).order_by(table.created_at.asc()).limit(overflow)
+                ]
+                removed += db.query(table).filter(
+                    table.id.in_(oldest_ids)
+                ).delete(synchronize_session=False)
+
+            db.commit()
+            self._count("evictions", removed)
+            return removed
+        finally:
+            db.close()
+
+    def clear(self):
+        """Xóa toàn bộ cache (memory + SQLite)"""
+        with self._lock:
+            self._memory.clear()
+        self._ensure_table()
+        db = SessionLocal()
+        try:
+            db.query(models.RouteDistanceCache).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict:
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            counters = dict(self.stats_counters)
+            memory_items = len(self._memory)
+
+        hits = counters["memory_hits"] + counters["db_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hits": hits,
+            "hit_rate": round(hits / lookups * 100, 1) if lookups else 0,
+            "memory_items": memory_items,
+            "max_memory_items": self.max_memory_items,
+            "max_db_items": self.max_db_items,
+            "ttl_seconds": self.ttl_seconds,
+            "precision": self.precision,
+            "enabled": self.enabled
+        }
+
+    def collect_metrics(self):
+        """Collector cho /metrics (đọc từ stats_counters lúc scrape)"""
+        with self._lock:
+            counters = dict(self.stats_counters)
+            memory_items = len(self._memory)
+        yield ("route_cache_lookups_total", "counter", "Số lần tra cache khoảng cách theo kết quả", ("result",),
+               [(("memory_hit",), counters["memory_hits"]), (("db_hit",), counters["db_hits"]),
+                (("miss",), counters["misses"])])
+        yield ("route_cache_errors_total", "counter", "Lỗi đọc/ghi cache khoảng cách", (), [((), counters["errors"])])
+        yield ("route_cache_memory_items", "gauge", "Số tuyến trong LRU memory", (), [((), memory_items)])
+
+
+# Singleton instance
+route_distance_cache = RouteDistanceCache(
+    max_memory_items=settings.ROUTE_CACHE_MEMORY_SIZE,
+    max_db_items=settings.ROUTE_CACHE_DB_SIZE,
+    ttl_seconds=settings.ROUTE_CACHE_TTL_SECONDS,
+    precision=settings.ROUTE_CACHE_PRECISION,
+    enabled=settings.ROUTE_CACHE_ENABLED
+)
+metrics.register_collector(route_distance_cache.collect_metrics)
@@ -1,24 +1,25 @@
 # backend/app/utils/simple_email_service.py
 
-import smtplib
-import ssl
+import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
 from dotenv import load_dotenv
 import os
 
+from app.utils.smtp_connection import SMTPConnectionManager
+
+logger = logging.getLogger(__name__)
+
 class SimpleEmailService:
     def __init__(self):
         """Khởi tạo với cấu hình từ environment variables"""
         # Load environment variables from .env file
         load_dotenv()
 
-        # Test load
-        print("🔧 Environment variables loaded:")
-        print(f"SMTP_USERNAME: {os.getenv('SMTP_USERNAME')}")
-        print(f"ADMIN_EMAIL: {os.getenv('ADMIN_EMAIL')}")
+        logger.debug("🔧 Environment variables loaded: SMTP_USERNAME=%s, ADMIN_EMAIL=%s",
+                     os.getenv('SMTP_USERNAME'), os.getenv('ADMIN_EMAIL'))
 
         self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
         self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
@@ -30,131 +31,151 @@ class SimpleEmailService:
         self.display_name = os.getenv('FROM_DISPLAY_NAME', 'Đặt xe Việt')
         self.company_name = os.getenv('COMPANY_NAME', 'Taxi Service')
         
+        # Giữ phiên SMTP (STARTTLS + login) để dùng lại giữa các email
+        self.smtp = SMTPConnectionManager(
+            self.smtp_server,
+            self.smtp_port,
+            username=self.username,
+            password=self.password,
+            use_tls=os.getenv('SMTP_USE_TLS', 'true').lower() == 'true',
+            idle_timeout=float(os.getenv('SMTP_IDLE_TIMEOUT', '120')),
+            max_messages_per_connection=int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        )
+        
         if not self.username or not self.password:
-            print("⚠️ Warning: SMTP credentials not configured")
+            logger.warning("⚠️ SMTP credentials not configured")
         
         if not self.admin_email:
-            print("⚠️ Warning: Admin email not configured")
+            logger.warning("⚠️ Admin email not configured")
     
     def send_new_booking_notification(self, booking_data: Dict[str, Any]) -> bool:
         """
         Gửi email thông báo đơn đặt chuyến mới cho admin
         """
+        return self.send_new_booking_notifications([booking_data])[0]
+    
+    def send_new_booking_notifications(self, bookings: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Gửi email thông báo cho nhiều đơn qua cùng 1 kết nối SMTP (dùng bởi notification dispatcher)
+        """
         if not self.admin_email:
-            print("ℹ️ No admin email configured, skipping notification")
-            return True
+            logger.info("ℹ️ No admin email configured, skipping notification")
+            return [True] * len(bookings)
         
         if not self.username or not self.password:
-            print("ℹ️ SMTP not configured, skipping email")
-            return True
+            logger.info("ℹ️ SMTP not configured, skipping email")
+            return [True] * len(bookings)
         
-        try:
-            # Tạo nội dung email đơn giản
-            subject = f"🚨 ĐƠN MỚI #{booking_data.get('booking_id')} - {booking_data.get('customer_name')}"
-            
-            # HTML content đơn giản
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
-                    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                    .header {{ background: #dc3545; color: white; padding: 20px; text-align: center; border-radius: 5px; }}
-                    .content {{ background: #f9f9f9; padding: 20px; border-radius: 5px; margin: 10px 0; }}
-                    .urgent {{ background: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-                    .customer-info {{ background: #d1ecf1; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-                    table {{ width: 100%; }}
-                    td {{ padding: 5px 0; }}
-                    .label {{ font-weight: bold; width: 30%; }}
-                    .price {{ background: #d4edda; padding: 10px; border-radius: 5px; text-align: center; font-size: 18px; font-weight: bold; color: #155724; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h2>🚨 ĐƠN ĐẶT CHUYẾN MỚI</h2>
-                        <p>ID: #{booking_data.get('booking_id')} - {datetime.now().strftime('%d/%m/%Y %H:%M')}</p>
-                    </div>
-                    
-                    <div class="urgent">
-                        <h3 style="color: #dc3545;">⚡ CẦN LIÊN HỆ NGAY:</h3>
-                        <p><strong>📞 Gọi cho khách hàng để xác nhận chuyến đi</strong></p>
-                    </div>
-                    
-                    <div class="customer-info">
-                        <h3>👤 THÔNG TIN KHÁCH HÀNG</h3>
-                        <table>
-                            <tr><td class="label">Họ tên:</td><td><strong>{booking_data.get('customer_name')}</strong></td></tr>
-                            <tr><td class="label">Điện thoại:</td><td><strong style="color: #dc3545; font-size: 16px;">{booking_data.get('customer_phone')}</strong></td></tr>
-                            <tr><td class="label">Email:</td><td>{booking_data.get('customer_email') or 'Không có'}</td></tr>
-                        </table>
-                    </div>
+        messages = []
+        results = [False] * len(bookings)
+        for index, booking_data in enumerate(bookings):
+            try:
+                messages.append((index, self._build_booking_message(booking_data)))
+            except Exception as e:
+                logger.error("❌ Failed to build admin notification #%s: %s", booking_data.get('booking_id'), e)
+        
+        sent = self.smtp.send_many([message for _, message in messages])
+        for (index, _), ok in zip(messages, sent):
+            results[index] = ok
+            if ok:
+                logger.info("✅ Admin notification sent to %s (booking #%s)", self.admin_email, bookings[index].get('booking_id'))
+        return results
+    
+    def _build_booking_message(self, booking_data: Dict[str, Any]) -> MIMEMultipart:
+        """Dựng email thông báo đơn mới"""
+        # Tạo nội dung email đơn giản
+        subject = f"🚨 ĐƠN MỚI #{booking_data.get('booking_id')} - {booking_data.get('customer_name')}"
+        
+        # HTML content đơn giản
+        html_content = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <style>
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
+                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+                .header {{ background: #dc3545; color: white; padding: 20px; text-align: center; border-radius: 5px; }}
+                .content {{ background: #f9f9f9; padding: 20px; border-radius: 5px; margin: 10px 0; }}
+                .urgent {{ background: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+                .customer-info {{ background: #d1ecf1; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+                table {{ width: 100%; }}
+                td {{ padding: 5px 0; }}
+                .label {{ font-weight: bold; width: 30%; }}
+                .price {{ background: #d4edda; padding: 10px; border-radius: 5px; text-align: center; font-size: 18px; font-weight: bold; color: #155724; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h2>🚨 ĐƠN ĐẶT CHUYẾN MỚI</h2>
+                    <p>ID: #{booking_data.get('booking_id')} - {datetime.now().strftime('%d/%m/%Y %H:%M')}</p>
+                </div>
+                
+                <div class="urgent">
+                    <h3 style="color: #dc3545;">⚡ CẦN LIÊN HỆ NGAY:</h3>
+                    <p><strong>📞 Gọi cho khách hàng để xác nhận chuyến đi</strong></p>
+                </div>
+                
+                <div class="customer-info">
+                    <h3>👤 THÔNG TIN KHÁCH HÀNG</h3>
+                    <table>
+                        <tr><td class="label">Họ tên:</td><td><strong>{booking_data.get('customer_name')}</strong></td></tr>
+                        <tr><td class="label">Điện thoại:</td><td><strong style="color: #dc3545; font-size: 16px;">{booking_data.get('customer_phone')}</strong></td></tr>
+                        <tr><td class="label">Email:</td><td>{booking_data.get('customer_email') or 'Không có'}</td></tr>
+                    </table>
+                </div>
+                
+                <div class="content">
+                    <h3>🚗 CHI TIẾT CHUYẾN ĐI</h3>
+                    <table>
+                        <tr><td class="label">Ngày giờ:</td><td>{booking_data.get('travel_date')} lúc {booking_data.get('travel_time')}</td></tr>
+                        <tr><td class="label">Số khách:</td><td>{booking_data.get('passenger_count')} người</td></tr>
+                        <tr><td class="label">Loại xe:</td><td>{booking_data.get('vehicle_type_name')}</td></tr>
+                        <tr><td class="label">Từ:</td><td>{booking_data.get('from_address')}</td></tr>
+                        <tr><td class="label">Đến:</td><td>{booking_data.get('to_address')}</td></tr>
+                        <tr><td class="label">Khoảng cách:</td><td>{booking_data.get('distance_km')} km ({booking_data.get('duration_minutes')} phút)</td></tr>
+                    </table>
                     
-                    <div class="content">
-                        <h3>🚗 CHI TIẾT CHUYẾN ĐI</h3>
-                        <table>
-                            <tr><td class="label">Ngày giờ:</td><td>{booking_data.get('travel_date')} lúc {booking_data.get('travel_time')}</td></tr>
-                            <tr><td class="label">Số khách:</td><td>{booking_data.get('passenger_count')} người</td></tr>
-                            <tr><td class="label">Loại xe:</td><td>{booking_data.get('vehicle_type_name')}</td></tr>
-                            <tr><td class="label">Từ:</td><td>{booking_data.get('from_address')}</td></tr>
-                            <tr><td class="label">Đến:</td><td>{booking_data.get('to_address')}</td></tr>
-                            <tr><td class="label">Khoảng cách:</td><td>{booking_data.get('distance_km')} km ({booking_data.get('duration_minutes')} phút)</td></tr>
-                        </table>
-                        
-                        {f'''
-                        <div style="margin: 15px 0;">
-                            <strong>📝 Ghi chú:</strong>
-                            <div style="background: #fff3cd; padding: 10px; border-radius: 5px; font-style: italic;">
-                                {booking_data.get('notes')}
-                            </div>
+                    {f'''
+                    <div style="margin: 15px 0;">
+                        <strong>📝 Ghi chú:</strong>
+                        <div style="background: #fff3cd; padding: 10px; border-radius: 5px; font-style: italic;">
+                            {booking_data.get('notes')}
                         </div>
-                        ''' if booking_data.get('notes') else ''}
-                    </div>
-                    
-                    <div class="price">
-                        💰 GIÁ CƯỚC: {f"{booking_data.get('calculated_price', 0):,.0f}".replace(',', '.')} VNĐ
-                    </div>
-                    
-                    <div style="text-align: center; margin: 20px 0; padding: 15px; background: #f1f3f4; border-radius: 5px;">
-                        <p style="color: #dc3545; font-weight: bold; margin: 0;">
-                            ⏰ Khách hàng đang chờ xác nhận - vui lòng gọi ngay!
-                        </p>
                     </div>
+                    ''' if booking_data.get('notes') else ''}
                 </div>
-            </body>
-            </html>
-            """
-            
-            # Tạo và gửi email
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"] = f"{self.display_name} <{self.from_email}>" if self.from_email else self.display_name
-            message["To"] = self.admin_email
-            
-            html_part = MIMEText(html_content, "html", "utf-8")
-            message.attach(html_part)
-            
-            # Gửi email
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.username, self.password)
-                server.send_message(message)
-            
-            print(f"✅ Admin notification sent to {self.admin_email}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Failed to send admin notification: {e}")
-            return False
+                
+                <div class="price">
+                    💰 GIÁ CƯỚC: {f"{booking_data.get('calculated_price', 0):,.0f}".replace(',', '.')} VNĐ
+                </div>
+                
+                <div style="text-align: center; margin: 20px 0; padding: 15px; background: #f1f3f4; border-radius: 5px;">
+                    <p style="color: #dc3545; font-weight: bold; margin: 0;">
+                        ⏰ Khách hàng đang chờ xác nhận - vui lòng gọi ngay!
+                    </p>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+        
+        # Tạo và gửi email
+        message = MIMEMultipart("alternative")
+        message["Subject"] = subject
+        message["From"] = f"{self.display_name} <{self.from_email}>" if self.from_email else self.display_name
+        message["To"] = self.admin_email
+        
+        html_part = MIMEText(html_content, "html", "utf-8")
+        message.attach(html_part)
+        return message
     
     def test_email(self, test_email: str = None) -> bool:
         """Test gửi email"""
         test_email = test_email or self.admin_email
         if not test_email:
-            print("❌ No test email provided")
+            logger.error("❌ No test email provided")
             return False
         
         try:
@@ -178,18 +199,24 @@ class SimpleEmailService:
             message["To"] = test_email
             message.attach(MIMEText(content, "html", "utf-8"))
             
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.username, self.password)
-                server.send_message(message)
+            if not self.smtp.send(message):
+                logger.error("❌ Test email failed: %s", self.smtp.last_error)
+                return False
             
-            print(f"✅ Test email sent to {test_email}")
+            logger.info("✅ Test email sent to %s", test_email)
             return True
             
         except Exception as e:
-            print(f"❌ Test email failed: {e}")
+            logger.error("❌ Test email failed: %s", e)
             return False
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Metrics của kết nối SMTP (số email, độ trễ gửi, số lần kết nối lại)"""
+        return self.smtp.get_stats()
+    
+    def close(self):
+        """Đóng phiên SMTP đang giữ (gọi khi tắt server)"""
+        self.smtp.close()
+
 # Singleton instance
 simple_email_service = SimpleEmailService()
\ No newline at end of file
@@ -0,0 +1,168 @@
+# backend/app/utils/smtp_connection.py
+
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from email.message import Message
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionManager:
+    """
+    Giữ 1 phiên SMTP đã STARTTLS + login để gửi nhiều email liên tiếp.
+    - Dùng lại kết nối giữa các lần gửi, kiểm tra bằng NOOP nếu đã rảnh lâu
+    - Đóng kết nối khi rảnh quá idle_timeout hoặc đã gửi max_messages_per_connection email
+    - Mất kết nối giữa chừng thì kết nối lại và gửi lại 1 lần
+    Thread-safe (khóa quanh mỗi lần gửi) vì dispatcher nền và API test có thể gửi cùng lúc.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 use_tls: bool = True, timeout: float = 30.0, idle_timeout: float = 120.0,
+                 noop_after: float = 15.0, max_messages_per_connection: int = 100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self.max_messages_per_connection = max_messages_per_connection
+
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._messages_on_connection = 0
+        self._lock = threading.Lock()
+
+        self.stats_counters = {
+            "sent": 0,
+            "failed": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "noop_checks": 0,
+            "batches": 0
+        }
+        self._latency_total_ms = 0.0
+        self.last_send_ms = None
+        self.max_send_ms = None
+        self.last_connect_ms = None
+        self.last_error = None
+
+    # ----- Kết nối -----
+    def _connect(self) -> smtplib.SMTP:
+        started = time.perf_counter()
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.use_tls:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            self._quit(server)
+            raise
+
+        self.last_connect_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.stats_counters["connects"] += 1
+        self._messages_on_connection = 0
+        return server
+
+    @staticmethod
+    def _quit(server: Optional[smtplib.SMTP]):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _drop(self):
+        self._quit(self._server)
+        self._server = None
+
+    def _ensure_connection(self) -> smtplib.SMTP:
+        if self._server is not None:
+            idle = time.monotonic() - self._last_used
+            if idle > self.idle_timeout or self._messages_on_connection >= self.max_messages_per_connection:
+                self._drop()
+            elif idle > self.noop_after:
+                # Server có thể đã đóng phiên rảnh - NOOP rẻ hơn nhiều so với handshake TLS mới
+                self.stats_counters["noop_checks"] += 1
+                try:
+                    if self._server.noop()[0] != 250:
+                        self._drop()
+                except Exception:
+                    self._drop()
+
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    # ----- Gửi -----
+    def _send_locked(self, message: Message) -> bool:
+        started = time.perf_counter()
+        for attempt in range(2):
+            try:
+                server = self._ensure_connection()
+                server.send_message(message)
+                self._messages_on_connection += 1
+                self._last_used = time.monotonic()
+                self._record_latency((time.perf_counter() - started) * 1000)
+                self.stats_counters["sent"] += 1
+                return True
+            except Exception as e:
+                # SMTPException cũng là OSError: chỉ thử lại khi lỗi do kết nối (mất phiên, timeout, socket)
+                transient = isinstance(e, smtplib.SMTPServerDisconnected) or (
+                    isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException))
+                self.last_error = str(e)
+                # Lỗi SMTP khác (VD: từ chối người nhận) thì phiên vẫn dùng được
+                if transient or not isinstance(e, smtplib.SMTPException):
+                    self._drop()
+                if transient and attempt == 0:
+                    self.stats_counters["reconnects"] += 1
+                    continue
+                break
+
+        self.stats_counters["failed"] += 1
+        logger.error("❌ SMTP send failed: %s", self.last_error)
+        return False
+
+    def send(self, message: Message) -> bool:
+        with self._lock:
+            return self._send_locked(message)
+
+    def send_many(self, messages: List[Message]) -> List[bool]:
+        """Gửi nhiều email qua cùng 1 kết nối (giữ lock cho cả batch)"""
+        with self._lock:
+            self.stats_counters["batches"] += 1
+            return [self._send_locked(message) for message in messages]
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+    def _record_latency(self, elapsed_ms: float):
+        self._latency_total_ms += elapsed_ms
+        self.last_send_ms = round(elapsed_ms, 1)
+        self.max_send_ms = max(self.max_send_ms or 0, self.last_send_ms)
+
+    def get_stats(self) -> Dict:
+        sent = self.stats_counters["sent"]
+        return {
+            **self.stats_counters,
+            "connected": self._server is not None,
+            "messages_on_connection": self._messages_on_connection,
+            "avg_send_ms": round(self._latency_total_ms / sent, 1) if sent else None,
+            "last_send_ms": self.last_send_ms,
+            "max_send_ms": self.max_send_ms,
+            "last_connect_ms": self.last_connect_ms,
+            "last_error": self.last_error
+        }
@@ -1,23 +1,93 @@
 # backend/app/utils/telegram_service.py
 
+import html
+import logging
 import requests
 import json
-from typing import Dict, Any, Optional
+import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Giới hạn độ dài 1 tin nhắn của Telegram
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+def escape_html(value: Any) -> str:
+    """Escape dữ liệu người dùng nhập trước khi chèn vào tin parse_mode=HTML (tránh lỗi 400 / chèn thẻ)"""
+    return html.escape(str(value), quote=False)
+
+
+class TokenBucket:
+    """Token bucket đơn giản: rate token/giây, tối đa capacity token (cho phép burst)"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+    
+    def wait_time(self, tokens: float = 1) -> float:
+        """Số giây cần chờ để có đủ token"""
+        self._refill()
+        return 0.0 if self.tokens >= tokens else (tokens - self.tokens) / self.rate
+    
+    def take(self, tokens: float = 1):
+        self._refill()
+        self.tokens -= tokens
+
+
 class TelegramService:
     """Service để gửi thông báo Telegram"""
     
     def __init__(self, bot_token: Optional[str] = None, chat_id: Optional[str] = None):
+        self.api_base = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.base_url = f"https://api.telegram.org/bot{bot_token}" if bot_token else None
+        self.base_url = f"{self.api_base}/bot{bot_token}" if bot_token else None
+        
+        # Session keep-alive dùng chung cho mọi request tới Bot API
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+        self.session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+        
+        # Giới hạn gửi theo từng chat (Telegram: ~20 tin/phút cho group)
+        self.rate_per_minute = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", "20"))
+        self.burst = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+        self.max_wait_seconds = float(os.getenv("TELEGRAM_MAX_WAIT_SECONDS", "5"))
+        # Hàng đợi từ bao nhiêu booking trở lên thì gộp thành 1 tin tổng hợp
+        self.digest_threshold = int(os.getenv("TELEGRAM_DIGEST_THRESHOLD", "3"))
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}  # chat_id -> monotonic time (theo retry_after của 429)
+        self._lock = threading.Lock()
+        
+        self.stats_counters = {
+            "sent": 0,
+            "failed": 0,
+            "digests": 0,
+            "coalesced_bookings": 0,
+            "rate_limited": 0,
+            "throttle_waits": 0
+        }
     
     def set_credentials(self, bot_token: str, chat_id: str):
         """Cập nhật thông tin bot token và chat ID"""
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{self.api_base}/bot{bot_token}"
     
     def is_configured(self) -> bool:
         """Kiểm tra xem service đã được cấu hình chưa"""
@@ -35,7 +105,7 @@ class TelegramService:
         
         try:
             # Test bằng cách gọi getMe API
-            response = requests.get(f"{self.base_url}/getMe", timeout=10)
+            response = self.session.get(f"{self.base_url}/getMe", timeout=10)
             
             if response.status_code == 200:
                 bot_info = response.json()
@@ -70,22 +140,62 @@ class TelegramService:
                 "error": f"Unexpected error: {str(e)}"
             }
     
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+    
+    def _reserve(self, chat_id: str) -> float:
+        """
+        Lấy 1 token cho chat. Chờ nếu chỉ thiếu ít (<= max_wait_seconds),
+        ngược lại trả về số giây caller nên thử lại sau (0 = được gửi)
+        """
+        with self._lock:
+            blocked = self._blocked_until.get(chat_id, 0) - time.monotonic()
+            if blocked > 0:
+                return blocked
+            wait = self._bucket(chat_id).wait_time()
+            if wait > self.max_wait_seconds:
+                return wait
+            self._bucket(chat_id).take()
+        
+        if wait > 0:
+            self.stats_counters["throttle_waits"] += 1
+            time.sleep(wait)
+        return 0.0
+    
     def send_message(self, message: str, parse_mode: str = "HTML") -> Dict[str, Any]:
-        """Gửi tin nhắn đến Telegram"""
+        """
+        Gửi tin nhắn đến Telegram.
+        Bị giới hạn tốc độ (token bucket hoặc 429) thì trả về rate_limited + retry_after (giây)
+        """
         if not self.is_configured():
             return {
                 "success": False,
                 "error": "Bot token hoặc chat ID chưa được cấu hình"
             }
         
+        chat_id = self.chat_id
+        retry_after = self._reserve(chat_id)
+        if retry_after > 0:
+            self.stats_counters["rate_limited"] += 1
+            return {
+                "success": False,
+                "rate_limited": True,
+                "retry_after": round(retry_after, 1),
+                "error": f"Rate limited, retry after {retry_after:.1f}s"
+            }
+        
         try:
             payload = {
-                "chat_id": self.chat_id,
+                "chat_id": chat_id,
                 "text": message,
                 "parse_mode": parse_mode
             }
             
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/sendMessage",
                 json=payload,
                 timeout=10
@@ -94,27 +204,48 @@ class TelegramService:
             if response.status_code == 200:
                 result = response.json()
                 if result.get("ok"):
+                    self.stats_counters["sent"] += 1
                     return {
                         "success": True,
                         "message_id": result["result"].get("message_id")
                     }
                 else:
+                    self.stats_counters["failed"] += 1
                     return {
                         "success": False,
                         "error": f"Telegram API error: {result.get('description', 'Unknown error')}"
                     }
+            elif response.status_code == 429:
+                # Telegram báo số giây phải chờ trong parameters.retry_after
+                try:
+                    retry_after = float(response.json().get("parameters", {}).get("retry_after", 1))
+                except ValueError:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                with self._lock:
+                    self._blocked_until[chat_id] = time.monotonic() + retry_after
+                self.stats_counters["rate_limited"] += 1
+                logger.warning("⏳ Telegram 429 for chat %s, retry after %ss", chat_id, retry_after)
+                return {
+                    "success": False,
+                    "rate_limited": True,
+                    "retry_after": retry_after,
+                    "error": f"HTTP 429: retry after {retry_after}s"
+                }
             else:
+                self.stats_counters["failed"] += 1
                 return {
                     "success": False,
                     "error": f"HTTP {response.status_code}: {response.text}"
                 }
                 
         except requests.exceptions.RequestException as e:
+            self.stats_counters["failed"] += 1
             return {
                 "success": False,
                 "error": f"Network error: {str(e)}"
             }
         except Exception as e:
+            self.stats_counters["failed"] += 1
             return {
                 "success": False,
                 "error": f"Unexpected error: {str(e)}"
@@ -127,22 +258,22 @@ class TelegramService:
             price_formatted = f"{booking_data['calculated_price']:,.0f}".replace(",", ".")
             
             # Format ngày giờ
-            travel_datetime = f"{booking_data['travel_date']} {booking_data['travel_time']}"
+            travel_datetime = escape_html(f"{booking_data['travel_date']} {booking_data['travel_time']}")
             
-            vehicle_name = booking_data['vehicle_type_name']; #vehicle_names.get(booking_data.get('vehicle_type'), booking_data.get('vehicle_type', 'N/A'))
+            vehicle_name = escape_html(booking_data['vehicle_type_name']); #vehicle_names.get(booking_data.get('vehicle_type'), booking_data.get('vehicle_type', 'N/A'))
             
             message = f"""🚗 <b>BOOKING MỚI #{booking_data['booking_id']}</b>
 
-👤 <b>Khách hàng:</b> {booking_data['customer_name']}
-📱 <b>SĐT:</b> {booking_data['customer_phone']}
-📧 <b>Email:</b> {booking_data.get('customer_email', 'N/A')}
+👤 <b>Khách hàng:</b> {escape_html(booking_data['customer_name'])}
+📱 <b>SĐT:</b> {escape_html(booking_data['customer_phone'])}
+📧 <b>Email:</b> {escape_html(booking_data.get('customer_email', 'N/A'))}
 
 🗓️ <b>Thời gian:</b> {travel_datetime}
 👥 <b>Số khách:</b> {booking_data['passenger_count']} người
 🚙 <b>Loại xe:</b> {vehicle_name}
 
-📍 <b>Điểm đón:</b> {booking_data['from_address']}
-📍 <b>Điểm đến:</b> {booking_data['to_address']}
+📍 <b>Điểm đón:</b> {escape_html(booking_data['from_address'])}
+📍 <b>Điểm đến:</b> {escape_html(booking_data['to_address'])}
 
 📏 <b>Khoảng cách:</b> {booking_data.get('distance_km', 0):.1f} km
 ⏱️ <b>Thời gian di chuyển:</b> {booking_data.get('duration_minutes', 0):.0f} phút
@@ -150,7 +281,7 @@ class TelegramService:
 
             # Thêm ghi chú nếu có
             if booking_data.get('notes'):
-                message += f"\n\n📝 <b>Ghi chú:</b> {booking_data['notes']}"
+                message += f"\n\n📝 <b>Ghi chú:</b> {escape_html(booking_data['notes'])}"
             
             message += f"\n\n⏰ <i>Thời gian đặt: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}</i>"
             
@@ -160,13 +291,13 @@ class TelegramService:
             # Fallback message nếu có lỗi format
             return f"""🚗 BOOKING MỚI #{booking_data.get('booking_id', 'N/A')}
 
-Khách hàng: {booking_data.get('customer_name', 'N/A')}
-SĐT: {booking_data.get('customer_phone', 'N/A')}
-Từ: {booking_data.get('from_address', 'N/A')}
-Đến: {booking_data.get('to_address', 'N/A')}
+Khách hàng: {escape_html(booking_data.get('customer_name', 'N/A'))}
+SĐT: {escape_html(booking_data.get('customer_phone', 'N/A'))}
+Từ: {escape_html(booking_data.get('from_address', 'N/A'))}
+Đến: {escape_html(booking_data.get('to_address', 'N/A'))}
 Giá: {booking_data.get('calculated_price', 0):,.0f} VNĐ
 
-Lỗi format: {str(e)}"""
+Lỗi format: {escape_html(e)}"""
     
     def send_new_booking_notification(self, booking_data: Dict[str, Any]) -> Dict[str, Any]:
         """Gửi thông báo booking mới"""
@@ -175,19 +306,87 @@ Lỗi format: {str(e)}"""
             result = self.send_message(message)
             
             if result["success"]:
-                print(f"✅ Telegram notification sent for booking #{booking_data.get('booking_id')}")
+                logger.info("✅ Telegram notification sent for booking #%s", booking_data.get('booking_id'))
             else:
-                print(f"❌ Failed to send Telegram notification: {result.get('error')}")
+                logger.error("❌ Failed to send Telegram notification: %s", result.get('error'))
             
             return result
             
         except Exception as e:
             error_msg = f"Error sending Telegram notification: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.error("❌ %s", error_msg)
             return {
                 "success": False,
                 "error": error_msg
             }
 
+    def format_booking_digest_line(self, booking_data: Dict[str, Any]) -> str:
+        """1 booking dạng rút gọn trong tin tổng hợp"""
+        try:
+            price_formatted = f"{booking_data['calculated_price']:,.0f}".replace(",", ".")
+        except (KeyError, TypeError, ValueError):
+            price_formatted = "N/A"
+        return (f"🚗 <b>#{booking_data.get('booking_id', 'N/A')}</b> {escape_html(booking_data.get('customer_name', 'N/A'))} - "
+                f"📱 {escape_html(booking_data.get('customer_phone', 'N/A'))}\n"
+                f"   🗓️ {escape_html(booking_data.get('travel_date') or '')} {escape_html(booking_data.get('travel_time') or '')} | "
+                f"🚙 {escape_html(booking_data.get('vehicle_type_name') or 'N/A')} | 💰 {price_formatted} VNĐ\n"
+                f"   📍 {escape_html(booking_data.get('from_address', 'N/A'))} → {escape_html(booking_data.get('to_address', 'N/A'))}")
+    
+    def build_digest_messages(self, bookings: List[Dict[str, Any]]) -> List[List[int]]:
+        """Chia các booking thành các tin tổng hợp không vượt quá giới hạn độ dài. Trả về index theo từng tin"""
+        groups, current, length = [], [], 0
+        for index, booking_data in enumerate(bookings):
+            line_length = len(self.format_booking_digest_line(booking_data)) + 2
+            if current and length + line_length > TELEGRAM_MAX_MESSAGE_LENGTH - 200:
+                groups.append(current)
+                current, length = [], 0
+            current.append(index)
+            length += line_length
+        if current:
+            groups.append(current)
+        return groups
+    
+    def send_new_booking_notifications(self, bookings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Gửi thông báo cho nhiều booking (dùng bởi notification dispatcher).
+        Ít booking và còn token thì gửi từng tin; hàng đợi dồn lại thì gộp thành tin tổng hợp.
+        Trả về kết quả theo từng booking.
+        """
+        if not bookings:
+            return []
+        
+        with self._lock:
+            tokens = self._bucket(self.chat_id).available() if self.chat_id else 0
+        if len(bookings) < self.digest_threshold and tokens >= len(bookings):
+            return [self.send_new_booking_notification(booking_data) for booking_data in bookings]
+        
+        results: List[Dict[str, Any]] = [None] * len(bookings)
+        for group in self.build_digest_messages(bookings):
+            lines = [self.format_booking_digest_line(bookings[index]) for index in group]
+            message = (f"🚨 <b>{len(group)} BOOKING MỚI</b>\n\n" + "\n\n".join(lines) +
+                       f"\n\n⏰ <i>{datetime.now().strftime('%d/%m/%Y %H:%M:%S')}</i>")
+            result = self.send_message(message)
+            if result["success"]:
+                self.stats_counters["digests"] += 1
+                self.stats_counters["coalesced_bookings"] += len(group)
+                logger.info("✅ Telegram digest sent for %s bookings", len(group))
+            for index in group:
+                results[index] = result
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            blocked = {chat: round(until - now, 1) for chat, until in self._blocked_until.items() if until > now}
+            tokens = {chat: round(bucket.available(), 2) for chat, bucket in self._buckets.items()}
+        return {
+            **self.stats_counters,
+            "rate_per_minute": self.rate_per_minute,
+            "burst": self.burst,
+            "digest_threshold": self.digest_threshold,
+            "tokens": tokens,
+            "blocked_seconds": blocked
+        }
+
 # Singleton instance
 telegram_service = TelegramService()
@@ -1,4 +1,8 @@
-from typing import Dict, List
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+import numpy as np
 from app.models.schemas import PriceTier
 
 class TierPriceCalculator:
@@ -7,14 +11,49 @@ class TierPriceCalculator:
         # Convert dict tiers to PriceTier objects và sắp xếp theo from_km
         self.tiers = []
         for tier_data in tiers:
-            tier = PriceTier(**tier_data)
+            tier = tier_data if isinstance(tier_data, PriceTier) else PriceTier(**tier_data)
             self.tiers.append(tier)
-        
+
         # Sắp xếp theo from_km để đảm bảo tính toán đúng
         self.tiers.sort(key=lambda x: x.from_km)
-    
-    def calculate_price(self, distance_km: float) -> Dict:
-        """Tính giá theo bậc khoảng cách"""
+        self._compile()
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+
+    def _compile(self):
+        """
+        Biên dịch các bậc thành hàm tuyến tính từng khúc (1 lần cho mỗi cấu hình):
+        tại mốc _breakpoints[j] giá cộng dồn là _price_at[j], trên đoạn [_breakpoints[j], _breakpoints[j+1])
+        giá tăng _slope[j] đồng/km (tổng price_per_km các bậc phủ đoạn đó).
+        Tra giá = 1 lần bisect + 1 phép nhân-cộng, không phụ thuộc số bậc.
+        """
+        self._from_km = [tier.from_km for tier in self.tiers]
+        self._starts = [max(tier.from_km, 0) for tier in self.tiers]
+        self._ends = [float("inf") if tier.to_km is None else tier.to_km for tier in self.tiers]
+        self._rates = [tier.price_per_km for tier in self.tiers]
+        self._labels = [
+            (f"{tier.from_km}-{tier.to_km if tier.to_km else '∞'}km",
+             tier.description or f"Bậc {tier.from_km}-{tier.to_km or '∞'}km")
+            for tier in self.tiers
+        ]
+
+        bands = list(zip(self._starts, self._ends, self._rates))
+        self._breakpoints = sorted({0.0, *map(float, self._starts), *(float(end) for end in self._ends if end != float("inf"))})
+        self._price_at = [
+            sum(rate * max(0.0, min(end, point) - start) for start, end, rate in bands)
+            for point in self._breakpoints
+        ]
+        self._slope = [
+            sum(rate for start, end, rate in bands if start <= point < end)
+            for point in self._breakpoints
+        ]
+
+    def price_for(self, distance_km: float) -> float:
+        """Tổng giá (chưa làm tròn) cho khoảng cách > 0 - O(log số mốc)"""
+        segment = bisect.bisect_right(self._breakpoints, distance_km) - 1
+        return self.base_price + self._price_at[segment] + self._slope[segment] * (distance_km - self._breakpoints[segment])
+
+    def calculate_price(self, distance_km: float, include_breakdown: bool = True) -> Dict:
+        """Tính giá theo bậc khoảng cách (breakdown chỉ dựng khi include_breakdown=True)"""
         if distance_km <= 0:
             return {
                 "distance_km": distance_km,
@@ -23,49 +62,83 @@ class TierPriceCalculator:
                 "price_breakdown": [],
                 "error": "Khoảng cách phải lớn hơn 0"
             }
-        
-        total_price = self.base_price
-        price_breakdown = []
-        remaining_distance = distance_km
-        
-        for tier in self.tiers:
-            if remaining_distance <= 0:
-                break
-            
-            # Tính khoảng cách áp dụng cho tier này
-            tier_distance = 0
-            
-            if distance_km > tier.from_km:
-                # Xác định khoảng cách cho tier này
-                tier_start = tier.from_km
-                tier_end = tier.to_km if tier.to_km is not None else distance_km
-                
-                # Tính khoảng cách thực tế trong tier này
-                effective_start = max(tier_start, 0)
-                effective_end = min(tier_end, distance_km)
-                
-                if effective_end > effective_start:
-                    tier_distance = effective_end - effective_start
-                    tier_price = tier_distance * tier.price_per_km
-                    total_price += tier_price
-                    
-                    price_breakdown.append({
-                        "tier": f"{tier.from_km}-{tier.to_km if tier.to_km else '∞'}km",
-                        "from_km": tier.from_km,
-                        "to_km": tier.to_km,
-                        "distance": round(tier_distance, 2),
-                        "price_per_km": tier.price_per_km,
-                        "tier_price": round(tier_price, 0),
-                        "description": tier.description or f"Bậc {tier.from_km}-{tier.to_km or '∞'}km"
-                    })
-        
-        return {
+
+        result = {
             "distance_km": distance_km,
             "base_price": self.base_price,
-            "total_price": round(total_price, 0),
-            "price_breakdown": price_breakdown
+            "total_price": round(self.price_for(distance_km), 0)
         }
-    
+        if include_breakdown:
+            result["price_breakdown"] = self.price_breakdown(distance_km)
+        return result
+
+    def price_breakdown(self, distance_km: float) -> List[Dict]:
+        """Chi tiết từng bậc đã áp dụng - chỉ duyệt các bậc bắt đầu trước distance_km"""
+        price_breakdown = []
+        for index in range(bisect.bisect_left(self._from_km, distance_km)):
+            tier = self.tiers[index]
+            effective_start = self._starts[index]
+            effective_end = min(self._ends[index], distance_km)
+
+            if effective_end > effective_start:
+                tier_distance = effective_end - effective_start
+                tier_price = tier_distance * tier.price_per_km
+                label, description = self._labels[index]
+                price_breakdown.append({
+                    "tier": label,
+                    "from_km": tier.from_km,
+                    "to_km": tier.to_km,
+                    "distance": round(tier_distance, 2),
+                    "price_per_km": tier.price_per_km,
+                    "tier_price": round(tier_price, 0),
+                    "description": description
+                })
+        return price_breakdown
+
+    def _tier_arrays(self) -> Dict[str, np.ndarray]:
+        """Hàm tuyến tính từng khúc đã biên dịch, dạng mảng NumPy cho calculate_prices()"""
+        if self._arrays is None:
+            self._arrays = {
+                "from_km": np.array(self._from_km, dtype=float),
+                "starts": np.array(self._starts, dtype=float),
+                "ends": np.array(self._ends, dtype=float),
+                "rates": np.array(self._rates, dtype=float),
+                "breakpoints": np.array(self._breakpoints, dtype=float),
+                "price_at": np.array(self._price_at, dtype=float),
+                "slope": np.array(self._slope, dtype=float)
+            }
+        return self._arrays
+
+    def calculate_prices(self, distances_km, include_breakdown: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Bản mảng của calculate_price() cho nhiều khoảng cách trong 1 lượt NumPy
+        (backfill/định giá lại lịch sử trips, thử cấu hình what-if).
+        - total_price: cùng kết quả với calculate_price()["total_price"] (khoảng cách <= 0 -> base_price)
+        - valid: khoảng cách > 0
+        - tier_distances / tier_prices (nếu include_breakdown): ma trận (số chuyến x số bậc)
+        """
+        distances = np.asarray(distances_km, dtype=float)
+        valid = distances > 0
+        arrays = self._tier_arrays()
+        breakpoints = arrays["breakpoints"]
+
+        clipped = np.where(valid, distances, 0.0)
+        segment = np.searchsorted(breakpoints, clipped, side="right") - 1
+        total = self.base_price + arrays["price_at"][segment] + arrays["slope"][segment] * (clipped - breakpoints[segment])
+
+        result = {
+            "distance_km": distances,
+            "total_price": np.round(np.where(valid, total, self.base_price), 0),
+            "valid": valid
+        }
+        if include_breakdown:
+            column = clipped[:, None]
+            tier_distances = np.clip(np.minimum(arrays["ends"], column) - arrays["starts"], 0.0, None)
+            tier_distances[~(column > arrays["from_km"])] = 0.0
+            result["tier_distances"] = tier_distances
+            result["tier_prices"] = tier_distances * arrays["rates"]
+        return result
+
     def get_tier_info(self) -> List[Dict]:
         """Lấy thông tin các bậc giá"""
         return [
@@ -76,4 +149,47 @@ class TierPriceCalculator:
                 "description": tier.description
             }
             for tier in self.tiers
-        ]
\ No newline at end of file
+        ]
+
+
+class TierCalculatorCache:
+    """
+    Cache TierPriceCalculator đã biên dịch theo version cấu hình
+    (VD: version pricing snapshot, hoặc id + updated_at của tier config).
+    Key mới = cấu hình đã đổi -> biên dịch lại; giữ tối đa max_size bản (LRU).
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, TierPriceCalculator]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "compiles": 0}
+
+    def get(self, key: Hashable, base_price: float, tiers: List[Dict]) -> TierPriceCalculator:
+        with self._lock:
+            calculator = self._items.get(key)
+            if calculator is not None:
+                self._items.move_to_end(key)
+                self.stats_counters["hits"] += 1
+                return calculator
+
+        # Biên dịch ngoài lock (2 request cùng lúc có thể cùng biên dịch - kết quả như nhau)
+        calculator = TierPriceCalculator(base_price, tiers)
+        with self._lock:
+            self._items[key] = calculator
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            self.stats_counters["compiles"] += 1
+        return calculator
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> Dict:
+        return {**self.stats_counters, "size": len(self._items), "max_size": self.max_size}
+
+
+# Singleton instance
+tier_calculator_cache = TierCalculatorCache()
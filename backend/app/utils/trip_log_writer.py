@@ -0,0 +1,162 @@
+# backend/app/utils/trip_log_writer.py
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+from app.config.settings import settings
+from app.database.database import SessionLocal
+from app.models import models
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class TripLogWriter:
+    """
+    Ghi lịch sử chuyến đi (bảng trips) kiểu write-behind.
+    - Request chỉ đưa trip vào queue giới hạn kích thước, không chờ INSERT/commit
+    - 1 thread nền gom trip thành batch, ghi bằng multi-row INSERT trong 1 transaction
+    - Flush khi đủ batch_size hoặc sau flush_interval giây; khi tắt server ghi nốt phần còn lại
+    Chỉ 1 writer commit nên tránh được lỗi "database is locked" khi nhiều request cùng ghi.
+    """
+
+    def __init__(self, max_queue_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats_counters = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "dropped": 0,
+            "rejected_full": 0
+        }
+        self.last_flush_ms = None
+        self.last_error = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._thread = threading.Thread(target=self._run, name="trip-log-writer", daemon=True)
+        self._thread.start()
+        logger.info("📝 Trip log writer started (batch %s, interval %ss)", self.batch_size, self.flush_interval)
+
+    def stop(self, timeout: float = 10.0):
+        """Dừng thread sau khi ghi hết các trip còn trong queue"""
+        if not self.is_running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("⚠️ Trip log writer did not finish in %ss (%s trips pending)", timeout, self._queue.qsize())
+        else:
+            logger.info("📝 Trip log writer stopped (%s trips written)", self.stats_counters['written'])
+        self._thread = None
+
+    def submit(self, trip_data: Dict) -> bool:
+        """Đưa 1 trip vào queue. False nếu writer chưa chạy hoặc queue đầy (caller tự ghi đồng bộ)"""
+        if not self.is_running:
+            return False
+        row = dict(trip_data)
+        # Giữ thời điểm báo giá thay vì thời điểm flush
+        row.setdefault("created_at", datetime.now(timezone.utc).replace(tzinfo=None))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.stats_counters["rejected_full"] += 1
+            return False
+        self.stats_counters["enqueued"] += 1
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[Dict] = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if stopping:
+                # Lấy nốt các trip đã vào queue trước khi dừng
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                self._flush(batch[start:start + self.batch_size])
+
+    def _flush(self, rows: List[Dict]):
+        # Các trip có thể thiếu vài cột (VD: from_address) - chuẩn hóa để INSERT nhiều dòng cùng lúc
+        columns = set().union(*rows)
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                db.execute(insert(models.Trip), rows)
+                db.commit()
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+                self.stats_counters["written"] += len(rows)
+                self.stats_counters["batches"] += 1
+                return
+            except Exception as e:
+                db.rollback()
+                self.last_error = str(e)
+                if attempt < self.max_retries:
+                    self.stats_counters["retries"] += 1
+                    time.sleep(0.2 * (2 ** attempt))
+            finally:
+                db.close()
+
+        self.stats_counters["dropped"] += len(rows)
+        logger.error("❌ Trip log writer dropped %s trips: %s", len(rows), self.last_error)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            "running": self.is_running,
+            "pending": self._queue.qsize(),
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error
+        }
+
+
+# Singleton instance
+trip_log_writer = TripLogWriter(
+    max_queue_size=settings.TRIP_LOG_QUEUE_SIZE,
+    batch_size=settings.TRIP_LOG_BATCH_SIZE,
+    flush_interval=settings.TRIP_LOG_FLUSH_INTERVAL_SECONDS
+)
@@ -0,0 +1,167 @@
+# backend/app/utils/trip_repricing.py
+
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import models
+from app.utils.price_calculator import PriceCalculator
+from app.utils.tier_calculator import TierPriceCalculator
+
+logger = logging.getLogger(__name__)
+
+_TRIP_COLUMNS = (
+    models.Trip.id,
+    models.Trip.from_lat,
+    models.Trip.from_lng,
+    models.Trip.to_lat,
+    models.Trip.to_lng,
+    models.Trip.distance_km,
+    models.Trip.duration_minutes,
+    models.Trip.calculated_price,
+)
+
+
+def build_calculator(config_type: str, config: Dict):
+    """Calculator chỉ để tính giá (không gọi Google Maps)"""
+    if config_type == "tier":
+        return TierPriceCalculator(config["base_price"], config["tiers"])
+    return PriceCalculator(
+        base_price=config["base_price"],
+        price_per_km=config["price_per_km"],
+        min_price=config["min_price"],
+        max_price=config["max_price"],
+        use_google_maps=False
+    )
+
+
+def price_distances(calculator, distances: np.ndarray) -> np.ndarray:
+    """Giá cho cả cột khoảng cách (1 lượt NumPy)"""
+    if isinstance(calculator, TierPriceCalculator):
+        return calculator.calculate_prices(distances)["total_price"]
+    return calculator.calculate_prices(distances)["final_price"]
+
+
+def reprice_trips(db: Session, calculator, config_used: str, chunk_size: int = 50000,
+                  apply: bool = False, only_missing: bool = False, limit: Optional[int] = None) -> Dict:
+    """
+    Tính lại giá các trips đã lưu với 1 cấu hình giá, theo từng chunk (keyset theo id).
+    - Khoảng cách lấy từ distance_km; thiếu thì ước tính Haversine từ tọa độ (vector hóa)
+    - Bỏ qua các chuyến tính theo giá cố định
+    - apply=False: chỉ thống kê what-if (tổng giá cũ/mới, chênh lệch); apply=True: ghi lại giá mới
+    - old_total/new_total/delta_total chỉ tính trên các chuyến đã có giá cũ (so sánh cùng tập chuyến);
+      giá của các chuyến chưa có giá cũ cộng riêng vào backfilled_total
+    - only_missing=True: chỉ xử lý các chuyến chưa có calculated_price (backfill)
+    """
+    started = time.perf_counter()
+    summary = {
+        "config": config_used,
+        "apply": apply,
+        "only_missing": only_missing,
+        "scanned": 0,
+        "priced": 0,
+        "skipped_no_distance": 0,
+        "estimated_distance": 0,
+        "changed": 0,
+        "updated": 0,
+        "compared": 0,
+        "backfilled": 0,
+        "old_total": 0.0,
+        "new_total": 0.0,
+        "backfilled_total": 0.0,
+        "chunks": 0
+    }
+
+    query = select(*_TRIP_COLUMNS).where(
+        or_(models.Trip.config_used.is_(None), ~models.Trip.config_used.like("fixed_price:%"))
+    )
+    if only_missing:
+        query = query.where(models.Trip.calculated_price.is_(None))
+
+    last_id = 0
+    while limit is None or summary["scanned"] < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - summary["scanned"])
+        # Core (không qua ORM loading) - chỉ cần các cột số
+        rows = db.connection().execute(query.where(models.Trip.id > last_id).order_by(models.Trip.id).limit(size)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        summary["scanned"] += len(rows)
+        summary["chunks"] += 1
+
+        # None -> NaN khi đưa vào mảng float (Row -> tuple để NumPy không dò từng thuộc tính của Row)
+        data = np.array([tuple(row) for row in rows], dtype=float)
+        ids = data[:, 0].astype(np.int64)
+        coordinates = data[:, 1:5]
+        distances = data[:, 5].copy()
+        durations = data[:, 6].copy()
+        old_prices = data[:, 7]
+
+        # Chuyến thiếu khoảng cách nhưng có đủ tọa độ -> ước tính Haversine
+        estimate = ~(distances > 0) & ~np.isnan(coordinates).any(axis=1)
+        if estimate.any():
+            estimated = PriceCalculator.enhanced_haversine_arrays(*coordinates[estimate].T)
+            distances[estimate] = estimated["distance_km"]
+            durations[estimate] = estimated["duration_minutes"]
+            summary["estimated_distance"] += int(estimate.sum())
+
+        priced = distances > 0
+        summary["skipped_no_distance"] += int((~priced).sum())
+        if not priced.any():
+            continue
+
+        new_prices = price_distances(calculator, distances[priced])
+        previous = old_prices[priced]
+        changed = np.isnan(previous) | (np.abs(new_prices - previous) >= 1)
+        summary["priced"] += int(priced.sum())
+        summary["changed"] += int(changed.sum())
+        known = ~np.isnan(previous)
+        summary["compared"] += int(known.sum())
+        summary["backfilled"] += int((~known).sum())
+        summary["old_total"] += float(previous[known].sum())
+        summary["new_total"] += float(new_prices[known].sum())
+        summary["backfilled_total"] += float(new_prices[~known].sum())
+
+        if apply and changed.any():
+            estimated_rows = estimate[priced][changed]
+            params = [
+                {
+                    "id": int(trip_id),
+                    "calculated_price": float(price),
+                    "distance_km": float(distance),
+                    "duration_minutes": None if np.isnan(duration) else float(duration),
+                    "config_used": config_used
+                } if is_estimated else {
+                    "id": int(trip_id),
+                    "calculated_price": float(price),
+                    "config_used": config_used
+                }
+                for trip_id, price, distance, duration, is_estimated in zip(
+                    ids[priced][changed], new_prices[changed], distances[priced][changed],
+                    durations[priced][changed], estimated_rows
+                )
+            ]
+            # ORM bulk UPDATE theo khóa chính -> executemany, nhóm theo bộ cột giống nhau
+            for group in (
+                [p for p in params if "distance_km" in p],
+                [p for p in params if "distance_km" not in p]
+            ):
+                if group:
+                    db.execute(update(models.Trip), group)
+            db.commit()
+            summary["updated"] += len(params)
+
+    elapsed = time.perf_counter() - started
+    summary["old_total"] = round(summary["old_total"], 0)
+    summary["new_total"] = round(summary["new_total"], 0)
+    summary["backfilled_total"] = round(summary["backfilled_total"], 0)
+    summary["delta_total"] = round(summary["new_total"] - summary["old_total"], 0)
+    summary["elapsed_ms"] = round(elapsed * 1000, 1)
+    summary["rows_per_second"] = round(summary["scanned"] / elapsed) if elapsed > 0 else None
+    logger.info("💹 Repriced %s trips with %s (%s changed, %s updated) in %s ms",
+                summary["priced"], config_used, summary["changed"], summary["updated"], summary["elapsed_ms"])
+    return summary
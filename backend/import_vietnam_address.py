@@ -1,14 +1,38 @@
 #!/usr/bin/env python3
 """
 Script import dữ liệu tỉnh/huyện/xã từ district_ward.txt vào SQLite database
-Sử dụng: python import_vietnam_address.py district_ward.txt
+Sử dụng: python import_vietnam_address.py district_ward.txt [--db database/travel_calculator.db] [--prune]
+
+Import lại (VD: sau khi sáp nhập đơn vị hành chính) chỉ ghi các dòng mới/thay đổi,
+giữ nguyên id và tọa độ đã geocode.
 """
 
+import argparse
 import json
 import sqlite3
 import sys
 import os
-from datetime import datetime
+import time
+import urllib.request
+
+from app.utils.address_search_index import fts5_available, rebuild_address_search_index
+
+def notify_index_reload():
+    """
+    Báo server đang chạy build lại index tỉnh/huyện/xã trong memory.
+    Đặt ADDRESS_INDEX_RELOAD_URL, VD: http://127.0.0.1:8000/api/address/index/reload
+    """
+    reload_url = os.getenv("ADDRESS_INDEX_RELOAD_URL")
+    if not reload_url:
+        print("ℹ️ Server đang chạy cần gọi POST /api/address/index/reload để nạp dữ liệu mới")
+        return
+    try:
+        request = urllib.request.Request(reload_url, data=b"", method="POST")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            result = json.loads(response.read().decode("utf-8"))
+        print(f"🌳 Server đã nạp lại index: {result.get('counts')} trong {result.get('build_ms')} ms")
+    except Exception as e:
+        print(f"⚠️ Không gọi được {reload_url}: {e}")
 
 def create_address_tables(cursor):
     """Tạo các bảng address nếu chưa có"""
@@ -71,9 +95,105 @@ def create_address_tables(cursor):
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_ward_district ON wards(district_code)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_ward_province ON wards(province_code)')
 
-def import_district_ward_format(cursor, json_data):
+# Pragma chỉ dùng trong lúc import (cả import nằm trong 1 transaction, lỗi thì rollback toàn bộ)
+IMPORT_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",  # 64 MB
+)
+
+# Upsert theo code: chỉ ghi dòng mới hoặc dòng có tên/cấp cha thay đổi, không đụng tới tọa độ và id
+UPSERT_SQL = {
+    "province": '''
+        INSERT INTO provinces (code, name, full_name) VALUES (?, ?, ?)
+        ON CONFLICT(code) DO UPDATE SET name = excluded.name, full_name = excluded.full_name
+        WHERE provinces.name IS NOT excluded.name OR provinces.full_name IS NOT excluded.full_name
+    ''',
+    "district": '''
+        INSERT INTO districts (code, name, full_name, province_code) VALUES (?, ?, ?, ?)
+        ON CONFLICT(code) DO UPDATE SET name = excluded.name, full_name = excluded.full_name,
+            province_code = excluded.province_code
+        WHERE districts.name IS NOT excluded.name OR districts.full_name IS NOT excluded.full_name
+            OR districts.province_code IS NOT excluded.province_code
+    ''',
+    "ward": '''
+        INSERT INTO wards (code, name, full_name, district_code, province_code, division_type) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(code) DO UPDATE SET name = excluded.name, full_name = excluded.full_name,
+            district_code = excluded.district_code, province_code = excluded.province_code,
+            division_type = excluded.division_type
+        WHERE wards.name IS NOT excluded.name OR wards.full_name IS NOT excluded.full_name
+            OR wards.district_code IS NOT excluded.district_code OR wards.province_code IS NOT excluded.province_code
+            OR wards.division_type IS NOT excluded.division_type
+    ''',
+}
+
+LEVELS = ("province", "district", "ward")
+LEVEL_LABELS = {"province": "📍 Tỉnh/TP", "district": "🏘️ Quận/Huyện", "ward": "🏠 Phường/Xã"}
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """
+    Đọc lần lượt từng phần tử của mảng JSON ngoài cùng (mỗi phần tử là 1 tỉnh kèm huyện/xã)
+    mà không nạp cả file: chỉ giữ trong bộ nhớ phần tử đang đọc dở.
     """
-    Import từ format district_ward.txt:
+    decoder = json.JSONDecoder()
+    buffer, eof, started = "", False, False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer:
+            if not started:
+                if buffer[0] != "[":
+                    raise ValueError("Format dữ liệu không đúng. Cần là array của provinces")
+                buffer, started = buffer[1:], True
+                continue
+            if buffer[0] == "]":
+                return
+            if buffer[0] == ",":
+                buffer = buffer[1:]
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        if eof:
+            raise ValueError("File JSON bị cắt cụt (thiếu ']')")
+        # Phần tử lớn: đọc thêm ít nhất bằng phần đang có để số lần parse lại không tăng theo bình phương
+        chunk = stream.read(max(chunk_size, len(buffer)))
+        eof = not chunk
+        buffer += chunk
+
+class BatchWriter:
+    """Gom dòng theo bảng, ghi bằng executemany mỗi batch_size dòng"""
+    
+    def __init__(self, conn, sql, batch_size):
+        self.conn = conn
+        self.sql = sql
+        self.batch_size = batch_size
+        self.rows = []
+        self.seen = 0
+        self.written = 0  # Dòng thực sự được insert/update
+    
+    def add(self, row):
+        self.rows.append(row)
+        self.seen += 1
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        if not self.rows:
+            return
+        before = self.conn.total_changes
+        self.conn.executemany(self.sql, self.rows)
+        self.written += self.conn.total_changes - before
+        self.rows = []
+
+def import_district_ward_format(conn, stream, batch_size=5000, prune=False):
+    """
+    Import từ format district_ward.txt (upsert theo code, đọc dạng stream):
     [
       {
         "name": "Thành phố Hà Nội",
@@ -101,89 +221,83 @@ def import_district_ward_format(cursor, json_data):
         ]
       }
     ]
+    prune=True: xóa các đơn vị không còn trong file (sau khi sáp nhập/giải thể).
+    Trả về thống kê theo cấp: seen, inserted, updated, unchanged, deleted.
     """
+    counts_before = {level: conn.execute(f"SELECT COUNT(*) FROM {level}s").fetchone()[0] for level in LEVELS}
+    writers = {level: BatchWriter(conn, UPSERT_SQL[level], batch_size) for level in LEVELS}
+    seen_codes = {level: [] for level in LEVELS} if prune else None
     
-    provinces_count = 0
-    districts_count = 0
-    wards_count = 0
-    
-    for province_data in json_data:
-        try:
-            province_code = str(province_data.get('code'))
-            province_name = province_data.get('name', '')
-            
-            # Insert province
-            cursor.execute('''
-                INSERT OR REPLACE INTO provinces (code, name, full_name)
-                VALUES (?, ?, ?)
-            ''', (
-                province_code,
-                province_name,
-                province_name  # full_name = name for now
-            ))
-            provinces_count += 1
-            
-            print(f"✅ Province: {province_name} (code: {province_code})")
+    for index, province_data in enumerate(iter_json_array(stream)):
+        if index == 0 and not all(key in province_data for key in ("name", "code", "districts")):
+            raise ValueError("Format dữ liệu không đúng. Thiếu các field: name, code, districts")
+        
+        province_code = str(province_data.get('code'))
+        province_name = province_data.get('name', '')
+        writers["province"].add((province_code, province_name, province_name))  # full_name = name for now
+        
+        for district_data in province_data.get('districts', []):
+            district_code = str(district_data.get('code'))
+            district_name = district_data.get('name', '')
+            writers["district"].add((district_code, district_name, district_name, province_code))
             
-            # Process districts
-            for district_data in province_data.get('districts', []):
-                try:
-                    district_code = str(district_data.get('code'))
-                    district_name = district_data.get('name', '')
-                    
-                    # Insert district
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO districts (code, name, full_name, province_code)
-                        VALUES (?, ?, ?, ?)
-                    ''', (
-                        district_code,
-                        district_name,
-                        district_name,  # full_name = name for now
-                        province_code
-                    ))
-                    districts_count += 1
-                    
-                    # Process wards
-                    for ward_data in district_data.get('wards', []):
-                        try:
-                            ward_code = str(ward_data.get('code'))
-                            ward_name = ward_data.get('name', '')
-                            division_type = ward_data.get('division_type', '')
-                            
-                            # Insert ward
-                            cursor.execute('''
-                                INSERT OR REPLACE INTO wards (code, name, full_name, district_code, province_code, division_type)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            ''', (
-                                ward_code,
-                                ward_name,
-                                ward_name,  # full_name = name for now
-                                district_code,
-                                province_code,
-                                division_type
-                            ))
-                            wards_count += 1
-                            
-                        except Exception as e:
-                            print(f"❌ Lỗi import ward {ward_data.get('name', 'Unknown')}: {e}")
-                            
-                except Exception as e:
-                    print(f"❌ Lỗi import district {district_data.get('name', 'Unknown')}: {e}")
-                    
-        except Exception as e:
-            print(f"❌ Lỗi import province {province_data.get('name', 'Unknown')}: {e}")
+            for ward_data in district_data.get('wards', []):
+                ward_name = ward_data.get('name', '')
+                writers["ward"].add((
+                    str(ward_data.get('code')), ward_name, ward_name,
+                    district_code, province_code, ward_data.get('division_type', '')
+                ))
+                if prune:
+                    seen_codes["ward"].append(str(ward_data.get('code')))
+            if prune:
+                seen_codes["district"].append(district_code)
+        if prune:
+            seen_codes["province"].append(province_code)
     
-    return provinces_count, districts_count, wards_count
+    for writer in writers.values():
+        writer.flush()
+    
+    stats = {}
+    for level in LEVELS:
+        writer = writers[level]
+        inserted = conn.execute(f"SELECT COUNT(*) FROM {level}s").fetchone()[0] - counts_before[level]
+        stats[level] = {
+            "seen": writer.seen,
+            "inserted": inserted,
+            "updated": writer.written - inserted,
+            "unchanged": writer.seen - writer.written,
+            "deleted": 0
+        }
+    
+    if not writers["province"].seen:
+        raise ValueError("File dữ liệu trống")
+    
+    if prune:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_seen_codes (level TEXT, code TEXT, PRIMARY KEY (level, code))")
+        conn.execute("DELETE FROM import_seen_codes")
+        for level in LEVELS:
+            conn.executemany("INSERT OR IGNORE INTO import_seen_codes VALUES (?, ?)",
+                             ((level, code) for code in seen_codes[level]))
+            stats[level]["deleted"] = conn.execute(
+                f"DELETE FROM {level}s WHERE code NOT IN (SELECT code FROM import_seen_codes WHERE level = ?)",
+                (level,)
+            ).rowcount
+    
+    return stats
 
 def main():
-    if len(sys.argv) != 2:
-        print("❌ Sử dụng: python import_vietnam_address.py <path_to_district_ward.txt>")
-        print("   Ví dụ: python import_vietnam_address.py district_ward.txt")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Import tỉnh/huyện/xã từ district_ward.txt (upsert, giữ nguyên tọa độ)")
+    parser.add_argument("json_file", help="Đường dẫn tới district_ward.txt")
+    parser.add_argument("--db", default='/var/www/travel-booking/database/travel_calculator.db',
+                        help="Đường dẫn SQLite (VD: database/travel_calculator.db)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Số dòng mỗi lần executemany")
+    parser.add_argument("--prune", action="store_true",
+                        help="Xóa tỉnh/huyện/xã không còn trong file (cẩn thận: giá cố định đang trỏ tới ID cũ)")
+    parser.add_argument("--force-reindex", action="store_true", help="Dựng lại index FTS5 kể cả khi dữ liệu không đổi")
+    args = parser.parse_args()
     
-    json_file = sys.argv[1]
-    db_path = '/var/www/travel-booking/database/travel_calculator.db'
-    #db_path = 'database/travel_calculator.db'
+    json_file = args.json_file
+    db_path = args.db
     
     # Kiểm tra file JSON
     if not os.path.exists(json_file):
@@ -197,81 +311,84 @@ def main():
         sys.exit(1)
     
     print(f"📂 Đang đọc file: {json_file}")
-    
-    try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-    except Exception as e:
-        print(f"❌ Lỗi đọc file JSON: {e}")
-        sys.exit(1)
-    
-    # Kiểm tra format dữ liệu
-    if not isinstance(json_data, list):
-        print("❌ Format dữ liệu không đúng. Cần là array của provinces")
-        sys.exit(1)
-    
-    if len(json_data) == 0:
-        print("❌ File dữ liệu trống")
-        sys.exit(1)
-    
-    # Kiểm tra sample data
-    sample = json_data[0]
-    if not all(key in sample for key in ['name', 'code', 'districts']):
-        print("❌ Format dữ liệu không đúng. Thiếu các field: name, code, districts")
-        sys.exit(1)
-    
-    print(f"📊 Tìm thấy {len(json_data)} tỉnh/thành phố trong file")
     print(f"🗄️ Kết nối database: {db_path}")
     
-    # Kết nối database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    # isolation_level=None: tự quản lý transaction (BEGIN ... COMMIT)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    timings = {}
+    started = time.perf_counter()
     
     try:
+        for pragma in IMPORT_PRAGMAS:
+            conn.execute(pragma)
+        
         print("🔧 Tạo bảng address...")
-        create_address_tables(cursor)
+        create_address_tables(conn.cursor())
         
         print("📥 Bắt đầu import dữ liệu...")
+        phase = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                stats = import_district_ward_format(conn, f, batch_size=args.batch_size, prune=args.prune)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        timings["import"] = time.perf_counter() - phase
+        
+        changed = sum(level_stats[key] for level_stats in stats.values() for key in ("inserted", "updated", "deleted"))
         
-        # Import dữ liệu
-        provinces_count, districts_count, wards_count = import_district_ward_format(cursor, json_data)
+        # Dựng lại index tìm kiếm FTS5 cho /api/address/search
+        if not changed and not args.force_reindex:
+            print("ℹ️ Dữ liệu không thay đổi - bỏ qua dựng lại index")
+        elif fts5_available(conn):
+            print("🔎 Dựng index tìm kiếm địa chỉ (FTS5)...")
+            phase = time.perf_counter()
+            conn.execute("BEGIN")
+            index_result = rebuild_address_search_index(conn)
+            if conn.in_transaction:
+                conn.execute("COMMIT")
+            timings["fts_index"] = time.perf_counter() - phase
+            print(f"   ✓ {index_result['rows']} dòng trong {index_result['elapsed_ms']} ms")
+        else:
+            print("⚠️ SQLite không hỗ trợ FTS5 - /api/address/search sẽ dùng LIKE")
         
-        conn.commit()
+        if changed:
+            notify_index_reload()
+        timings["total"] = time.perf_counter() - started
         
         print("\n" + "="*50)
         print("✅ IMPORT THÀNH CÔNG!")
-        print(f"   📍 Tỉnh/TP: {provinces_count}")
-        print(f"   🏘️ Quận/Huyện: {districts_count}")  
-        print(f"   🏠 Phường/Xã: {wards_count}")
+        for level in LEVELS:
+            level_stats = stats[level]
+            print(f"   {LEVEL_LABELS[level]}: {level_stats['seen']} trong file | "
+                  f"+{level_stats['inserted']} mới, ~{level_stats['updated']} đổi, "
+                  f"={level_stats['unchanged']} giữ nguyên, -{level_stats['deleted']} xóa")
         
-        # Verify data
-        cursor.execute("SELECT COUNT(*) FROM provinces")
-        total_provinces = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM districts") 
-        total_districts = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM wards")
-        total_wards = cursor.fetchone()[0]
+        total_rows = sum(level_stats["seen"] for level_stats in stats.values())
+        print(f"\n⏱️ Thời gian:")
+        print(f"   Đọc + ghi: {timings['import'] * 1000:.0f} ms ({total_rows / timings['import']:.0f} dòng/s)")
+        if "fts_index" in timings:
+            print(f"   Index FTS5: {timings['fts_index'] * 1000:.0f} ms")
+        print(f"   Tổng: {timings['total'] * 1000:.0f} ms")
         
+        # Verify data
         print(f"\n📊 Tổng trong database:")
-        print(f"   📍 Tỉnh/TP: {total_provinces}")
-        print(f"   🏘️ Quận/Huyện: {total_districts}")
-        print(f"   🏠 Phường/Xã: {total_wards}")
-        
-        # Hiển thị sample data
-        print(f"\n🔍 Sample dữ liệu:")
-        cursor.execute("SELECT name FROM provinces LIMIT 5")
-        provinces_sample = cursor.fetchall()
-        for p in provinces_sample:
-            print(f"   • {p[0]}")
+        for level in LEVELS:
+            total = conn.execute(f"SELECT COUNT(*) FROM {level}s").fetchone()[0]
+            with_coordinates = conn.execute(
+                f"SELECT COUNT(*) FROM {level}s WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+            ).fetchone()[0]
+            print(f"   {LEVEL_LABELS[level]}: {total} ({with_coordinates} có tọa độ)")
         
         print(f"\n🎉 Hoàn thành! Bạn có thể sử dụng AddressSelector component.")
         
     except Exception as e:
         print(f"❌ Lỗi import: {e}")
-        conn.rollback()
         sys.exit(1)
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
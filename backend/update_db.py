@@ -8,6 +8,7 @@ sys.path.insert(0, app_dir)
 
 from app.database.database import engine, create_tables, DATABASE_PATH
 from app.models.models import Base, Booking, Customer, Settings, PriceConfig
+from app.database.migrations import migrate_fixed_price_routes
 from sqlalchemy.orm import sessionmaker
 
 def update_database():
@@ -20,6 +21,9 @@ def update_database():
         Base.metadata.create_all(bind=engine)
         print("✓ Đã tạo/cập nhật các bảng database")
         
+        # Cột địa chỉ chuẩn hóa + index cho bảng giá cố định
+        migrate_fixed_price_routes(engine)
+        
         # Thêm dữ liệu mặc định cho vehicle types
         SessionLocal = sessionmaker(bind=engine)
         db = SessionLocal()